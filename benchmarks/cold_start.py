@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+r"""Measure the cold-start cost of bluing step by step.
+
+Where startup.py times whole commands, this suite times each heavy step on
+its own, every run in a fresh interpreter so that nothing is warm:
+
+    import      `import bluing` and each of its subpackages
+    table       loading each assigned numbers table, from the bundle and
+                from its text file
+    cmdline     docopt parsing in each `ui.parse_cmdline()`, with arguments
+                that do not touch an HCI device
+    scanner     `BlueScanner.__init__()` against a fake HCI
+
+Usage:
+    python benchmarks/cold_start.py [--repeat=<n>] [--filter=<str>] [--json=<file>]
+                                    [--compare=<file>]
+
+The JSON file records the Python version and the git revision, and can be
+given to --compare by a later run to see what regressed.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC_ROOT = ROOT/'src'
+
+# Run in the child: `setup` is not timed, `stmt` is. A step that exits (e.g.
+# parse_cmdline() on an error) is still timed, its exit code is recorded.
+RUNNER = r'''
+import sys, json, time
+case = json.loads(sys.argv[1])
+ns = {}
+exec(case['setup'], ns)
+exit_code = 0
+start = time.perf_counter()
+try:
+    exec(case['stmt'], ns)
+except SystemExit as e:
+    exit_code = e.code if isinstance(e.code, int) else 1
+elapsed = time.perf_counter() - start
+sys.stdout.flush()
+sys.__stdout__.write('\n' + json.dumps({'ms': elapsed * 1000, 'exit_code': exit_code}) + '\n')
+'''
+
+IMPORTS = [
+    'bluing',
+    'bluing.common',
+    'bluing.br',
+    'bluing.br.br_scan',
+    'bluing.le',
+    'bluing.le.le_scan',
+    'bluing.le.gatt_scan',
+    'bluing.android',
+    'bluing.spoof',
+    'bluing.plugin',
+    'bluing.service_record',
+]
+
+# assigned_numbers only needs the standard library, it is loaded as a
+# top-level module so that `import bluing` is not part of the measure.
+TABLE_SETUP = "import sys; sys.path.insert(0, {!r}); import assigned_numbers".format(
+    str(SRC_ROOT/'bluing'))
+TABLES = [
+    'oui',
+    'oui28',
+    'oui36',
+    'company-identifiers',
+    'gatt-services',
+    'gatt-characteristics',
+    'gatt-descriptors',
+    'gatt-declarations',
+    'service-class-profile-ids',
+    'protocol-ids',
+]
+
+# module: argv of parse_cmdline() not requiring an HCI device
+CMDLINES = {
+    'bluing.ui': ['--flash-micro-bit'],
+    'bluing.br.ui': ['--org=Apple', '--timeout=10', '--sniff-and-guess-bd-addr'],
+    'bluing.le.ui': ['--sniff-adv'],
+    'bluing.spoof.ui': ['--host-name=bluing'],
+    'bluing.android.ui': ['--collect-btsnoop-log'],
+    'bluing.plugin.ui': ['list'],
+    'bluing.plugin.list.ui': [],
+    'bluing.plugin.install.ui': ['bluing-plugin.whl'],
+    'bluing.plugin.run.ui': ['bluing-plugin'],
+    'bluing.plugin.uninstall.ui': ['bluing-plugin'],
+}
+
+FAKE_HCI_SETUP = r'''
+import bluing
+from bthci import ControllerErrorCodes
+
+class FakeCmdComplete:
+    status = ControllerErrorCodes.SUCCESS
+    bd_addr = '00:11:22:33:44:55'
+
+class FakeHCI:
+    def __init__(self, iface, *args):
+        pass
+
+    @staticmethod
+    def hcistr2devid(iface):
+        return int(iface.removeprefix('hci'))
+
+    def read_bd_addr(self):
+        return FakeCmdComplete()
+
+    def close(self):
+        pass
+
+bluing.HCI = FakeHCI
+'''
+
+
+def cases() -> list[dict]:
+    cases = []
+    for module in IMPORTS:
+        cases.append({'group': 'import', 'name': module,
+                      'setup': '', 'stmt': 'import ' + module})
+
+    for table in TABLES:
+        cases.append({'group': 'table', 'name': table + ' (bundle)', 'setup': TABLE_SETUP,
+                      'stmt': 'assigned_numbers.load_table({!r})'.format(table)})
+        cases.append({'group': 'table', 'name': table + ' (text)', 'setup': TABLE_SETUP,
+                      'stmt': 'assigned_numbers.parse_text_table({!r})'.format(table)})
+
+    for module, argv in CMDLINES.items():
+        cases.append({'group': 'cmdline', 'name': module,
+                      'setup': 'from {} import parse_cmdline'.format(module),
+                      'stmt': 'parse_cmdline({!r})'.format(argv)})
+
+    cases.append({'group': 'scanner', 'name': 'BlueScanner.__init__',
+                  'setup': FAKE_HCI_SETUP, 'stmt': "bluing.BlueScanner('hci0')"})
+
+    return cases
+
+
+def run_once(case: dict) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SRC_ROOT), env.get('PYTHONPATH')]))
+
+    proc = subprocess.run([sys.executable, '-c', RUNNER, json.dumps(case)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    lines = proc.stdout.decode(errors='replace').strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        # The setup failed, e.g. a dependency is not installed
+        err = proc.stderr.decode(errors='replace').strip().splitlines()
+        return {'ms': None, 'exit_code': proc.returncode, 'error': err[-1] if err else ''}
+
+
+def bench(repeat: int, filter: str = None) -> list[dict]:
+    results = []
+    for case in cases():
+        name = '{}: {}'.format(case['group'], case['name'])
+        if filter and filter not in name:
+            continue
+
+        runs = [run_once(case) for _ in range(repeat)]
+        times = [r['ms'] for r in runs if r['ms'] is not None]
+        result = {
+            'group': case['group'],
+            'name': case['name'],
+            'median_ms': median(times) if times else None,
+            'min_ms': min(times) if times else None,
+            'exit_code': runs[-1]['exit_code'],
+        }
+        if 'error' in runs[-1]:
+            result['error'] = runs[-1]['error']
+        results.append(result)
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[dict], baseline: dict = None):
+    print("{:<8} {:<40} {:>10} {:>10} {:>5} {:>9}".format(
+        'group', 'step', 'median ms', 'min ms', 'exit', 'vs base'))
+    for r in results:
+        if r['median_ms'] is None:
+            print("{:<8} {:<40} {}".format(r['group'], r['name'], r.get('error', 'failed')))
+            continue
+
+        delta = ''
+        base = baseline.get((r['group'], r['name'])) if baseline else None
+        if base:
+            delta = '{:+.0f}%'.format((r['median_ms'] - base) / base * 100)
+
+        print("{:<8} {:<40} {:>10.2f} {:>10.2f} {:>5} {:>9}".format(
+            r['group'], r['name'], r['median_ms'], r['min_ms'], r['exit_code'], delta))
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        return {(r['group'], r['name']): r['median_ms'] for r in json.load(f)['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the steps of bluing")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per step, the median is reported")
+    parser.add_argument('--filter', help="Only run the steps whose '<group>: <name>' contains it")
+    parser.add_argument('--json', metavar='FILE', help="Also write the results to a JSON file")
+    parser.add_argument('--compare', metavar='FILE', help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare) if args.compare else None
+    results = bench(args.repeat, args.filter)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'revision': git_revision(), 'repeat': args.repeat,
+                       'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+r"""Measure the memory held per LE device by a scan result.
+
+A synthetic population of advertisers is decoded into the records of a
+bounded scan (LeDeviceInfo) and of a continuous one (LeDeviceTable entries),
+and tracemalloc gives the bytes still allocated per device. Each record is
+measured twice:
+
+    before    the previous layout, replicated below: a LeDeviceInfo with a
+              __dict__ and a list of AD structures, an entry with a dict of
+              AD structures, and one AdRecord per device and AD structure
+    after     the current one: slotted records holding interned tuples of
+              interned AdRecords
+
+The population mixes the beacons a crowded place is full of: a few iBeacon
+payloads repeated by many devices, Apple Continuity messages unique to each
+device, and named sensors.
+
+Usage:
+    python benchmarks/memory.py [--devs=<n>] [--seed=<n>] [--json=<file>]
+"""
+
+import sys
+import json
+import random
+import argparse
+import tracemalloc
+from pathlib import Path
+
+
+SRC_ROOT = Path(__file__).resolve().parent.parent/'src'
+sys.path.insert(0, str(SRC_ROOT))
+
+from bluing.gap_data import AdRecord, decode_ad_structs, intern_ad_structs
+from bluing.le.le_scan import LeDeviceInfo
+from bluing.le.device_table import LeDeviceTable
+
+
+FLAGS = b'\x02\x01\x06'
+APPLE = b'\x4c\x00'
+NUM_IBEACONS = 20
+NUM_SENSOR_NAMES = 50
+
+
+def population(num_devs: int, seed: int) -> list[tuple[str, bytes]]:
+    """Return (addr, AdvData) of num_devs devices, every AdvData a distinct
+    bytes object as if just read from the HCI socket."""
+    rand = random.Random(seed)
+    ibeacons = [b'\x1a\xff' + APPLE + b'\x02\x15' + rand.randbytes(16 + 4) + b'\xc5'
+                for _ in range(NUM_IBEACONS)]
+
+    devs = []
+    for i in range(num_devs):
+        addr = ':'.join('{:02X}'.format(b) for b in rand.randbytes(6))
+        kind = rand.random()
+        if kind < 0.5:
+            data = FLAGS + rand.choice(ibeacons)
+        elif kind < 0.85:
+            data = FLAGS + b'\x0a\xff' + APPLE + b'\x10\x05' + rand.randbytes(4)
+        else:
+            name = 'Sensor-{}'.format(rand.randrange(NUM_SENSOR_NAMES)).encode()
+            data = FLAGS + bytes([len(name) + 1, 0x09]) + name + b'\x03\x03\x0f\x18'
+        devs.append((addr, bytes(bytearray(data))))
+    return devs
+
+
+def legacy_decode_ad_structs(data: bytes) -> list[AdRecord]:
+    view = memoryview(data)
+    records = []
+    offset = 0
+    while offset < len(view):
+        length = view[offset]
+        if length == 0 or offset + 1 + length > len(view):
+            break
+        records.append(AdRecord(view[offset+1], view[offset+2:offset+1+length]))
+        offset += 1 + length
+    return records
+
+
+class LegacyLeDeviceInfo:
+    def __init__(self, addr: str, addr_type: str, connectable : bool, rssi : int,
+                 adapters: dict = None, identity=None) -> None:
+        self.addr = addr.upper()
+        self.addr_type = addr_type
+        self.connectable = connectable
+        self.rssi = rssi
+        self.adapters = {} if adapters is None else adapters
+        self.identity = identity
+        self.cluster = None
+        self.ad_structs = []
+
+    def add_ad_structs(self, ad: AdRecord):
+        self.ad_structs.append(ad)
+
+
+class LegacyLeDeviceEntry:
+    __slots__ = ('addr', 'addr_type', 'connectable', 'rssi', 'ads', 'adapters',
+                 'identity', 'cluster', 'first_seen', 'last_seen', 'update_count')
+
+    def __init__(self, addr: str, addr_type: str, now: float):
+        self.addr = addr
+        self.addr_type = addr_type
+        self.connectable = False
+        self.rssi = None
+        self.ads = {}
+        self.adapters = {}
+        self.identity = None
+        self.cluster = None
+        self.first_seen = self.last_seen = now
+        self.update_count = 0
+
+
+def info_before(devs):
+    infos = []
+    for addr, data in devs:
+        info = LegacyLeDeviceInfo(addr, 'random', True, -60)
+        for ad in legacy_decode_ad_structs(data):
+            info.add_ad_structs(ad)
+        infos.append(info)
+    return infos
+
+
+def info_after(devs):
+    infos = []
+    for addr, data in devs:
+        info = LeDeviceInfo(addr, 'random', True, -60)
+        info.ad_structs = intern_ad_structs(decode_ad_structs(data))
+        infos.append(info)
+    return infos
+
+
+def entry_before(devs):
+    entries = {}
+    for addr, data in devs:
+        entry = entries[addr] = LegacyLeDeviceEntry(addr, 'random', 0.0)
+        entry.connectable = True
+        entry.rssi = -60
+        entry.adapters['hci0'] = -60
+        entry.update_count += 1
+        for ad in legacy_decode_ad_structs(data):
+            entry.ads[ad.type] = ad
+    return entries
+
+
+def entry_after(devs):
+    table = LeDeviceTable(sys.maxsize, float('inf'))
+    for addr, data in devs:
+        table.update(addr, 'random', True, -60, decode_ad_structs(data), 'hci0', 0.0)
+    return table
+
+
+CASES = [
+    ('LeDeviceInfo', 'before', info_before),
+    ('LeDeviceInfo', 'after', info_after),
+    ('LeDeviceTable entry', 'before', entry_before),
+    ('LeDeviceTable entry', 'after', entry_after),
+]
+
+
+def measure(build, devs) -> int:
+    """Return the bytes still allocated by build(devs)."""
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        kept = build(devs)
+        size = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per LE device of the scan results")
+    parser.add_argument('--devs', type=int, default=100000, help="Number of devices")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the population")
+    parser.add_argument('--json', metavar='FILE', help="Also write the results to a JSON file")
+    args = parser.parse_args()
+
+    devs = population(args.devs, args.seed)
+
+    results = []
+    print("{:<20} {:<7} {:>14} {:>12}".format('record', 'layout', 'bytes/device', 'vs before'))
+    for record, layout, build in CASES:
+        per_dev = measure(build, devs) / len(devs)
+        before = next((r['bytes_per_dev'] for r in results
+                       if r['record'] == record and r['layout'] == 'before'), None)
+        results.append({'record': record, 'layout': layout, 'bytes_per_dev': per_dev})
+        print("{:<20} {:<7} {:>14.0f} {:>12}".format(
+            record, layout, per_dev, '' if before is None else '{:+.0f}%'.format(
+                (per_dev - before) / before * 100)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'devs': args.devs, 'seed': args.seed,
+                       'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+r"""Measure the cold-start cost of every bluing subcommand.
+
+Each command is run as `python -X importtime -m bluing <command> --help` in a
+fresh process. For each of them the wall time, the total import time reported
+by `-X importtime` and the peak RSS of the child process are recorded.
+
+Usage:
+    python benchmarks/startup.py [--repeat=<n>] [--json=<file>]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from statistics import median
+from pathlib import Path
+
+
+SRC_ROOT = Path(__file__).resolve().parent.parent/'src'
+
+COMMANDS = [
+    [],
+    ['br'],
+    ['le'],
+    ['android'],
+    ['discover'],
+    ['spoof'],
+    ['plugin'],
+    ['plugin', 'list'],
+    ['plugin', 'install'],
+    ['plugin', 'uninstall'],
+    ['plugin', 'run'],
+]
+
+
+def parse_importtime(stderr: str) -> int:
+    """Return the total import time (us) of all top-level imports.
+
+    Lines of `-X importtime` look like:
+        import time:       self [us] | cumulative | imported package
+        import time:        93 |        93 |   _io
+    Nested imports are indented, so only unindented ones are summed.
+    """
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if fields[2].startswith('  '):
+            continue
+        total += int(fields[1])
+    return total
+
+
+def run_once(cmd: list[str]) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SRC_ROOT), env.get('PYTHONPATH')]))
+
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-m', 'bluing'] + cmd + ['--help'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    stderr = proc.stderr.read()
+    # os.wait4() gives the resource usage of this very child, unlike
+    # getrusage(RUSAGE_CHILDREN) which accumulates over all of them.
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return {
+        'exit_code': proc.returncode,
+        'wall_ms': elapsed * 1000,
+        'import_ms': parse_importtime(stderr.decode(errors='replace')) / 1000,
+        'max_rss_kb': rusage.ru_maxrss,
+    }
+
+
+def bench(repeat: int) -> list[dict]:
+    results = []
+    for cmd in COMMANDS:
+        runs = [run_once(cmd) for _ in range(repeat)]
+        results.append({
+            'command': ' '.join(['bluing'] + cmd + ['--help']),
+            'exit_code': runs[-1]['exit_code'],
+            'wall_ms': median(r['wall_ms'] for r in runs),
+            'import_ms': median(r['import_ms'] for r in runs),
+            'max_rss_kb': max(r['max_rss_kb'] for r in runs),
+        })
+    return results
+
+
+def print_results(results: list[dict]):
+    print("{:<36} {:>10} {:>10} {:>12} {:>5}".format(
+        'command', 'wall ms', 'import ms', 'max RSS KiB', 'exit'))
+    for r in results:
+        print("{:<36} {:>10.1f} {:>10.1f} {:>12} {:>5}".format(
+            r['command'], r['wall_ms'], r['import_ms'], r['max_rss_kb'], r['exit_code']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of bluing subcommands")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per command, the median is reported")
+    parser.add_argument('--json', metavar='FILE', help="Also write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = bench(args.repeat)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'repeat': args.repeat, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
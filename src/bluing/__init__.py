@@ -14,49 +14,16 @@ LOG_LEVEL = locals_dict['LOG_LEVEL']
 VERSION_STR = locals_dict['VERSION_STR']
 
 
-import io
+import os
 from pathlib import Path
-import pkg_resources
 
 from bthci import HCI, ControllerErrorCodes
 
 
 PKG_ROOT = Path(__file__).parent
 MICRO_BIT_FIRMWARE_PATH = PKG_ROOT/'res'/'micro-bit.hex'
-
-# https://www.bluetooth.com/specifications/assigned-numbers/service-discovery/
-#     Table 2: Service Class Profile Identifiers
-#
-#     For historical reasons, some UUIDs in Table 2 are used to identify 
-#     profiles in a BluetoothProfileDescriptorList universal attribute as well 
-#     as service classes in a ServiceClassIDList universal attribute. However, 
-#     for new profiles, Service Class UUIDs shall not be used in a 
-#     BluetoothProfileDescriptorList universal attribute and Profile UUIDs 
-#     shall not be used in a ServiceClassIDList universal attribute.
-#
-# Include both service class UUID (32-bit) and profile UUID (32-bit), and other
-# information. 
-service_cls_profile_ids_file = pkg_resources.resource_stream(__name__, 
-    'res/service-class-profile-ids.txt')
-service_cls_profile_ids_file = io.TextIOWrapper(
-    service_cls_profile_ids_file)
-service_cls_profile_ids = {}
-
-# 需要手动编辑的 Service Class 如下：
-#     IrMCSyncCommand
-#     Headset – HS
-# 同时注意去掉可能出现的 E2 80 8B
-for line in service_cls_profile_ids_file:
-    items = line.strip().split('\t')
-    if items[0] == 'Service Class Name':
-        continue
-    # print(items)
-    uuid = int(items.pop(1)[2:], base=16)
-    service_cls_profile_ids[uuid] = {
-        'Name': items[0],
-        'Specification': items[1],
-        'Allowed Usage': items[2]
-    }
+# Per-user writable, the installed package may be read-only
+CACHE_ROOT = Path(os.environ.get('XDG_CACHE_HOME') or Path.home()/'.cache')/PKG_NAME
 
 
 class BlueScanner():
@@ -81,9 +48,15 @@ class ScanResult:
         type - May be 'GATT', 'LE Devices', 'BR/EDR Devices' ...
         """
         self.type = type
+        # An ndjson.NdjsonWriter, the records are written to it as they are added
+        self.writer = None
 
     def store(self):
         pass
 
+    def emit(self, record: dict):
+        if self.writer is not None:
+            self.writer.write(record)
+
 
 __all__ = []
@@ -5,34 +5,44 @@ import sys
 from shutil import copy
 from subprocess import STDOUT, check_output
 from pathlib import Path
+from importlib import import_module
 
 from xpycommon.log import Logger
 from xpycommon.ui import red, blue
-from xpycommon.bluetooth.bluez import stop_bluetooth_service, \
-    restart_bluetooth_service
-
-from bthci import HCI
 
 from . import LOG_LEVEL, MICRO_BIT_FIRMWARE_PATH
 from .ui import parse_cmdline
-from .br import main as br_main
-from .le import main as le_main
-from .android import main as android_main
-from .spoof import main as spoof_main
-from .plugin import main as plugin_main
 
 
 logger = Logger(__name__, LOG_LEVEL)
+
+# Maps a command to the subpackage providing its main(). The subpackage is
+# only imported once the command is selected, so a command does not pay for
+# the dependencies and resource tables of all the others at startup.
 cmd_to_main = {
-    'br': br_main,
-    'le': le_main,
-    'android': android_main,
-    'spoof': spoof_main,
-    'plugin': plugin_main,
+    'br': '.br',
+    'le': '.le',
+    'discover': '.discover',
+    'android': '.android',
+    'spoof': '.spoof',
+    'plugin': '.plugin',
 }
 
 
+def load_cmd_main(cmd: str):
+    """Import the subpackage of a command and return its main().
+
+    Raise KeyError when the command is unknown.
+    """
+    return import_module(cmd_to_main[cmd], __package__).main
+
+
 def clean(iface: str, raddr: str):
+    # Only `--clean` needs BlueZ and the HCI, keep them out of the startup path.
+    from xpycommon.bluetooth.bluez import stop_bluetooth_service, \
+        restart_bluetooth_service
+    from bthci import HCI
+
     hci = HCI(iface)
     laddr = hci.bd_addr
     hci.close()
@@ -104,9 +114,11 @@ def main(argv: list[str] = sys.argv):
             argv = [cmd] + args['<args>']
 
             try:
-                cmd_to_main[cmd](argv)
+                cmd_main = load_cmd_main(cmd)
             except KeyError as e:
                 raise ValueError("Invalid command: " + red(args['<command>']))
+
+            cmd_main(argv)
     except Exception as e:
         logger.error("{}: \"{}\"".format(e.__class__.__name__, e))
         sys.exit(1)
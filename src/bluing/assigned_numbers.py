@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+r"""Assigned numbers tables (MA-L/MA-M/MA-S, company identifiers, UUIDs ...)
+
+The tables are kept as text files under res/. Parsing them on every startup
+costs tens of thousands of dict insertions, so they are also compiled into a
+single binary bundle, res/assigned-numbers.bin:
+
+    python src/bluing/assigned_numbers.py
+
+The bundle is memory-mapped and binary-searched on demand, which lets
+concurrent bluing processes share its pages. A table falls back to its text
+file when the bundle is missing, from another format version, or stale (the
+content of the text file differs from the one it was built from). The size
+and mtime of the text file recorded at build time tell it is unchanged
+without reading it; when only the mtime differs, e.g. after a checkout, the
+BLAKE2b digest of the file decides.
+
+This module only depends on the standard library, so that it can be run as a
+build step before bluing and its dependencies are installed.
+
+Bundle layout (native byte order):
+    Header     magic (8 B) | format version (2 B) | number of tables (2 B) | byte order (4 B)
+    Directory  per table: name (32 B) | source size (8 B) | source mtime (8 B, ns) |
+               source digest (16 B) | count (4 B) | keys offset (4 B) |
+               string offsets offset (4 B) | strings offset (4 B)
+    Per table  sorted 64-bit keys | count + 1 32-bit string offsets | UTF-8 strings
+               (the fields of a record are separated by 0x1F)
+"""
+
+import io
+import os
+import csv
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from collections.abc import Mapping
+
+
+RES_ROOT = Path(__file__).parent/'res'
+BUNDLE_PATH = RES_ROOT/'assigned-numbers.bin'
+
+BUNDLE_MAGIC = b'BLUINGAN'
+BUNDLE_FORMAT_VERSION = 2
+BUNDLE_BYTE_ORDERS = {'little': 1, 'big': 2}
+
+BUNDLE_HEADER = struct.Struct('=8sHHI')
+BUNDLE_DIR_ENTRY = struct.Struct('=32sQq16sIIII')
+SOURCE_DIGEST_SIZE = 16
+
+FIELD_SEP = '\x1f'
+
+
+def parse_oui(f: io.TextIOBase) -> dict:
+    """Parse the IEEE MA-L listing, e.g. `00-00-0C   (hex)\t\tCisco Systems, Inc`"""
+    table = {}
+    for line in f:
+        items = line.strip().split('\t\t')
+        if len(items) == 2 and '   (hex)' in items[0]:
+            company_id = items[0].removesuffix('   (hex)')
+            table[int(company_id.replace('-', ''), base=16)] = (items[1],)
+    return table
+
+
+def parse_oui_blocks(f: io.TextIOBase, prefix_len: int) -> dict:
+    """Parse the IEEE MA-M (28-bit) or MA-S (36-bit) listing, keyed by prefix.
+
+    An assignment is a 24-bit OUI followed by a range of the remaining bits:
+        70-B3-D5   (hex)\t\tKitron UAB
+        F6E000-F6EFFF     (base 16)\t\tKitron UAB
+    """
+    table = {}
+    oui = None
+    for line in f:
+        items = line.strip().split('\t\t')
+        if len(items) != 2:
+            continue
+        if '   (hex)' in items[0]:
+            oui = int(items[0].removesuffix('   (hex)').replace('-', ''), base=16)
+        elif '(base 16)' in items[0] and oui is not None:
+            low = int(items[0].split('-')[0], base=16)
+            table[(oui << (prefix_len - 24)) | (low >> (48 - prefix_len))] = (items[1],)
+    return table
+
+
+def parse_oui28(f: io.TextIOBase) -> dict:
+    return parse_oui_blocks(f, 28)
+
+
+def parse_oui36(f: io.TextIOBase) -> dict:
+    return parse_oui_blocks(f, 36)
+
+
+def parse_company_identifiers(f: io.TextIOBase) -> dict:
+    table = {}
+    for row in csv.DictReader(f):
+        table[int(row['Decimal'])] = (row['Company'],)
+    return table
+
+
+def parse_gatt_uuids(f: io.TextIOBase) -> dict:
+    """Name, Uniform Type Identifier, UUID and Specification separated by tabs"""
+    table = {}
+    for line in f:
+        items = line.strip().split('\t')
+        if len(items) < 4:
+            continue
+        uuid = int(items.pop(2), base=16)
+        table[uuid] = (items[0], items[1], items[2])
+    return table
+
+
+def parse_service_cls_profile_ids(f: io.TextIOBase) -> dict:
+    # 需要手动编辑的 Service Class 如下：
+    #     IrMCSyncCommand
+    #     Headset – HS
+    # 同时注意去掉可能出现的 E2 80 8B
+    table = {}
+    for line in f:
+        items = line.strip().split('\t')
+        if items[0] == 'Service Class Name':
+            continue
+        uuid = int(items.pop(1)[2:], base=16)
+        table[uuid] = (items[0], items[1], items[2])
+    return table
+
+
+def parse_protocol_ids(f: io.TextIOBase) -> dict:
+    table = {}
+    for line in f:
+        items = line.strip().split('\t')
+        if items[0] == 'Protocol Name':
+            continue
+        uuid = int(items.pop(1), base=16)
+        table[uuid] = (items[0], items[1])
+    return table
+
+
+# name: (source file, parser, field names)
+# A table without field names maps a key to a single string.
+TABLES = {
+    'oui': ('oui.txt', parse_oui, None),
+    'oui28': ('mam.txt', parse_oui28, None),
+    'oui36': ('oui36.txt', parse_oui36, None),
+    'company-identifiers': ('CompanyIdentfiers.csv', parse_company_identifiers, None),
+    'gatt-services': ('gatt-service-uuid.txt', parse_gatt_uuids,
+                      ('Name', 'Uniform Type Identifier', 'Specification')),
+    'gatt-characteristics': ('gatt-characteristic-uuid.txt', parse_gatt_uuids,
+                             ('Name', 'Uniform Type Identifier', 'Specification')),
+    'gatt-descriptors': ('gatt-descriptor-uuid.txt', parse_gatt_uuids,
+                         ('Name', 'Uniform Type Identifier', 'Specification')),
+    'gatt-declarations': ('gatt-declaration-uuid.txt', parse_gatt_uuids,
+                          ('Name', 'Uniform Type Identifier', 'Specification')),
+    'service-class-profile-ids': ('service-class-profile-ids.txt', parse_service_cls_profile_ids,
+                                  ('Name', 'Specification', 'Allowed Usage')),
+    'protocol-ids': ('sdp_ProfileDescriptorList_protocol_ids.txt', parse_protocol_ids,
+                     ('Name', 'spec')),
+}
+
+
+def _make_value(fields: tuple | None, items: tuple):
+    if fields is None:
+        return items[0]
+    else:
+        return dict(zip(fields, items))
+
+
+def parse_text_table(name: str) -> dict:
+    """Parse the text file of a table, return a dict of key -> record items.
+
+    Raise FileNotFoundError when the text file is absent.
+    """
+    file_name, parser, _ = TABLES[name]
+    with open(RES_ROOT/file_name, encoding='utf-8', newline='') as f:
+        return parser(f)
+
+
+class BundleTable(Mapping):
+    """A table of the memory-mapped bundle, looked up by binary search."""
+    def __init__(self, buf: memoryview, fields: tuple | None, count: int,
+                 keys_off: int, offs_off: int, strs_off: int):
+        self.fields = fields
+        self.keys = buf[keys_off:keys_off + 8*count].cast('Q')
+        self.offs = buf[offs_off:offs_off + 4*(count + 1)].cast('I')
+        self.strs = buf[strs_off:strs_off + self.offs[count]]
+
+    def __getitem__(self, key):
+        if type(key) is not int:
+            raise KeyError(key)
+
+        idx = bisect_left(self.keys, key)
+        if idx == len(self.keys) or self.keys[idx] != key:
+            raise KeyError(key)
+
+        items = str(self.strs[self.offs[idx]:self.offs[idx+1]], 'utf-8').split(FIELD_SEP)
+        return _make_value(self.fields, items)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+_bundle_dir = None
+
+
+def source_digest(path: Path) -> bytes:
+    digest = hashlib.blake2b(digest_size=SOURCE_DIGEST_SIZE)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _open_bundle() -> dict:
+    """Map the bundle and return its directory, 
+    name -> ((source size, mtime, digest), entry).
+
+    An empty directory is returned if the bundle is unusable.
+    """
+    global _bundle_dir
+    if _bundle_dir is not None:
+        return _bundle_dir
+
+    _bundle_dir = {}
+    try:
+        with open(BUNDLE_PATH, 'rb') as f:
+            buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        return _bundle_dir
+
+    try:
+        magic, version, num, byte_order = BUNDLE_HEADER.unpack_from(buf)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_FORMAT_VERSION or \
+            byte_order != BUNDLE_BYTE_ORDERS[sys.byteorder]:
+            return _bundle_dir
+
+        for i in range(num):
+            entry = BUNDLE_DIR_ENTRY.unpack_from(buf, BUNDLE_HEADER.size + i*BUNDLE_DIR_ENTRY.size)
+            name = entry[0].rstrip(b'\x00').decode()
+            _bundle_dir[name] = (entry[1:4], (buf,) + entry[4:])
+    except struct.error:
+        _bundle_dir = {}
+
+    return _bundle_dir
+
+
+def load_table(name: str) -> Mapping:
+    """Return the table from the bundle, or from its text file if the bundle
+    is unusable or stale. A table found in neither is empty."""
+    file_name, _, fields = TABLES[name]
+    src_path = RES_ROOT/file_name
+
+    try:
+        src_stat = os.stat(src_path)
+    except FileNotFoundError:
+        src_stat = None
+
+    try:
+        (bundled_size, bundled_mtime, bundled_digest), entry = _open_bundle()[name]
+        if src_stat is None or (src_stat.st_size == bundled_size and 
+                                (src_stat.st_mtime_ns == bundled_mtime or 
+                                 source_digest(src_path) == bundled_digest)):
+            return BundleTable(entry[0], fields, *entry[1:])
+    except KeyError:
+        pass
+
+    if src_stat is None:
+        return {}
+
+    return {key: _make_value(fields, items) for key, items in parse_text_table(name).items()}
+
+
+class AssignedNumbers(Mapping):
+    """Read-only int-keyed view of an assigned numbers table.
+
+    Nothing is read until the first lookup, so importing a module that
+    declares a table costs nothing.
+    """
+    def __init__(self, name: str):
+        if name not in TABLES:
+            raise ValueError("Unknown assigned numbers table: {}".format(name))
+        self.name = name
+        self._table = None
+
+    @property
+    def table(self) -> Mapping:
+        if self._table is None:
+            self._table = load_table(self.name)
+        return self._table
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    def __contains__(self, key) -> bool:
+        try:
+            self.table[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+def build_bundle(path: Path = BUNDLE_PATH) -> list[str]:
+    """Compile the text files of all tables into the bundle.
+
+    Tables whose text file is absent are left out. Return the names of the
+    tables written.
+    """
+    tables = []
+    for name, (file_name, _, _) in TABLES.items():
+        try:
+            items = parse_text_table(name)
+        except FileNotFoundError:
+            continue
+        src_stat = os.stat(RES_ROOT/file_name)
+        tables.append((name, (src_stat.st_size, src_stat.st_mtime_ns, 
+                              source_digest(RES_ROOT/file_name)), items))
+
+    dir_size = BUNDLE_HEADER.size + len(tables)*BUNDLE_DIR_ENTRY.size
+    body = bytearray()
+    entries = []
+    for name, (src_size, src_mtime, src_digest), items in tables:
+        keys = array('Q', sorted(items))
+        strs = bytearray()
+        offs = array('I', [0])
+        for key in keys:
+            strs += FIELD_SEP.join(items[key]).encode('utf-8')
+            offs.append(len(strs))
+
+        body += b'\x00' * (-(dir_size + len(body)) % 8)
+        keys_off = dir_size + len(body)
+        body += keys.tobytes()
+        offs_off = dir_size + len(body)
+        body += offs.tobytes()
+        strs_off = dir_size + len(body)
+        body += strs
+
+        entries.append(BUNDLE_DIR_ENTRY.pack(name.encode(), src_size, src_mtime, src_digest,
+                                             len(keys), keys_off, offs_off, strs_off))
+
+    header = BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, len(tables),
+                                BUNDLE_BYTE_ORDERS[sys.byteorder])
+
+    # Write then rename, so that a running bluing never maps a partial bundle.
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(header + b''.join(entries) + body)
+    os.replace(tmp_path, path)
+
+    return [name for name, _, _ in tables]
+
+
+if __name__ == '__main__':
+    names = build_bundle()
+    print("{}: {}".format(BUNDLE_PATH, ', '.join(names)))
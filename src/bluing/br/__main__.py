@@ -14,8 +14,6 @@ from bthci.events import HCI_Connection_Request
 
 from . import LOG_LEVEL
 from .ui import parse_cmdline
-from .br_scan import BrScanner
-from .sdp_scan import SdpScanner
 
 
 logger = Logger(__name__, LOG_LEVEL)
@@ -26,17 +24,27 @@ def main(argv: list[str] = sys.argv):
     logger.debug("parse_cmdline() returned\n"
                  "    args:", args)
 
+    writer = None
     try:
+        if args['--ndjson']:
+            from ..ndjson import NdjsonWriter
+            writer = NdjsonWriter(args['--ndjson'])
+
+        # Scanners are imported by the option that needs them, so `--help` and
+        # the other options do not parse the company and service class tables.
         if args['--inquiry']:
+            from .br_scan import BrScanner
             br_scanner = BrScanner(args['-i'])
-            br_scanner.inquiry(inquiry_len=args['--inquiry-len'])
+            br_scanner.inquiry(inquiry_len=args['--inquiry-len'], writer=writer)
         elif args['--sdp']:
-            SdpScanner(args['-i']).scan(args['BD_ADDR'])
+            from .sdp_scan import SdpScanner
+            SdpScanner(args['-i']).scan(args['BD_ADDR'], writer)
         elif args['--lmp-features']:
             if args['--local']: # Move to BrScanenr
                 # HCI Read Local Supported Features 
                 raise NotImplementedError("The `--local` option is not yet implemented")
             else:
+                from .br_scan import BrScanner
                 br_scanner = BrScanner(args['-i'])
                 br_scanner.scan_lmp_features(args['BD_ADDR'])
         elif args['--stack']:
@@ -123,3 +131,6 @@ def main(argv: list[str] = sys.argv):
         logger.debug("e_info: {}".format(e_info))
         logger.error("{}: \"{}\"".format(e.__class__.__name__, e))
         sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
@@ -8,17 +8,13 @@ from bthci.events import HciEventCodes, HCI_Inquiry_Result, HCI_Inquiry_Result_w
                          HCI_Extended_Inquiry_Result
 from bthci.bluez_hci import HCI_CHANNEL_USER
 from xpycommon.log import Logger
-from xpycommon.ui import green, blue, red, INDENT
+from xpycommon.ui import green, blue, red
 from xpycommon.bluetooth import ClassOfDevice
 
-from .. import BlueScanner, service_cls_profile_ids
-from ..common import bdaddr_to_company_name
+from .. import BlueScanner, ScanResult
+from ..common import bdaddr_to_company_name, bdaddr_to_int, oui_lookup
 from ..le.ll import ll_vers
-from ..gap_data import gap_type_names, \
-    COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS, \
-    COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS, \
-    COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS, COMPLETE_LOCAL_NAME, \
-    SHORTENED_LOCAL_NAME, TX_POWER_LEVEL
+from ..gap_data import decode_ad_structs, pp_ad_records
 
 from . import LOG_LEVEL
 from .lmp import lmp_vers, company_identfiers, pp_lmp_features, pp_ext_lmp_features
@@ -27,11 +23,46 @@ from .lmp import lmp_vers, company_identfiers, pp_lmp_features, pp_ext_lmp_featu
 logger = Logger(__name__, LOG_LEVEL)
 
 
+class BrDevicesScanResult(ScanResult):
+    def __init__(self):
+        super().__init__('BR/EDR Devices')
+        self.devices = []
+
+    def add_device(self, bd_addr: str, page_scan_repetition_mode: int, cod: bytes, 
+                   clk_offset: int, rssi: int = None, ext_inq_rsp: bytes = None):
+        """Add a device from an inquiry result, see BrScanner.pp_inquiry_result()"""
+        device = {
+            'record': 'br_device',
+            'addr': bd_addr,
+            'company': oui_lookup(bdaddr_to_int(bd_addr)),
+            'page_scan_repetition_mode': page_scan_repetition_mode,
+            'cod': int.from_bytes(cod, byteorder='little'),
+            'clock_offset': clk_offset,
+            'rssi': rssi,
+            'eir': None if ext_inq_rsp is None else 
+                [record.to_dict() for record in decode_ad_structs(ext_inq_rsp)]
+        }
+        self.devices.append(device)
+        self.emit(device)
+
+    def add_name(self, bd_addr: str, name: str):
+        for device in self.devices:
+            if device['addr'] == bd_addr:
+                device['name'] = name
+        self.emit({'record': 'br_device_name', 'addr': bd_addr, 'name': name})
+
+
 class BrScanner(BlueScanner):
-    def inquiry(self, inquiry_len=0x08):
+    def inquiry(self, inquiry_len=0x08, writer=None):
+        """
+        writer - An ndjson.NdjsonWriter the devices are written to as they are 
+                 discovered, instead of being printed.
+        """
         logger.info("Discovering other nearby BR/EDR Controllers on {} for {} sec\n\n".format(
             blue(self.iface), blue("{:.2f}".format(inquiry_len*1.28))))
 
+        self.result = BrDevicesScanResult()
+        self.result.writer = writer
         self.scanned_dev = []
         self.remote_name_req_flag = True
         hci = HCI(self.iface)
@@ -74,7 +105,9 @@ class BrScanner(BlueScanner):
                         logger.error("{}: \"{}\"".format(e.__class__, e))
                         name = ''
 
-                    print("{} : {}".format(bd_addr, blue(name)))
+                    self.result.add_name(bd_addr, name)
+                    if writer is None:
+                        print("{} : {}".format(bd_addr, blue(name)))
         except HciRuntimeError as e:
             logger.error("{}".format(e))
         except KeyboardInterrupt as e:
@@ -82,6 +115,7 @@ class BrScanner(BlueScanner):
             hci.inquiry_cancel()
             
         hci.close()
+        return self.result
 
 
     def scan_lmp_features(self, paddr: str):
@@ -159,6 +193,11 @@ class BrScanner(BlueScanner):
         if bd_addr in self.scanned_dev:
             return
 
+        self.result.add_device(bd_addr, page_scan_repetition_mode, cod, clk_offset)
+        if self.result.writer is not None:
+            self.scanned_dev.append(bd_addr)
+            return
+
         print("BD_ADDR: {} ({})".format(blue(bd_addr), bdaddr_to_company_name(bd_addr)))
         print("Page scan repetition mode: ", end='')
         pp_page_scan_repetition_mode(page_scan_repetition_mode)
@@ -191,6 +230,11 @@ class BrScanner(BlueScanner):
         if bd_addr in self.scanned_dev:
             return
 
+        self.result.add_device(bd_addr, page_scan_repetition_mode, cod, clk_offset, rssi)
+        if self.result.writer is not None:
+            self.scanned_dev.append(bd_addr)
+            return
+
         print("BD_ADDR: {} ({})".format(blue(bd_addr), bdaddr_to_company_name(bd_addr)))
         # print('name:', blue(name.decode()))
         print("Page scan repetition mode: ", end='')
@@ -224,6 +268,12 @@ class BrScanner(BlueScanner):
         if bd_addr in self.scanned_dev:
             return
 
+        self.result.add_device(bd_addr, page_scan_repetition_mode, cod, clk_offset, rssi, 
+                               ext_inq_rsp)
+        if self.result.writer is not None:
+            self.scanned_dev.append(bd_addr)
+            return
+
         print("BD_ADDR: {} ({})".format(blue(bd_addr), bdaddr_to_company_name(bd_addr)))
         # print('name:', blue(name.decode()))
         print('Page scan repetition mode: ', end='')
@@ -236,7 +286,7 @@ class BrScanner(BlueScanner):
 
         print("Clock offset: 0x{:04X}".format(clk_offset))
         print("RSSI:", rssi)
-        pp_ext_inquiry_rsp(ext_inq_rsp)
+        pp_ext_inquiry_rsp(ext_inq_rsp, rssi)
         print('\n')
 
         self.scanned_dev.append(bd_addr)
@@ -254,78 +304,16 @@ def pp_page_scan_repetition_mode(val):
         print(red('RFU'))
 
 
-def pp_ext_inquiry_rsp(ext_inq_rsp):
+def pp_ext_inquiry_rsp(ext_inq_rsp: bytes, rssi: int = None):
     '''Parse and print Extended Inquiry Response (240 octets)
 
     https://www.bluetooth.com/specifications/assigned-numbers/generic-access-profile/
     '''
     print('Extended inquiry response: ', end='')
-    if ext_inq_rsp[0] == 0:
+    records = decode_ad_structs(ext_inq_rsp)
+    if len(records) == 0:
         print(red('None'))
         return
 
     print()
-
-    while ext_inq_rsp[0] != 0:
-        length = ext_inq_rsp[0]
-        data = ext_inq_rsp[1:1+length]
-        data_type = data[0]
-        ext_inq_rsp = ext_inq_rsp[1+length:]
-        print(INDENT, end='')
-        # TODO: Unify the gap type name parsings of BR and LE
-        if data_type == COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS:
-            print(gap_type_names[data_type])
-            if length - 1 >= 2:
-                eir_data = data[1:]
-                if len(eir_data) % 2 != 0:
-                    print(INDENT*2 + blue('Invalid EIR data length: %d'%len(eir_data)))
-                    continue
-
-                for i in range(0, len(eir_data), 2):
-                    uuid = int.from_bytes(eir_data[i:i+2], byteorder='little')
-                    print(INDENT*2 + '0x%04x '%uuid, end='')
-                    try:
-                        print(blue(service_cls_profile_ids[uuid]['Name']))
-                    except KeyError as e:
-                        print(red('unknown'))
-            else:
-                print(INDENT*2 + red('None'))
-        elif data_type == COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS:
-            print(gap_type_names[data_type])
-            if length - 1 >= 4:
-                eir_data = data[1:]
-                if len(eir_data) % 4 != 0:
-                    logger.info(INDENT*2 + 'Invalid EIR data length: {} {}'.format(len(eir_data), eir_data))
-                    continue
-                for i in range(0, len(eir_data), 4):
-                    uuid = int.from_bytes(eir_data[i:i+4], byteorder='little')
-                    print(INDENT*2 + '0x%08x '%uuid)
-            else:
-                print(INDENT*2 + red('None'))
-        elif data_type == COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS:
-            print(gap_type_names[data_type])
-            if length - 1 >= 16:
-                eir_data = data[1:]
-                if len(eir_data) % 16 != 0:
-                    logger.info(INDENT*2 + 'Invalid EIR data length: {} {}'.format(len(eir_data), eir_data))
-                    continue
-                for i in range(0, len(eir_data), 16):
-                    uuid = int.from_bytes(eir_data[i:i+16], byteorder='little')
-                    uuid_str = '%032X' % uuid
-                    print(INDENT*2, end='')
-                    print(blue('-'.join([uuid_str[:8], uuid_str[8:12], 
-                        uuid_str[12:16], uuid_str[16:20], uuid_str[20:32]])))   
-            else:
-                print(INDENT*2 + red('None'))
-        elif data_type == SHORTENED_LOCAL_NAME or \
-            data_type == COMPLETE_LOCAL_NAME:
-            print(gap_type_names[data_type]+':', blue(data[1:].decode()))
-        elif data_type == TX_POWER_LEVEL:
-            print(gap_type_names[data_type]+':', blue(str(int.from_bytes(
-                data[1:], byteorder='little')) + ' dBm'))
-        else:
-            try:
-                print(gap_type_names[data_type])
-            except KeyError as e:
-                print(red('Unknown, 0x%02x'%data_type))
-            print(INDENT*2, data[1:],sep='')
+    pp_ad_records(records, rssi)
@@ -1,22 +1,14 @@
 #!/usr/bin/env python
 
-import io
-import csv
-import pkg_resources
-
 from xpycommon.log import Logger
 from xpycommon.ui import green, red
 
+from ..assigned_numbers import AssignedNumbers
 from . import LOG_LEVEL
 
 logger = Logger(__name__, LOG_LEVEL)
 
-company_identfiers_file = pkg_resources.resource_stream(__name__, '../res/CompanyIdentfiers.csv')
-company_identfiers_file = io.TextIOWrapper(company_identfiers_file)
-company_identfiers = {}
-for row in csv.DictReader(company_identfiers_file):
-    # print(row['Decimal'], row['Hexadecimal'], row['Company'])
-    company_identfiers[int(row['Decimal'])] = row['Company']
+company_identfiers = AssignedNumbers('company-identifiers')
 
 lmp_vers = {
     0:  'Bluetooth Core Specification 1.0b (Withdrawn)',
@@ -9,15 +9,30 @@ from xpycommon.log import Logger
 from xpycommon.ui import blue
 from halo import Halo
 
-from .. import BlueScanner, LOG_LEVEL
+from .. import BlueScanner, ScanResult, LOG_LEVEL
 from ..service_record import ServiceRecord
 
 
 logger = Logger(__name__, LOG_LEVEL)
 
 
+class SdpScanResult(ScanResult):
+    def __init__(self, addr: str = None):
+        super().__init__('SDP')
+        self.addr = addr
+        self.records = []
+
+    def add_record(self, record: ServiceRecord):
+        self.records.append(record)
+        self.emit(dict(record.to_dict(), addr=self.addr))
+
+
 class SdpScanner(BlueScanner):
-    def scan(self, addr:str):
+    def scan(self, addr:str, writer=None):
+        """
+        writer - An ndjson.NdjsonWriter the service records are written to, 
+                 instead of being printed.
+        """
         spinner = Halo(text="Scanning", placement='right')
         spinner.start()
 
@@ -38,21 +53,38 @@ class SdpScanner(BlueScanner):
         spinner.stop()
         
         logger.debug("output: {}".format(output))
-        self.pp_sdptool_output(output)
+        if writer is None:
+            self.pp_sdptool_output(output)
+            return
 
+        self.result = SdpScanResult(addr.upper())
+        self.result.writer = writer
+        for record_xml in self.split_sdptool_output(output):
+            try:
+                self.result.add_record(ServiceRecord(record_xml))
+            except ElementTree.ParseError as e:
+                logger.warning("Invalid service record XML, {}: {}".format(e, record_xml))
+        return self.result
 
-    @classmethod
-    def pp_sdptool_output(cls, output:str):
-        '''Split the string output by sdptool into individual servcie records 
-        and processes them separately.'''
-        # print(DEBUG, 'parse_sdptool_output')
+    @staticmethod
+    def split_sdptool_output(output: str) -> list[str]:
+        '''Split the string output by sdptool into individual service record 
+        XMLs.'''
         pattern = r'Failed to connect to SDP server on[\da-zA-Z :]*'
         pattern = re.compile(pattern)
         result = pattern.findall(output)
         for i in result:
             output = output.replace(i, '')
 
-        record_xmls = output.split('<?xml version="1.0" encoding="UTF-8" ?>\n\n')[1:]
+        return output.split('<?xml version="1.0" encoding="UTF-8" ?>\n\n')[1:]
+
+
+    @classmethod
+    def pp_sdptool_output(cls, output:str):
+        '''Split the string output by sdptool into individual servcie records 
+        and processes them separately.'''
+        # print(DEBUG, 'parse_sdptool_output')
+        record_xmls = cls.split_sdptool_output(output)
         print('Number of service records:', len(record_xmls), '\n\n')
         for record_xml in record_xmls:
             print(blue('Service Record'))
@@ -3,8 +3,8 @@
 r"""
 Usage:
     bluing br [-h | --help]
-    bluing br [-i <hci>] [--inquiry-len=<n>] --inquiry
-    bluing br [-i <hci>] --sdp BD_ADDR
+    bluing br [-i <hci>] [--inquiry-len=<n>] [--ndjson=<file>] --inquiry
+    bluing br [-i <hci>] [--ndjson=<file>] --sdp BD_ADDR
     bluing br [-i <hci>] --local --sdp
     bluing br [-i <hci>] --lmp-features BD_ADDR
     bluing br [-i <hci>] --local --lmp-features
@@ -31,6 +31,9 @@ Options:
                                      Interval Length = n * 0.625 ms (1 Baseband slot)
                                      Time Range: 0 to 40.9 s
                                      Range of n: 0x0000 to 0xFFFF [default: 0]
+    --ndjson=<file>              Write the result as NDJSON, one device or service 
+                                 record per line, to <file> or stdout if <file> 
+                                 is -, instead of printing it
     --sdp                        Retrieve information from the SDP database of a 
                                  remote BR/EDR device
     --lmp-features               Read LMP features of a remote BR/EDR device
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-import io
-import pkg_resources
+from functools import lru_cache
+from collections.abc import Iterable
 
 from dbus.exceptions import DBusException
 
@@ -9,20 +9,24 @@ from xpycommon.log import Logger
 from xpycommon.ui import blue, red
 
 from . import LOG_LEVEL
+from .assigned_numbers import AssignedNumbers
 
 
 logger = Logger(__name__, LOG_LEVEL)
 
-oui_file = pkg_resources.resource_stream(__name__, "res/oui.txt")
-oui_file = io.TextIOWrapper(oui_file)
-oui_company_names = {}
-for line in oui_file:
-    items = line.strip().split('\t\t')
-    if len(items) == 2 and '   (hex)' in items[0]:
-        company_id = items[0].removesuffix('   (hex)')
-        oui_company_names[company_id] = items[1]
-        
-# logger.debug("oui_company_names: {}".format(oui_company_names))
+# IEEE assigns MA-L (24-bit), MA-M (28-bit) and MA-S (36-bit) blocks. The
+# MA-M and MA-S blocks are carved out of MA-L ones registered to the IEEE
+# Registration Authority, so the longest matching prefix wins.
+oui_company_names = AssignedNumbers('oui')
+oui28_company_names = AssignedNumbers('oui28')
+oui36_company_names = AssignedNumbers('oui36')
+oui_tables = [
+    (48 - 36, oui36_company_names),
+    (48 - 28, oui28_company_names),
+    (48 - 24, oui_company_names),
+]
+
+OUI_LOOKUP_CACHE_SIZE = 4096
 
 
 class InvalidArgsException(DBusException):
@@ -44,13 +48,32 @@ class Rejected(DBusException):
     _dbus_error_name = "org.bluez.Error.Rejected"
 
 
+def bdaddr_to_int(addr: str) -> int:
+    """Convert a BD_ADDR like 'AA:BB:CC:DD:EE:FF' or 'AA-BB-...' to int."""
+    return int(addr.replace(':', '').replace('-', ''), base=16)
+
+
+@lru_cache(maxsize=OUI_LOOKUP_CACHE_SIZE)
+def oui_lookup(addr: int) -> str | None:
+    """Return the organization assigned the longest prefix of the 48-bit 
+    address, or None."""
+    for shift, table in oui_tables:
+        try:
+            return table[addr >> shift]
+        except KeyError:
+            continue
+
+    return None
+
+
 def bdaddr_to_company_name(addr: str):
-    company_id = addr.replace(':', '-').upper()[0:8]
-    
-    logger.debug("bdaddr_to_company_name(), addr: " + addr)
-    logger.debug(company_id)
-
-    try:
-        return blue(oui_company_names[company_id])
-    except KeyError:
-        return red('Unknown')
+    name = oui_lookup(bdaddr_to_int(addr))
+    return red('Unknown') if name is None else blue(name)
+
+
+def bdaddrs_to_company_names(addrs: Iterable[str]) -> list[str]:
+    """Bulk version of bdaddr_to_company_name(), each distinct address is 
+    resolved once."""
+    addrs = list(addrs)
+    names = {addr: bdaddr_to_company_name(addr) for addr in set(addrs)}
+    return [names[addr] for addr in addrs]
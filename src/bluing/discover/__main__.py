@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import sys
+from subprocess import CalledProcessError, check_output, STDOUT
+from traceback import format_exception
+
+from xpycommon.log import Logger
+from xpycommon.ui import blue
+
+from . import LOG_LEVEL
+from .ui import parse_cmdline
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+def main(argv: list[str] = sys.argv):
+    args = parse_cmdline(argv[1:])
+    logger.debug("parse_cmdline() returned\n"
+                 "    args:", args)
+
+    writer = None
+    try:
+        if args['--ndjson']:
+            from ..ndjson import NdjsonWriter
+            writer = NdjsonWriter(args['--ndjson'])
+
+        from .discoverer import InterleavedDiscoverer, pp_dev_found
+        result = InterleavedDiscoverer(args['-i']).discover(
+            args['--timeout'], args['--period'], args['--br-duty'], args['--scan-type'],
+            None if writer is not None else pp_dev_found, writer)
+
+        if writer is None:
+            print()
+            print()
+            print(blue("----------------"+result.type+" Scan Result"+"----------------"))
+            result.print()
+        result.store()
+    except KeyboardInterrupt:
+        try:
+            output = check_output(' '.join(['hciconfig', args['-i'], 'reset']), 
+                                             stderr=STDOUT, timeout=60, shell=True)
+        except CalledProcessError as e:
+            logger.warning("{}: {}".format(e.__class__.__name__, e))
+        print()
+        logger.info("Canceled\n")
+    except Exception as e:
+        e_info = ''.join(format_exception(*sys.exc_info()))
+        logger.debug("e_info: {}".format(e_info))
+        logger.error("{}: \"{}\"".format(e.__class__.__name__, e))
+        sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
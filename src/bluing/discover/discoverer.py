@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+r"""Interleaved BR/EDR inquiry and LE scanning on one HCI device
+
+A controller is time sliced between the two transports: each period starts
+with an Inquiry of period * br_duty sec, rounded to the 1.28 s unit of
+Inquiry_Length, and the rest of it is an LE scan. Every device found goes
+into one table, keyed by address, so a dual-mode device using its public
+address on both transports ends up as one entry tagged with both.
+"""
+
+import time
+import struct
+import sqlite3
+from datetime import datetime
+
+from bthci import HCI, HciRuntimeError
+from bthci.events import HCI_Inquiry_Result_with_RSSI, HCI_Extended_Inquiry_Result
+from xpycommon.log import Logger
+from xpycommon.ui import blue, green, yellow
+
+from .. import ScanResult
+from ..common import bdaddrs_to_company_names
+from ..gap_data import AdRecord, decode_ad_structs, COMPLETE_LOCAL_NAME, SHORTENED_LOCAL_NAME
+from ..le.hci_scan import HciLeScanner
+from ..le.addr_type_cache import addr_type_cache
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+INQUIRY_LEN_UNIT = 1.28 # sec
+TRANSPORT_BR = 'br'
+TRANSPORT_LE = 'le'
+TRANSPORT_NAMES = {TRANSPORT_BR: 'BR/EDR', TRANSPORT_LE: 'LE'}
+
+# A response of HCI_Inquiry_Result and of HCI_Inquiry_Result_with_RSSI
+INQUIRY_INFO = struct.Struct('<6sBH3sH')
+INQUIRY_INFO_WITH_RSSI = struct.Struct('<6sBB3sHb')
+
+
+def parse_inquiry_results(evt_code: int, params: bytes) -> list[tuple[str, int, int | None, bytes | None]]:
+    """Parse HCI_Inquiry_Result, HCI_Inquiry_Result_with_RSSI or
+    HCI_Extended_Inquiry_Result parameters into (BD_ADDR, CoD, RSSI, EIR).
+
+    Each of the Num_Responses responses is one block, as struct inquiry_info
+    and inquiry_info_with_rssi of the kernel:
+        BD_ADDR (6) | Page_Scan_Repetition_Mode | Reserved (2) | Class_Of_Device (3) |
+        Clock_Offset (2)
+    or, with RSSI, a 1-byte Reserved then RSSI last.
+    """
+    num_rsp = params[0]
+    if evt_code == HCI_Extended_Inquiry_Result.evt_code:
+        # Num_Responses is always 1
+        bd_addr, _, _, cod, _, rssi, eir = struct.unpack('<6sBB3sHb240s', params[1:256])
+        return [(bd_addr[::-1].hex(':').upper(), int.from_bytes(cod, 'little'), rssi, eir)]
+
+    with_rssi = evt_code == HCI_Inquiry_Result_with_RSSI.evt_code
+    rsp_format = INQUIRY_INFO_WITH_RSSI if with_rssi else INQUIRY_INFO
+    if len(params) < 1 + num_rsp * rsp_format.size:
+        raise ValueError("Truncated inquiry result: {}".format(params.hex()))
+
+    results = []
+    for offset in range(1, 1 + num_rsp * rsp_format.size, rsp_format.size):
+        fields = rsp_format.unpack_from(params, offset)
+        bd_addr, cod = fields[0], fields[3]
+        rssi = fields[5] if with_rssi else None
+        results.append((bd_addr[::-1].hex(':').upper(), int.from_bytes(cod, 'little'), rssi, None))
+    return results
+
+
+class DiscoveredDevice:
+    """A device found over BR/EDR, LE or both.
+
+    transports - Set of TRANSPORT_BR and TRANSPORT_LE
+    ads        - Latest AD/EIR data structure of each type, EIR and AdvData
+                 and ScanRspData merged
+    """
+    __slots__ = ('addr', 'addr_type', 'transports', 'br_rssi', 'le_rssi', 'cod',
+                 'le_connectable', 'ads', 'first_seen', 'last_seen')
+
+    def __init__(self, addr: str, addr_type: str, now: float):
+        self.addr = addr
+        self.addr_type = addr_type
+        self.transports = set()
+        self.br_rssi = None
+        self.le_rssi = None
+        self.cod = None
+        self.le_connectable = None
+        self.ads = {}
+        self.first_seen = self.last_seen = now
+
+    @property
+    def name(self) -> str | None:
+        for ad_type in (COMPLETE_LOCAL_NAME, SHORTENED_LOCAL_NAME):
+            ad = self.ads.get(ad_type)
+            if ad is not None and ad.error is None:
+                return ad.value
+        return None
+
+    @property
+    def transport_str(self) -> str:
+        return ' + '.join(TRANSPORT_NAMES[transport] for transport in
+                          (TRANSPORT_BR, TRANSPORT_LE) if transport in self.transports)
+
+    def to_dict(self) -> dict:
+        return {'record': 'discovered_device', 'addr': self.addr, 'addr_type': self.addr_type,
+                'transports': sorted(self.transports), 'name': self.name,
+                'br_rssi': self.br_rssi, 'cod': self.cod,
+                'le_rssi': self.le_rssi, 'le_connectable': self.le_connectable,
+                'ad_structs': [ad.to_dict() for ad in self.ads.values()],
+                'first_seen': self.first_seen, 'last_seen': self.last_seen}
+
+
+class DiscoveredDevicesScanResult(ScanResult):
+    def __init__(self):
+        super().__init__('BR/EDR and LE Devices')
+        # (addr, addr type) -> DiscoveredDevice. A BR/EDR address is public,
+        # so it meets the LE public address of the same device.
+        self.devices = {}
+
+    def _get(self, addr: str, addr_type: str, transport: str,
+             now: float) -> tuple[DiscoveredDevice, bool]:
+        """Return the device and whether it is new to this transport."""
+        dev = self.devices.get((addr, addr_type))
+        if dev is None:
+            dev = self.devices[(addr, addr_type)] = DiscoveredDevice(addr, addr_type, now)
+        is_new = transport not in dev.transports
+        dev.transports.add(transport)
+        dev.last_seen = now
+        return dev, is_new
+
+    def add_br(self, addr: str, cod: int, rssi: int | None, eir: bytes | None,
+               now: float) -> tuple[DiscoveredDevice, bool]:
+        dev, is_new = self._get(addr, 'public', TRANSPORT_BR, now)
+        dev.cod = cod
+        if rssi is not None:
+            dev.br_rssi = rssi
+        if eir is not None:
+            for ad in decode_ad_structs(eir):
+                dev.ads[ad.type] = ad
+        return dev, is_new
+
+    def add_le(self, addr: str, addr_type: str, connectable: bool, rssi: int,
+               ad_structs: list[AdRecord], now: float) -> tuple[DiscoveredDevice, bool]:
+        dev, is_new = self._get(addr, addr_type, TRANSPORT_LE, now)
+        dev.le_connectable = dev.le_connectable or connectable
+        dev.le_rssi = rssi
+        for ad in ad_structs:
+            dev.ads[ad.type] = ad
+        return dev, is_new
+
+    def emit_devices(self):
+        for dev in self.devices.values():
+            self.emit(dev.to_dict())
+
+    def print(self):
+        devs = sorted(self.devices.values(), key=lambda dev: (sorted(dev.transports), dev.addr))
+        company_names = bdaddrs_to_company_names(dev.addr for dev in devs)
+
+        print("{:<12} {:<17} {:<7} {:>7} {:>7} {:<8} {}".format(
+            'Transport', 'Addr', 'Type', 'BR RSSI', 'LE RSSI', 'CoD', 'Name'))
+        for dev, company_name in zip(devs, company_names):
+            print("{:<12} {} {:<7} {:>7} {:>7} {:<8} {}".format(
+                dev.transport_str, blue(dev.addr), dev.addr_type,
+                '' if dev.br_rssi is None else dev.br_rssi,
+                '' if dev.le_rssi is None else dev.le_rssi,
+                '' if dev.cod is None else "0x{:06X}".format(dev.cod),
+                dev.name or ''),
+                "("+company_name+")" if dev.addr_type == 'public' else "")
+
+        num_dual = sum(1 for dev in devs if len(dev.transports) == 2)
+        num_br = sum(1 for dev in devs if dev.transports == {TRANSPORT_BR})
+        print()
+        print("{} devices: {} BR/EDR only, {} LE only, {} on both".format(
+            len(devs), num_br, len(devs) - num_br - num_dual, num_dual))
+
+    def store(self):
+        """Merge the LE devices into the LE address type cache."""
+        try:
+            addr_type_cache.update((dev.addr, dev.addr_type, dev.le_rssi, dev.last_seen)
+                                   for dev in self.devices.values()
+                                   if TRANSPORT_LE in dev.transports)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Failed to update the LE address type cache {}: {}".format(
+                addr_type_cache.path, e))
+
+
+def pp_dev_found(dev: DiscoveredDevice, transport: str):
+    """Print a device found on a transport for the first time."""
+    print("[{}] {} {:<6} {:<7} {} {}".format(
+        datetime.fromtimestamp(dev.last_seen).strftime('%Y-%m-%d %H:%M:%S'),
+        green('+'), TRANSPORT_NAMES[transport], dev.addr_type, blue(dev.addr), dev.name or ''),
+        yellow("(also on {})".format(TRANSPORT_NAMES[TRANSPORT_BR if transport == TRANSPORT_LE else TRANSPORT_LE]))
+        if len(dev.transports) == 2 else "")
+
+
+class InterleavedDiscoverer:
+    def __init__(self, iface: str = 'hci0'):
+        self.iface = iface
+
+    @staticmethod
+    def slices(period: float, br_duty: float) -> tuple[int, float]:
+        """Return the Inquiry_Length and the LE scan duration (sec) of a period.
+
+        br_duty - Share of the period given to the inquiry, 0 to 1
+        """
+        if not 0 <= br_duty <= 1:
+            raise ValueError("Invalid BR/EDR duty cycle: {}".format(br_duty))
+        inquiry_len = round(period * br_duty / INQUIRY_LEN_UNIT)
+        if br_duty > 0:
+            inquiry_len = max(1, inquiry_len)
+        le_duration = max(0, period - inquiry_len * INQUIRY_LEN_UNIT)
+        if br_duty < 1 and le_duration == 0:
+            raise ValueError("Period of {} sec leaves no time for LE scanning".format(period))
+        return inquiry_len, le_duration
+
+    def discover(self, timeout: float = 30, period: float = 10, br_duty: float = 0.5,
+                 scan_type: str = 'active', callback=pp_dev_found,
+                 writer=None) -> DiscoveredDevicesScanResult:
+        """Alternate inquiries and LE scans for timeout sec.
+
+        callback - Called as callback(dev, transport) when a device is found on
+                   a transport for the first time
+        writer   - An ndjson.NdjsonWriter the devices are written to at the end
+        """
+        inquiry_len, le_duration = self.slices(period, br_duty)
+        logger.info("Discovering BR/EDR and LE devices on {} for {} sec, "
+                    "{:.2f} sec of inquiry then {:.2f} sec of LE {} scanning in turn".format(
+                        blue(self.iface), blue(str(timeout)), inquiry_len * INQUIRY_LEN_UNIT,
+                        le_duration, scan_type))
+
+        result = DiscoveredDevicesScanResult()
+        result.writer = writer
+
+        def inquiry_result_handler(event: bytes):
+            try:
+                results = parse_inquiry_results(event[0], event[2:])
+            except (ValueError, struct.error) as e:
+                logger.warning("{}".format(e))
+                return
+            now = time.time()
+            for addr, cod, rssi, eir in results:
+                dev, is_new = result.add_br(addr, cod, rssi, eir, now)
+                if is_new and callback is not None:
+                    callback(dev, TRANSPORT_BR)
+
+        # Latest AdvData and ScanRspData of each LE device, only the data that 
+        # changed are decoded.
+        last_data = {}
+
+        deadline = time.monotonic() + timeout
+        hci = HCI(self.iface)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if inquiry_len > 0 and remaining >= INQUIRY_LEN_UNIT:
+                    try:
+                        hci.inquiry(inquiry_len=min(inquiry_len, int(remaining / INQUIRY_LEN_UNIT)),
+                                    inquiry_result_handler=inquiry_result_handler)
+                    except KeyboardInterrupt:
+                        hci.inquiry_cancel()
+                        raise
+                    except HciRuntimeError as e:
+                        logger.error("{}".format(e))
+
+                remaining = deadline - time.monotonic()
+                if le_duration > 0 and remaining > 0:
+                    for report in HciLeScanner(self.iface).reports(scan_type, min(le_duration, remaining)):
+                        key = (report.addr, report.scan_rsp)
+                        if last_data.get(key) == report.data:
+                            ad_structs = ()
+                        else:
+                            last_data[key] = report.data
+                            ad_structs = decode_ad_structs(report.data)
+                        dev, is_new = result.add_le(report.addr, report.addr_type, report.connectable,
+                                                    report.rssi, ad_structs, time.time())
+                        if is_new and callback is not None:
+                            callback(dev, TRANSPORT_LE)
+
+                if deadline - time.monotonic() <= 0 or \
+                    (le_duration == 0 and deadline - time.monotonic() < INQUIRY_LEN_UNIT):
+                    break
+        finally:
+            hci.close()
+            result.emit_devices()
+
+        return result
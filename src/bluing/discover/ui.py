@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+r"""
+Usage:
+    bluing discover [-h | --help]
+    bluing discover [-i <hci>] [--timeout=<sec>] [--period=<sec>] [--br-duty=<ratio>] [--scan-type=<type>] [--ndjson=<file>]
+
+Options:
+    -h, --help            Print this help and quit
+    -i <hci>              HCI device
+    --timeout=<sec>       Duration of the discovery [default: 30]
+    --period=<sec>        Each period starts with a BR/EDR inquiry, then LE 
+                          scanning for the rest of it [default: 10]
+    --br-duty=<ratio>     Share of each period given to the inquiry, from 0 
+                          (LE only) to 1 (BR/EDR only), rounded to the 1.28 sec 
+                          unit of the inquiry length [default: 0.5]
+    --scan-type=<type>    The type of LE scan to perform. active or passive [default: active]
+    --ndjson=<file>       Write the devices as NDJSON, one per line, to <file> 
+                          or stdout if <file> is -, instead of printing them
+"""
+
+
+import sys
+
+from docopt import docopt
+from bthci import HCI
+
+from xpycommon.log import Logger
+from xpycommon.ui import red
+
+from . import LOG_LEVEL, PKG_NAME
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+def parse_cmdline(argv: list[str] = sys.argv[1:]) -> dict:
+    logger.debug("Entered parse_cmdline(argv={})".format(argv))
+
+    args = docopt(__doc__.replace(PKG_NAME.replace('.', ' '), PKG_NAME.split('.')[-1]), 
+                  argv, help=False, options_first=True)
+    logger.debug("docopt() returned\n"
+                 "    args:", args)
+
+    try:
+        # Discovering needs no option, so only `--help` prints the help.
+        if args['--help']:
+            print(__doc__)
+            sys.exit()
+
+        if args['-i'] is None:
+            args['-i'] = HCI.get_default_iface()
+        hci = HCI(args['-i'])
+        hci.clean_up_running()
+        hci.close()
+
+        for opt in ('--timeout', '--period'):
+            try:
+                args[opt] = float(args[opt])
+                if args[opt] <= 0:
+                    raise ValueError()
+            except ValueError as e:
+                e.args = ("Invalid {}: ".format(opt) + red(str(args[opt])),)
+                raise e
+
+        try:
+            args['--br-duty'] = float(args['--br-duty'])
+            if not 0 <= args['--br-duty'] <= 1:
+                raise ValueError()
+        except ValueError as e:
+            e.args = ("Invalid --br-duty: " + red(str(args['--br-duty'])),)
+            raise e
+
+        args['--scan-type'] = args['--scan-type'].lower()
+        if args['--scan-type'] not in ('active', 'passive'):
+            raise ValueError("Invalid --scan-type: " + red(args['--scan-type']))
+    except Exception as e:
+        logger.error("{}: \"{}\"".format(e.__class__.__name__, e))
+        sys.exit(1)
+    else:
+        return args
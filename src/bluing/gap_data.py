@@ -1,5 +1,13 @@
 #!/usr/bin/env python
 
+from collections.abc import Iterable
+
+from xpycommon.ui import blue, red, INDENT
+
+from .assigned_numbers import AssignedNumbers
+from .uuid_registry import BtUuid, get_uuid
+
+
 # EIR Data Type, Advertising Data Type (AD Type) and OOB Data Type Definitions
 # https://www.bluetooth.com/specifications/assigned-numbers/generic-access-profile/
 FLAGS                                          = 0x01
@@ -102,10 +110,6 @@ gap_type_names = {
     MANUFACTURER_SPECIFIC_DATA                     : "Manufacturer Specific Data",
 }
 
-# ad_value_parsers = {
-
-# }
-
 company_names = { # https://www.bluetooth.com/specifications/assigned-numbers/company-identifiers/
     0x0000: "Ericsson Technology Licensing",
     0x0001: "Nokia Mobile Phones",
@@ -2728,3 +2732,259 @@ company_names = { # https://www.bluetooth.com/specifications/assigned-numbers/co
 appearance_names = { # https://specificationrefs.bluetooth.com/assigned-values/Appearance%20Values.pdf
     
 }
+
+
+company_identifiers = AssignedNumbers('company-identifiers')
+
+# Bits of the Flags AD type
+ad_flag_names = [
+    "LE Limited Discoverable Mode",
+    "LE General Discoverable Mode",
+    "BR/EDR Not Supported", # Bit 37 of LMP Feature Mask Definitions (Page 0)
+    "Simultaneous LE + BR/EDR to Same Device Capable (Controller)", # Bit 49 of LMP Feature Mask Definitions (Page 0)
+    "Simultaneous LE + BR/EDR to Same Device Capable (Host)", # Bit 66 of LMP Feature Mask Definitions (Page 1)
+]
+
+
+def _uuids_parser(uuid_len: int):
+    def parse(raw: bytes) -> list[BtUuid]:
+        if len(raw) % uuid_len != 0:
+            raise ValueError("Length {} is not a multiple of {}".format(len(raw), uuid_len))
+        return [get_uuid(raw[i:i+uuid_len]) for i in range(0, len(raw), uuid_len)]
+    return parse
+
+
+def _service_data_parser(uuid_len: int):
+    def parse(raw: bytes) -> tuple[BtUuid, bytes]:
+        if len(raw) < uuid_len:
+            raise ValueError("Length {} < {}".format(len(raw), uuid_len))
+        return get_uuid(raw[:uuid_len]), raw[uuid_len:]
+    return parse
+
+
+def _uint_parser(size: int):
+    def parse(raw: bytes) -> int:
+        if len(raw) != size:
+            raise ValueError("Length {} != {}".format(len(raw), size))
+        return int.from_bytes(raw, 'little')
+    return parse
+
+
+def _parse_name(raw: bytes) -> str:
+    # The encoding is not specified, UTF-8 in practice but devices may send
+    # garbage.
+    return raw.decode('utf-8', errors='replace')
+
+
+def _parse_tx_power_level(raw: bytes) -> int:
+    if len(raw) != 1:
+        raise ValueError("Length {} != 1".format(len(raw)))
+    return int.from_bytes(raw, 'little', signed=True)
+
+
+def _parse_addrs(raw: bytes) -> list[str]:
+    if len(raw) % 6 != 0:
+        raise ValueError("Length {} is not a multiple of 6".format(len(raw)))
+    return [raw[i:i+6][::-1].hex(':').upper() for i in range(0, len(raw), 6)]
+
+
+# Company ID -> itself, so that the manufacturer data of a company share one
+# int object. There are at most 65536 of them.
+_company_ids = {}
+
+
+def _parse_manufacturer_specific_data(raw: bytes) -> tuple[int, bytes]:
+    if len(raw) < 2:
+        raise ValueError("Length {} < 2".format(len(raw)))
+    company_id = int.from_bytes(raw[:2], 'little')
+    return _company_ids.setdefault(company_id, company_id), raw[2:]
+
+
+# AD type: parser of the value, from raw bytes to a typed value. The value of
+# a type without a parser is the raw bytes.
+ad_value_parsers = {
+    FLAGS                                          : _uint_parser(1),
+    INCOMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS  : _uuids_parser(2),
+    COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS    : _uuids_parser(2),
+    INCOMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS  : _uuids_parser(4),
+    COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS    : _uuids_parser(4),
+    INCOMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS : _uuids_parser(16),
+    COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS   : _uuids_parser(16),
+    SHORTENED_LOCAL_NAME                           : _parse_name,
+    COMPLETE_LOCAL_NAME                            : _parse_name,
+    TX_POWER_LEVEL                                 : _parse_tx_power_level,
+    CLASS_OF_DEVICE                                : _uint_parser(3),
+    LIST_OF_16_BIT_SERVICE_SOLICITATION_UUIDS      : _uuids_parser(2),
+    LIST_OF_32_BIT_SERVICE_SOLICITATION_UUIDS      : _uuids_parser(4),
+    LIST_OF_128_BIT_SERVICE_SOLICITATION_UUIDS     : _uuids_parser(16),
+    SERVICE_DATA_16_BIT_UUID                       : _service_data_parser(2),
+    SERVICE_DATA_32_BIT_UUID                       : _service_data_parser(4),
+    SERVICE_DATA_128_BIT_UUID                      : _service_data_parser(16),
+    PUBLIC_TARGET_ADDRESS                          : _parse_addrs,
+    RANDOM_TARGET_ADDRESS                          : _parse_addrs,
+    APPEARANCE                                     : _uint_parser(2),
+    ADVERTISING_INTERVAL                           : _uint_parser(2),
+    LE_ROLE                                        : _uint_parser(1),
+    URI                                            : _parse_name,
+    MANUFACTURER_SPECIFIC_DATA                     : _parse_manufacturer_specific_data,
+}
+
+
+class AdRecord:
+    """A decoded AD structure (EIR data structure for BR/EDR).
+
+    type  - AD type, one of the constants above
+    raw   - Raw value, without the length and the AD type
+    value - Typed value given by ad_value_parsers, raw if the type has no
+            parser or if raw is malformed
+    error - Why raw is malformed, or None
+    """
+    __slots__ = ('type', 'raw', 'value', 'error')
+
+    def __init__(self, type: int, raw: bytes):
+        self.type = type
+        self.raw = bytes(raw)
+        self.value = self.raw
+        self.error = None
+
+        try:
+            parser = ad_value_parsers[type]
+        except KeyError:
+            return
+
+        try:
+            self.value = parser(self.raw)
+        except ValueError as e:
+            self.error = str(e)
+
+    @property
+    def name(self) -> str | None:
+        return gap_type_names.get(self.type)
+
+    def to_dict(self) -> dict:
+        """JSON serializable form"""
+        return {'type': self.type, 'name': self.name, 'raw': self.raw.hex(),
+                'value': _jsonable(self.value), 'error': self.error}
+
+
+def _jsonable(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    elif isinstance(value, BtUuid):
+        return value.display
+    elif isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    else:
+        return value
+
+
+# Maximum number of entries of each interning pool below. A full pool is
+# cleared, what was already shared stays shared.
+AD_POOL_SIZE = 65536
+
+# (AD type, raw) -> AdRecord, and tuple of interned AdRecords -> itself.
+# Nearby devices often send the same beacon, a long scan keeps one copy of
+# it instead of one per device.
+_ad_record_pool = {}
+_ad_structs_pool = {}
+
+
+def intern_ad_record(type: int, raw: bytes) -> AdRecord:
+    """Return the AdRecord of (type, raw), shared by all the callers.
+
+    An interned record must not be modified.
+    """
+    raw = bytes(raw)
+    key = (type, raw)
+    record = _ad_record_pool.get(key)
+    if record is None:
+        if len(_ad_record_pool) >= AD_POOL_SIZE:
+            _ad_record_pool.clear()
+        record = _ad_record_pool[key] = AdRecord(type, raw)
+    return record
+
+
+def intern_ad_structs(records: Iterable[AdRecord]) -> tuple[AdRecord, ...]:
+    """Return records as a tuple shared by all the callers.
+
+    records - Interned AdRecords, compared by identity
+    """
+    records = tuple(records)
+    shared = _ad_structs_pool.get(records)
+    if shared is None:
+        if len(_ad_structs_pool) >= AD_POOL_SIZE:
+            _ad_structs_pool.clear()
+        shared = _ad_structs_pool[records] = records
+    return shared
+
+
+def decode_ad_structs(data: bytes) -> list[AdRecord]:
+    """Decode AdvData, ScanRspData or an Extended Inquiry Response in a single
+    pass, without copying the remaining data.
+
+    Decoding stops at the first zero length (the padding of an EIR) or at a
+    truncated AD structure. The records are interned.
+    """
+    view = memoryview(data)
+    records = []
+    offset = 0
+    while offset < len(view):
+        length = view[offset]
+        if length == 0 or offset + 1 + length > len(view):
+            break
+        records.append(intern_ad_record(view[offset+1], view[offset+2:offset+1+length]))
+        offset += 1 + length
+    return records
+
+
+def pp_ad_records(records: list[AdRecord], rssi: int = None):
+    """Print AD structures, shared by BR/EDR EIR and LE AdvData/ScanRspData.
+
+    rssi - Used to compute the pathloss from Tx Power Level
+    """
+    for record in records:
+        name = record.name
+        if name is None:
+            name = "0x{:02X} ".format(record.type) + "(" + red("Unknown") + ")"
+        print(INDENT + "{}: ".format(name), end='')
+
+        value = record.value
+        if record.error is not None:
+            print(record.raw.hex().upper(), "(" + red("Raw") + ", {})".format(record.error))
+        elif record.type == FLAGS:
+            print()
+            for bit, flag_name in enumerate(ad_flag_names):
+                if value & (1 << bit):
+                    print(INDENT*2 + flag_name)
+        elif isinstance(value, list): # UUIDs or addresses
+            print() if value else print(red('None'))
+            for item in value:
+                print(INDENT*2 + (uuid_for_show(item) if isinstance(item, BtUuid) else blue(item)))
+        elif record.type in (SERVICE_DATA_16_BIT_UUID, SERVICE_DATA_32_BIT_UUID,
+                             SERVICE_DATA_128_BIT_UUID):
+            print()
+            print(INDENT*2 + "UUID: {}".format(uuid_for_show(value[0])))
+            print(INDENT*2 + "Data: {}".format(value[1].hex().upper()))
+        elif record.type == MANUFACTURER_SPECIFIC_DATA:
+            company_id, data = value
+            try:
+                company_name = blue(company_identifiers[company_id])
+            except KeyError:
+                company_name = red("Unknown")
+            print()
+            print(INDENT*2 + "Company ID:", '0x{:04X} ({})'.format(company_id, company_name))
+            print(INDENT*2 + 'Data:      ', data.hex().upper())
+        elif record.type == TX_POWER_LEVEL:
+            print(value, "dBm", "" if rssi is None else "(pathloss {} dBm)".format(value - rssi))
+        elif record.type in (SHORTENED_LOCAL_NAME, COMPLETE_LOCAL_NAME, URI):
+            print(blue(value))
+        elif isinstance(value, bytes):
+            print(value.hex().upper())
+        else:
+            print("0x{:X}".format(value))
+
+
+def uuid_for_show(bt_uuid: BtUuid) -> str:
+    """Format a UUID of an AD structure, short form first, with its name."""
+    uuid_str = blue(bt_uuid.display if bt_uuid.short is None else '0x' + bt_uuid.display)
+    return uuid_str if bt_uuid.name is None else uuid_str + ' ({})'.format(bt_uuid.name)
@@ -9,11 +9,8 @@ from xpycommon.ui import blue
 
 from bluepy.btle import BTLEException
 
-from .microbit import get_microbit_devpaths
 from . import LOG_LEVEL
 from .ui import parse_cmdline
-from .le_scan import LeScanner
-from .gatt_scan import GattScanner
 
 
 logger = Logger(__name__, LOG_LEVEL)
@@ -24,12 +21,68 @@ def main(argv: list[str] = sys.argv):
     logger.debug("parse_cmdline() returned\n"
                  "    args:", args)
 
+    writer = None
     try:
         scan_result = None
+        if args['--ndjson']:
+            from ..ndjson import NdjsonWriter
+            writer = NdjsonWriter(args['--ndjson'])
 
-        if args['--scan']:
-            scan_result = LeScanner(args['-i']).scan_devs(args['--timeout'], 
-                    args['--scan-type'], args['--sort'])
+        resolver = None
+        if args['--irk-file']:
+            from .rpa import RpaResolver
+            resolver = RpaResolver.from_irk_file(args['--irk-file'])
+
+        # Scanners are imported by the option that needs them, so `--help` and
+        # the other options do not load GATT, D-Bus or serial dependencies.
+        if args['--scan'] or args['--ll-feature-set'] or args['--pairing-feature'] \
+            or args['--sniff-adv']:
+            from .le_scan import LeScanner
+
+        if args['--scan'] and args['--continuous']:
+            from .le_scan import pp_dev_seen, pp_dev_lost, pp_addrs_linked
+            if writer is None:
+                seen_callback, lost_callback = pp_dev_seen, pp_dev_lost
+                link_callback = pp_addrs_linked
+            else:
+                seen_callback = lambda entry: writer.write(dict(entry.to_dict(), event='seen'))
+                lost_callback = lambda entry: writer.write(dict(entry.to_dict(), event='lost'))
+                # The cluster id of the records of the new address was merged's
+                link_callback = lambda cluster, merged: writer.write(
+                    dict(cluster.to_dict(), event='linked', merged=merged.id))
+
+            proximity = None
+            if args['--proximity']:
+                from .proximity import ProximityEstimator, load_sensor_positions, pp_proximity
+                if writer is None:
+                    # The table of the estimates replaces the devices seen and lost
+                    seen_callback = lost_callback = lambda entry: None
+                    link_callback = lambda cluster, merged: None
+                    proximity_callback = pp_proximity
+                else:
+                    def proximity_callback(snapshot):
+                        for record in snapshot.records():
+                            writer.write(record)
+                proximity = ProximityEstimator(
+                    args['--ifaces'] if args['--ifaces'] else [args['-i']],
+                    load_sensor_positions(args['--sensor-pos']) if args['--sensor-pos'] else None,
+                    pathloss_exponent=args['--pathloss-exp'], callback=proximity_callback)
+
+            scanner = LeScanner(args['-i'], resolver=resolver, proximity=proximity)
+            for entry, is_new in scanner.scan_devs_continuous(
+                    args['--scan-type'], args['--max-devs'], args['--max-idle'], 
+                    evict_callback=lost_callback, engine=args['--engine'], 
+                    extended=args['--extended'], ifaces=args['--ifaces'], 
+                    accept_list=args['--accept-list'], filter_dup=args['--filter-dup'],
+                    interval=args['--interval'], window=args['--window'], phys=args['--phy'],
+                    writer=writer, link_callback=link_callback):
+                if is_new:
+                    seen_callback(entry)
+        elif args['--scan']:
+            scan_result = LeScanner(args['-i'], resolver=resolver).scan_devs(args['--timeout'], 
+                    args['--scan-type'], args['--sort'], args['--engine'], args['--extended'],
+                    writer, args['--ifaces'], args['--accept-list'], args['--filter-dup'],
+                    args['--interval'], args['--window'], args['--phy'], args['--latency'])
         elif args['--ll-feature-set']:
             LeScanner(args['-i']).read_ll_feature_set(
                 args['PEER_ADDR'], args['--addr-type'], args['--timeout'])
@@ -37,16 +90,27 @@ def main(argv: list[str] = sys.argv):
             LeScanner(args['-i']).req_pairing_feature(
                 args['PEER_ADDR'], args['--addr-type'], args['--timeout'])
         elif args['--gatt']:
+            from .gatt_scan import GattScanner
             scan_result = GattScanner(args['-i'], args['--io-cap']).scan(
-                args['PEER_ADDR'], args['--addr-type']) 
+                args['PEER_ADDR'], args['--addr-type'], writer) 
         elif args['--sniff-adv']:
             if not args['--device']:
+                from .microbit import get_microbit_devpaths
                 dev_paths = get_microbit_devpaths()
             else:
                 dev_paths = args['--device']
             if len(dev_paths) == 0:
                 raise RuntimeError("Micro:bit not found")
-            LeScanner(microbit_devpaths=dev_paths).sniff_adv(args['--channel'])
+            from .sniff_pipeline import ConsoleSink, NdjsonSink, PcapSink
+            sinks = [ConsoleSink(resolver) if writer is None else NdjsonSink(writer, resolver)]
+            if args['--pcap']:
+                from .pcap import PcapWriter
+                sinks.append(PcapSink(PcapWriter(
+                    args['--pcap'], rotate_size=args['--rotate-size'], 
+                    rotate_interval=args['--rotate-interval'], ring_size=args['--ring-size'])))
+            LeScanner(microbit_devpaths=dev_paths, resolver=resolver).sniff_adv(
+                args['--channel'], sinks=sinks, queue_size=args['--queue-size'], 
+                drop=args['--drop'])
         elif args['--mon-incoming-conn']:
             #hci = HCI(args['-i'])
             #     flt = hci_filter()
@@ -62,11 +126,12 @@ def main(argv: list[str] = sys.argv):
         else:
             raise ValueError("Invalid option(s)")
 
-        if scan_result is not None:
+        if scan_result is not None and writer is None:
             print()
             print()
             print(blue("----------------"+scan_result.type+" Scan Result"+"----------------"))
             scan_result.print()
+        if scan_result is not None:
             scan_result.store()
     except BTLEException as e:
         logger.error(str(e) + ("\nNo BLE adapter or missing sudo?" if 'le on' in str(e) else ""))
@@ -96,3 +161,6 @@ def main(argv: list[str] = sys.argv):
         logger.debug("e_info: {}".format(e_info))
         logger.error("{}: \"{}\"".format(e.__class__.__name__, e))
         sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
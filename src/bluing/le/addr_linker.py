@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+r"""Link the random addresses a device rotates through
+
+A device rotating its random address keeps advertising the same things:
+the same manufacturer data header, service UUIDs, TX power, name... Those
+stable parts of its AD structures make a fingerprint, and an address is
+linked to the cluster of a previous address with the same fingerprint,
+found through a hash index, provided the timing fits a rotation: the
+previous address went silent shortly before the new one appeared. Two
+addresses advertising the same fingerprint at the same time are two
+devices.
+
+While scanning, the last seen time of the previous address is not final
+yet, so the link waits until that address has been silent for a while,
+and is undone if the previous address is reported again.
+"""
+
+from collections.abc import Iterable
+
+from xpycommon.log import Logger
+
+from ..gap_data import AdRecord, FLAGS, \
+    INCOMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS, COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS, \
+    INCOMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS, COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS, \
+    INCOMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS, COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS, \
+    SHORTENED_LOCAL_NAME, COMPLETE_LOCAL_NAME, TX_POWER_LEVEL, APPEARANCE, \
+    SERVICE_DATA_16_BIT_UUID, SERVICE_DATA_32_BIT_UUID, SERVICE_DATA_128_BIT_UUID, \
+    MANUFACTURER_SPECIFIC_DATA
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+# Bytes of manufacturer data kept after the company ID. They usually hold
+# the message type and length (e.g., Apple Continuity), the rest often
+# changes with the address.
+MANUFACTURER_DATA_PREFIX_LEN = 2
+# The new address of a device appears at most MAX_ROTATION_GAP sec after the
+# last report of its previous one...
+MAX_ROTATION_GAP = 60 # sec
+# ...and both may be reported within ROTATION_OVERLAP sec around the switch,
+# e.g., when reports are merged from several adapters.
+ROTATION_OVERLAP = 2 # sec
+# While scanning, a new address is linked once the previous one has been
+# silent for MIN_ROTATION_SILENCE sec, longer than the advertising interval
+# of most devices.
+MIN_ROTATION_SILENCE = 10 # sec
+
+UUID_LIST_LENS = {
+    INCOMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS  : 2,
+    COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS    : 2,
+    INCOMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS  : 4,
+    COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS    : 4,
+    INCOMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS : 16,
+    COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS   : 16,
+}
+
+SERVICE_DATA_UUID_LENS = {
+    SERVICE_DATA_16_BIT_UUID  : 2,
+    SERVICE_DATA_32_BIT_UUID  : 4,
+    SERVICE_DATA_128_BIT_UUID : 16,
+}
+
+
+def ad_fingerprint(ad_structs: Iterable[AdRecord]) -> tuple | None:
+    """Return the stable parts of AD structures as a hashable tuple, or None
+    if they have nothing telling a device apart (no AD structure, only
+    Flags...)."""
+    parts = []
+    for ad in ad_structs:
+        if ad.error is not None:
+            continue
+        if ad.type == MANUFACTURER_SPECIFIC_DATA:
+            parts.append((ad.type, ad.raw[:2+MANUFACTURER_DATA_PREFIX_LEN]))
+        elif ad.type in UUID_LIST_LENS:
+            uuid_len = UUID_LIST_LENS[ad.type]
+            parts.append((ad.type, b''.join(sorted(ad.raw[i:i+uuid_len]
+                                                   for i in range(0, len(ad.raw), uuid_len)))))
+        elif ad.type in SERVICE_DATA_UUID_LENS:
+            # The data of a service often rotates with the address
+            parts.append((ad.type, ad.raw[:SERVICE_DATA_UUID_LENS[ad.type]]))
+        elif ad.type in (SHORTENED_LOCAL_NAME, COMPLETE_LOCAL_NAME, TX_POWER_LEVEL,
+                         APPEARANCE, FLAGS):
+            parts.append((ad.type, ad.raw))
+
+    if all(ad_type == FLAGS for ad_type, _ in parts):
+        return None
+    return tuple(sorted(parts))
+
+
+class AddrCluster:
+    """The addresses of one device, in the order it used them.
+
+    first_seen  - First report of its first address
+    last_seen   - Latest report of its current address
+    fingerprint - ad_fingerprint() of its addresses, None if they cannot be 
+                  linked
+    """
+    __slots__ = ('id', 'addrs', 'addrs_first_seen', 'first_seen', 'last_seen', 
+                 'fingerprint')
+
+    def __init__(self, id: int, addr: str, first_seen: float, last_seen: float, 
+                 fingerprint: tuple | None = None):
+        self.id = id
+        self.addrs = [addr]
+        # First report of each address
+        self.addrs_first_seen = [first_seen]
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.fingerprint = fingerprint
+
+    def to_dict(self) -> dict:
+        return {'record': 'le_addr_cluster', 'id': self.id, 'addrs': self.addrs,
+                'first_seen': self.first_seen, 'last_seen': self.last_seen}
+
+
+class AddrLinker:
+    def __init__(self, max_gap: float = MAX_ROTATION_GAP, overlap: float = ROTATION_OVERLAP,
+                 min_silence: float | None = None):
+        """min_silence - None if the seen times passed to link() are final,
+                      e.g., when linking the addresses after a scan. Otherwise, 
+                      a new address is only linked by sweep(), once the 
+                      previous address has been silent for min_silence sec.
+        """
+        self.max_gap = max_gap
+        self.overlap = overlap
+        self.min_silence = min_silence
+        # Fingerprint -> clusters advertising it, the ones that can still be
+        # linked to a new address
+        self.index = {}
+        # Address -> its cluster
+        self.clusters = {}
+        # New address -> the previous address it waits to be linked to
+        self.pending = {}
+        # Addresses forgotten, kept in self.clusters until their cluster is
+        # silent for longer than max_gap
+        self.forgotten = set()
+        self.num_clusters = 0
+
+    def link(self, addr: str, addr_type: str, ad_structs: Iterable[AdRecord],
+             first_seen: float, last_seen: float) -> AddrCluster:
+        """Return the cluster of an address, linking it to the cluster of a
+        previous address if any.
+
+        The addresses are expected in the order they were first seen. Once
+        linked, linking an address again only updates the last seen time, 
+        unless a later address of its cluster was linked to it: both being 
+        reported, they are two devices and the later addresses are unlinked.
+        """
+        cluster = self.clusters.get(addr)
+        if cluster is not None:
+            self.forgotten.discard(addr)
+            if cluster.addrs[-1] != addr:
+                self._unlink(cluster, addr)
+            cluster.last_seen = max(cluster.last_seen, last_seen)
+            return cluster
+
+        # Public addresses do not rotate
+        fingerprint = ad_fingerprint(ad_structs) if addr_type == 'random' else None
+        prev_cluster = None
+        if fingerprint is not None:
+            prev_cluster = self._match(fingerprint, first_seen)
+
+        if prev_cluster is not None and self.min_silence is None:
+            logger.debug("Linked {} to {}".format(addr, prev_cluster.addrs[-1]))
+            cluster = prev_cluster
+            cluster.addrs.append(addr)
+            cluster.addrs_first_seen.append(first_seen)
+            cluster.last_seen = last_seen
+        else:
+            self.num_clusters += 1
+            cluster = AddrCluster(self.num_clusters, addr, first_seen, last_seen, fingerprint)
+            if fingerprint is not None:
+                self.index.setdefault(fingerprint, []).append(cluster)
+            if prev_cluster is not None:
+                self.pending[addr] = prev_cluster.addrs[-1]
+
+        self.clusters[addr] = cluster
+        return cluster
+
+    def _match(self, fingerprint: tuple, first_seen: float) -> AddrCluster | None:
+        """Return the cluster with fingerprint whose current address went
+        silent the most recently before first_seen, within max_gap."""
+        best = None
+        for cluster in self.index.get(fingerprint, ()):
+            if first_seen - self.max_gap <= cluster.last_seen <= first_seen + self.overlap and \
+                (best is None or cluster.last_seen > best.last_seen):
+                best = cluster
+        return best
+
+    def _merge(self, cluster: AddrCluster, new_cluster: AddrCluster):
+        """Link the addresses of new_cluster after the ones of cluster."""
+        logger.debug("Linked {} to {}".format(new_cluster.addrs[0], cluster.addrs[-1]))
+        cluster.addrs.extend(new_cluster.addrs)
+        cluster.addrs_first_seen.extend(new_cluster.addrs_first_seen)
+        cluster.last_seen = max(cluster.last_seen, new_cluster.last_seen)
+        for addr in new_cluster.addrs:
+            self.clusters[addr] = cluster
+        self.index[new_cluster.fingerprint].remove(new_cluster)
+
+    def _unlink(self, cluster: AddrCluster, addr: str):
+        """Move the addresses of cluster after addr to a cluster of their own,
+        addr becoming the current address of cluster."""
+        i = cluster.addrs.index(addr) + 1
+        logger.debug("Unlinked {} from {}, both reported".format(cluster.addrs[i], addr))
+        self.num_clusters += 1
+        new_cluster = AddrCluster(self.num_clusters, cluster.addrs[i], 
+                                  cluster.addrs_first_seen[i], cluster.last_seen, 
+                                  cluster.fingerprint)
+        new_cluster.addrs = cluster.addrs[i:]
+        new_cluster.addrs_first_seen = cluster.addrs_first_seen[i:]
+        del cluster.addrs[i:]
+        del cluster.addrs_first_seen[i:]
+        # Only known to be reported before the next address appeared
+        cluster.last_seen = new_cluster.first_seen
+
+        for new_addr in new_cluster.addrs:
+            self.clusters[new_addr] = new_cluster
+        self.index.setdefault(cluster.fingerprint, []).append(new_cluster)
+
+    def sweep(self, now: float) -> list[tuple[AddrCluster, AddrCluster]]:
+        """Link the new addresses whose previous address has been silent for
+        min_silence sec, then drop the clusters silent for longer than max_gap, 
+        they will never match again. Called periodically while scanning.
+
+        Return the links made, as (cluster, merged), merged being the cluster
+        of the new address whose addresses now follow the ones of cluster.
+        """
+        merges = []
+        for addr, prev_addr in list(self.pending.items()):
+            cluster = self.clusters.get(prev_addr)
+            new_cluster = self.clusters.get(addr)
+            if cluster is None or new_cluster is None or cluster.addrs[-1] != prev_addr or \
+                cluster is new_cluster or \
+                cluster.last_seen > new_cluster.first_seen + self.overlap:
+                # Either linked or unlinked meanwhile, or both addresses 
+                # reported: two devices
+                del self.pending[addr]
+            elif now - cluster.last_seen >= self.min_silence:
+                del self.pending[addr]
+                self._merge(cluster, new_cluster)
+                merges.append((cluster, new_cluster))
+
+        for fingerprint in list(self.index):
+            candidates = [cluster for cluster in self.index[fingerprint]
+                          if now - cluster.last_seen <= self.max_gap]
+            if candidates:
+                self.index[fingerprint] = candidates
+            else:
+                del self.index[fingerprint]
+
+        for addr in list(self.forgotten):
+            if now - self.clusters[addr].last_seen > self.max_gap:
+                self.forgotten.discard(addr)
+                del self.clusters[addr]
+
+        return merges
+
+    def forget(self, addr: str):
+        """Forget an address no longer tracked. Its cluster stays linkable for
+        max_gap, and so the address is kept until then, to be back in its 
+        cluster if seen again."""
+        cluster = self.clusters.get(addr)
+        if cluster is None:
+            return
+        if cluster.fingerprint is None:
+            del self.clusters[addr]
+        else:
+            self.forgotten.add(addr)
+
+    def linked_clusters(self) -> list[AddrCluster]:
+        """Return the clusters with more than one address."""
+        return list({id(cluster): cluster for cluster in self.clusters.values()
+                     if len(cluster.addrs) > 1}.values())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import time
+import sqlite3
+from pathlib import Path
+from collections.abc import Iterable
+
+from xpycommon.log import Logger
+
+from . import LE_ADDR_TYPE_CACHE_PATH, LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+class AddrTypeCache:
+    """Persistent index of the LE devices seen by scans, address -> address
+    type, last RSSI and last seen time.
+
+    Each scan merges its devices into the index in a single transaction, so
+    concurrent bluing processes never see a partial update, and a lookup is
+    a primary key search instead of loading every previous scan.
+    """
+    def __init__(self, path: Path = LE_ADDR_TYPE_CACHE_PATH):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS le_addr_types ("
+                               "addr TEXT PRIMARY KEY, addr_type TEXT NOT NULL, "
+                               "rssi INTEGER, last_seen REAL NOT NULL) WITHOUT ROWID")
+        return self._conn
+
+    def lookup(self, addr: str) -> tuple[str, int, float] | None:
+        """Return (addr type, last RSSI, last seen time) of an address or None."""
+        return self.conn.execute(
+            "SELECT addr_type, rssi, last_seen FROM le_addr_types WHERE addr = ?",
+            (addr.upper(),)).fetchone()
+
+    def update(self, devs: Iterable[tuple[str, str, int, float | None]]):
+        """Merge devices given as (addr, addr type, RSSI, last seen time).
+
+        A record is only replaced by a more recent one. A last seen time of
+        None means now.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO le_addr_types (addr, addr_type, rssi, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (addr) DO UPDATE SET addr_type = excluded.addr_type, "
+                "rssi = excluded.rssi, last_seen = excluded.last_seen "
+                "WHERE excluded.last_seen >= le_addr_types.last_seen",
+                [(addr.upper(), addr_type, rssi, now if last_seen is None else last_seen)
+                 for addr, addr_type, rssi, last_seen in devs])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+addr_type_cache = AddrTypeCache()
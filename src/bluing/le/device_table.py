@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import time
+from collections import OrderedDict
+
+from xpycommon.log import Logger
+
+from ..gap_data import intern_ad_structs
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+class LeDeviceEntry:
+    """A device of the live table. It has the attributes of LeDeviceInfo, so
+    LeDevicesScanResult can print it.
+
+    ad_structs  - Latest AD structure of each AD type, AdvData and ScanRspData
+                  merged. An interned tuple, shared by the devices advertising
+                  the same data.
+    adapters    - Latest RSSI of the device seen by each HCI device, 
+                  iface -> RSSI
+    identity    - rpa.Identity of a resolved RPA
+    cluster     - addr_linker.AddrCluster of the addresses linked to this one
+    first_seen  - time.time() of the first advertising report
+    last_seen   - time.time() of the latest advertising report
+    update_count - Number of advertising reports received
+    """
+    __slots__ = ('addr', 'addr_type', 'connectable', 'rssi', 'ad_structs', 'adapters',
+                 'identity', 'cluster', 'first_seen', 'last_seen', 'update_count')
+
+    def __init__(self, addr: str, addr_type: str, now: float):
+        self.addr = addr
+        self.addr_type = addr_type
+        self.connectable = False
+        self.rssi = None
+        self.ad_structs = ()
+        self.adapters = {}
+        self.identity = None
+        self.cluster = None
+        self.first_seen = self.last_seen = now
+        self.update_count = 0
+
+    def to_dict(self) -> dict:
+        return {'record': 'le_device', 'addr': self.addr, 'addr_type': self.addr_type,
+                'connectable': self.connectable, 'rssi': self.rssi,
+                'ad_structs': [ad.to_dict() for ad in self.ad_structs],
+                'adapters': self.adapters,
+                'identity': None if self.identity is None else self.identity.to_dict(),
+                'cluster': None if self.cluster is None else self.cluster.id,
+                'first_seen': self.first_seen, 'last_seen': self.last_seen,
+                'update_count': self.update_count}
+
+
+class LeDeviceTable:
+    """Bounded table of the LE devices seen, keyed by address.
+
+    Entries are kept in least recently seen order, so the entries to evict
+    are always at the front and an eviction costs O(1).
+    """
+    def __init__(self, max_devs: int = 10000, max_idle: float = 300):
+        """
+        max_devs - Maximum number of entries, the least recently seen ones
+                   are evicted beyond it.
+        max_idle - Entries not seen for more than max_idle seconds are evicted.
+        """
+        if max_devs <= 0:
+            raise ValueError("max_devs must be > 0")
+        if max_idle <= 0:
+            raise ValueError("max_idle must be > 0")
+
+        self.max_devs = max_devs
+        self.max_idle = max_idle
+        self.entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __contains__(self, addr: str) -> bool:
+        return addr in self.entries
+
+    def get(self, addr: str) -> LeDeviceEntry | None:
+        return self.entries.get(addr)
+
+    def update(self, addr: str, addr_type: str, connectable: bool, rssi: int,
+               ad_structs=(), iface: str = None, now: float = None) -> tuple[LeDeviceEntry, bool]:
+        """Record an advertising report and return (entry, is_new).
+
+        addr  - Upper case
+        iface - HCI device which received the report
+        """
+        if now is None:
+            now = time.time()
+
+        entry = self.entries.get(addr)
+        is_new = entry is None
+        if is_new:
+            entry = self.entries[addr] = LeDeviceEntry(addr, addr_type, now)
+        else:
+            self.entries.move_to_end(addr)
+
+        entry.addr_type = addr_type
+        # A scannable device answering SCAN_REQ stays connectable even if a
+        # later report comes from a SCAN_RSP.
+        entry.connectable = entry.connectable or connectable
+        entry.rssi = rssi
+        if iface is not None:
+            entry.adapters[iface] = rssi
+        entry.last_seen = now
+        entry.update_count += 1
+        if ad_structs:
+            # Only reached when the data of the device changed
+            ads = {ad.type: ad for ad in entry.ad_structs}
+            for ad in ad_structs:
+                ads[ad.type] = ad
+            entry.ad_structs = intern_ad_structs(ads.values())
+
+        return entry, is_new
+
+    def evict(self, now: float = None) -> list[LeDeviceEntry]:
+        """Evict the idle entries and those beyond max_devs, return them."""
+        if now is None:
+            now = time.time()
+
+        evicted = []
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if now - entry.last_seen <= self.max_idle and len(self.entries) <= self.max_devs:
+                break
+            self.entries.popitem(last=False)
+            evicted.append(entry)
+
+        if evicted:
+            logger.debug("Evicted {} LE devices, {} left".format(len(evicted), len(self.entries)))
+
+        return evicted
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+r"""Discovery latency of an LE scan
+
+How fast a scan finds the devices around depends on how its interval and
+window meet the advertising intervals of the devices. For each device
+found, the time from the start of the scan to its first advertising report
+is recorded, which gives the share of the devices discovered by any time t
+and the time needed to discover a given share of them. Comparing those of
+several scans of a venue, e.g. with different intervals and windows, tells
+the shortest scan finding 95 % of its devices.
+
+The devices found by the end of the scan are taken as all the devices
+around, the shares are relative to them.
+"""
+
+import math
+from bisect import bisect_right
+
+from xpycommon.log import Logger
+from xpycommon.ui import blue
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+# Shares of the devices whose discovery time is reported
+LATENCY_RATIOS = (0.5, 0.8, 0.9, 0.95, 0.99, 1.0)
+# Number of times t the share of devices discovered by t is reported at
+LATENCY_STEPS = 10
+
+
+class DiscoveryLatencyReport:
+    def __init__(self, start: float, duration: float, first_seen: dict[str, float],
+                 params: dict = None):
+        """
+        start      - time.time() the scan started
+        duration   - Duration of the scan (sec)
+        first_seen - addr -> time.time() of its first advertising report
+        params     - Parameters of the scan, reported as is
+        """
+        self.duration = duration
+        self.params = {} if params is None else params
+        # addr -> time to first seen (sec)
+        self.latencies = {addr: max(0.0, t - start) for addr, t in first_seen.items()}
+        self.sorted_latencies = sorted(self.latencies.values())
+
+    def time_to_ratio(self, ratio: float) -> float | None:
+        """Return the time (sec) by which ratio of the devices were discovered,
+        None if no device was."""
+        if not self.sorted_latencies:
+            return None
+        return self.sorted_latencies[max(0, math.ceil(ratio * len(self.sorted_latencies)) - 1)]
+
+    def ratio_by(self, t: float) -> float:
+        """Return the share of the devices discovered by t sec."""
+        if not self.sorted_latencies:
+            return 0.0
+        return bisect_right(self.sorted_latencies, t) / len(self.sorted_latencies)
+
+    def steps(self) -> list[float]:
+        step = self.duration / LATENCY_STEPS
+        return [round(step * i, 3) for i in range(1, LATENCY_STEPS + 1)]
+
+    def to_dict(self) -> dict:
+        return {'record': 'le_discovery_latency', 'params': self.params,
+                'duration': self.duration, 'devices': len(self.latencies),
+                'time_to_ratio': {str(ratio): self.time_to_ratio(ratio)
+                                  for ratio in LATENCY_RATIOS},
+                'ratio_by': [[t, self.ratio_by(t)] for t in self.steps()],
+                'time_to_first_seen': self.latencies}
+
+    def print(self):
+        print("Discovery latency of the {} devices ({}):".format(
+            len(self.latencies), ', '.join("{}={}".format(name, value) for name, value
+                                           in self.params.items() if value is not None)))
+        if not self.latencies:
+            return
+
+        for ratio in LATENCY_RATIOS:
+            print("    {:>5.0%} discovered in {} sec".format(
+                ratio, blue("{:.2f}".format(self.time_to_ratio(ratio)))))
+        print()
+        for t in self.steps():
+            ratio = self.ratio_by(t)
+            print("    {:>7.2f} sec {:>5.0%} {}".format(t, ratio, '#' * round(ratio * 40)))
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
-import io
-import pickle
+import json
 import subprocess
 from subprocess import STDOUT
 from uuid import UUID
@@ -9,69 +8,20 @@ from uuid import UUID
 from xpycommon.ui import green, blue, yellow, red, INDENT
 from xpycommon.log import Logger
 
-import pkg_resources
 from halo import Halo
 from bthci import ADDR_TYPE_PUBLIC
-from btgatt import Service, CharactValueDeclar, ServiceUuids, GattAttrTypes, bt_base_uuid, \
+from btgatt import Service, CharactValueDeclar, ServiceUuids, GattAttrTypes, \
     GattClient, ReadCharactValueError, ReadCharactDescriptorError, CharactProperties
 
 from .. import BlueScanner, ScanResult
+from ..uuid_registry import get_uuid
+from ..ndjson import jsonable
 from .ui import LOG_LEVEL
 from .gatt_scan_bt_agent import GattScanBtAgent
 
 
 logger = Logger(__name__, LOG_LEVEL)
 
-service_uuid_file = pkg_resources.resource_stream(__name__, "../res/gatt-service-uuid.txt")
-service_uuid_file = io.TextIOWrapper(service_uuid_file)
-
-char_uuid_file = pkg_resources.resource_stream(__name__, '../res/gatt-characteristic-uuid.txt')
-char_uuid_file = io.TextIOWrapper(char_uuid_file)
-
-descriptor_uuid_file = pkg_resources.resource_stream(__name__, '../res/gatt-descriptor-uuid.txt')
-descriptor_uuid_file = io.TextIOWrapper(descriptor_uuid_file)
-
-services_spec = {}
-characteristics_spec = {}
-descriptors_spec = {}
-
-BT_BASE_UUID = '00000000-0000-1000-8000-00805F9B34FB'
-BT_BASE_UUID_SUFFIX = "-0000-1000-8000-00805F9B34FB"
-
-for line in service_uuid_file:
-    items = line.strip().split('\t')
-    uuid = items.pop(2)
-    services_spec[uuid] = {
-        'Name': items[0],
-        'Uniform Type Identifier': items[1],
-        'Specification': items[2]
-    }
-
-for line in char_uuid_file:
-    items = line.strip().split('\t')
-    uuid = items.pop(2)
-    characteristics_spec[uuid] = {
-        'Name': items[0],
-        'Uniform Type Identifier': items[1],
-        'Specification': items[2]
-    }
-
-for line in descriptor_uuid_file:
-    items = line.strip().split('\t')
-    uuid = items.pop(2)
-    descriptors_spec[uuid] = {
-        'Name': items[0],
-        'Uniform Type Identifier': items[1],
-        'Specification': items[2]
-    }
-    
-
-def full_uuid_str_to_16_int(uuid: str):
-    """return 16-bit int or original uuid """
-    if uuid.startswith("0000") and uuid.endswith(BT_BASE_UUID_SUFFIX):
-        uuid = int(uuid.removeprefix('0000').removesuffix(BT_BASE_UUID_SUFFIX), base=16)
-    return uuid
-
 
 def attr_permissions2str(permissions: dict):
     permi_str = ''
@@ -152,17 +102,12 @@ class GattScanResult(ScanResult):
         self.services.append(service)
         
     def uuid2str_for_show(self, uuid: UUID) -> str:
-        if uuid.bytes[4:] == bt_base_uuid.bytes[4:]:
-            if uuid.bytes[:2] == b'\x00\x00':
-                uuid_str_for_show = '{:04X}'.format(int.from_bytes(
-                    uuid.bytes[2:4], 'big', signed=False))
-            else:
-                uuid_str_for_show = '{:08X}'.format(int.from_bytes(
-                    uuid.bytes[0:4], 'big', signed=False))
-        else:
-            uuid_str_for_show = str(uuid).upper()
-            
-        return uuid_str_for_show
+        return get_uuid(uuid).display
+
+    def uuid2name(self, uuid: UUID) -> str:
+        """Return the assigned name of a UUID unknown to btgatt, or red Unknown"""
+        name = get_uuid(uuid).name
+        return red("Unknown") if name is None else green(name)
 
     def print(self):
         if self.addr is None or self.addr_type is None:
@@ -179,7 +124,7 @@ class GattScanResult(ScanResult):
             try:
                 service_name = green(ServiceUuids[service.declar.value].name)
             except KeyError:
-                service_name = red("Unknown")
+                service_name = self.uuid2name(service.declar.value)
 
             print(blue("Service"), "(0x{:04x} - 0x{:04x}, {} characteristics)".format(
                 service.start_handle, service.end_handle, len(service.get_characts())))
@@ -209,7 +154,7 @@ class GattScanResult(ScanResult):
                     charact_name = green(GattAttrTypes[charact.declar.value.uuid].name)
                     # charact_name = green(charact_names[charact.declar.value.uuid])
                 except KeyError:
-                    charact_name = red("Unknown")
+                    charact_name = self.uuid2name(charact.declar.value.uuid)
                     
                 print(INDENT + yellow("Characteristic"), '({} descriptors)'.format(len(charact.descriptors)))
                 print(INDENT*2 + yellow("Declaration"))
@@ -264,17 +209,62 @@ class GattScanResult(ScanResult):
                     print(INDENT*3 + "Value: ", value_print)
                     print(INDENT*3 + "Permissions: {}\n".format(descriptor.permissions_desc))
 
+    def service_to_dict(self, service: Service) -> dict:
+        """One NDJSON record per service, with its characteristics and their 
+        descriptors."""
+        characts = []
+        for charact in service.get_characts():
+            value_declar = charact.value_declar
+            if value_declar is None:
+                value = error = None
+            else:
+                error = value_declar.get_read_error()
+                value, error = value_declar.value, None if error is None else error.desc
+
+            descriptors = []
+            for descriptor in charact.get_descriptors():
+                descriptor_error = descriptor.get_read_error()
+                descriptors.append({
+                    'handle': descriptor.handle,
+                    'uuid': "{:04X}".format(descriptor.type.int16),
+                    'name': descriptor.type.name,
+                    'value': descriptor.value,
+                    'error': None if descriptor_error is None else descriptor_error.desc
+                })
+
+            uuid = charact.declar.value.uuid
+            characts.append({
+                'handle': charact.declar.handle,
+                'properties': charact.declar.get_property_names(),
+                'value_handle': charact.declar.value.handle,
+                'uuid': get_uuid(uuid).display,
+                'name': get_uuid(uuid).name,
+                'value': value,
+                'error': error,
+                'descriptors': descriptors
+            })
+
+        uuid = service.declar.value
+        return {
+            'record': 'gatt_service',
+            'addr': self.addr,
+            'addr_type': 'public' if self.addr_type == ADDR_TYPE_PUBLIC else 'random',
+            'start_handle': service.start_handle,
+            'end_handle': service.end_handle,
+            'uuid': get_uuid(uuid).display,
+            'name': get_uuid(uuid).name,
+            'characteristics': characts
+        }
+
     def to_dict(self) -> dict:
-        j = {
-            "Addr": self.addr,
-            "Addr_Type": self.addr_type,
-            "services": []
+        return {
+            'addr': self.addr,
+            'addr_type': 'public' if self.addr_type == ADDR_TYPE_PUBLIC else 'random',
+            'services': [self.service_to_dict(service) for service in self.services]
         }
-        for service in self.services:
-            j["services"].append(service.json())
 
     def to_json(self) -> str:
-        self.to_dict()
+        return json.dumps(self.to_dict(), default=jsonable)
 
 
 class GattScanner(BlueScanner):
@@ -288,8 +278,13 @@ class GattScanner(BlueScanner):
         self.bt_agent = GattScanBtAgent(io_cap)
         self.bt_agent.register()
 
-    def scan(self, addr: str, addr_type: int = ADDR_TYPE_PUBLIC) -> GattScanResult:
+    def scan(self, addr: str, addr_type: int = ADDR_TYPE_PUBLIC, writer=None) -> GattScanResult:
+        """
+        writer - An ndjson.NdjsonWriter each service is written to once all 
+                 of its values and descriptors are read.
+        """
         logger.debug("Entered scan()")
+        self.result.writer = writer
 
         try:
             self.result.addr = addr.upper()
@@ -488,6 +483,8 @@ class GattScanner(BlueScanner):
                             descriptor.set_read_error(e)
                             descriptor.set_value(None)
 
+                self.result.emit(self.result.service_to_dict(service))
+
             # secondary_service_groups = req_groups(addr, addr_type, GattAttrTypes.SECONDARY_SERVICE)
             # include_groups = req_groups(addr, addr_type, GattAttrTypes.INCLUDE)
             
@@ -0,0 +1,634 @@
+#!/usr/bin/env python
+
+r"""LE scanning straight on the HCI socket
+
+The bluepy engine goes through the bluepy-helper process, which forwards each
+advertising report as a text line and converts each AD value to a string.
+This engine issues HCI_LE_Set_Scan_Parameters and HCI_LE_Set_Scan_Enable
+itself and decodes the HCI_LE_Advertising_Report events received on a raw HCI
+socket, so an advertising report costs no process hop and no text round-trip.
+
+With extended scanning, HCI_LE_Set_Extended_Scan_Parameters and 
+HCI_LE_Set_Extended_Scan_Enable are used instead, and the data fragmented 
+over several HCI_LE_Extended_Advertising_Report (AUX_CHAIN_IND) are 
+reassembled in pooled buffers, see ExtAdvReassembler.
+"""
+
+import time
+import queue
+import socket
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from bthci import HCI, ControllerErrorCodes
+from xpycommon.log import Logger
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+HCI_MAX_EVENT_SIZE = 260
+RECV_POLL_INTERVAL = 0.5 # sec
+MULTI_SCAN_QUEUE_SIZE = 4096
+HCI_CMD_COMPLETE_EVT_CODE = 0x0E
+HCI_CMD_STATUS_EVT_CODE = 0x0F
+HCI_LE_META_EVT_CODE = 0x3E
+HCI_LE_ADVERTISING_REPORT_SUBEVT_CODE = 0x02
+HCI_LE_EXTENDED_ADVERTISING_REPORT_SUBEVT_CODE = 0x0D
+
+OGF_LE_CTL = 0x08
+HCI_LE_READ_FILTER_ACCEPT_LIST_SIZE_OCF = 0x000F
+HCI_LE_ADD_DEVICE_TO_FILTER_ACCEPT_LIST_OCF = 0x0011
+HCI_LE_REMOVE_DEVICE_FROM_FILTER_ACCEPT_LIST_OCF = 0x0012
+HCI_LE_SET_EXTENDED_SCAN_PARAMETERS_OCF = 0x0041
+HCI_LE_SET_EXTENDED_SCAN_ENABLE_OCF = 0x0042
+# Scanning_PHYs bits of HCI_LE_Set_Extended_Scan_Parameters
+SCANNING_PHY_LE_1M = 0x01
+SCANNING_PHY_LE_CODED = 0x04
+SCANNING_PHYS = {'1m': SCANNING_PHY_LE_1M, 'coded': SCANNING_PHY_LE_CODED}
+
+# Event_Type of HCI_LE_Advertising_Report
+ADV_IND = 0x00
+ADV_DIRECT_IND = 0x01
+ADV_SCAN_IND = 0x02
+ADV_NONCONN_IND = 0x03
+SCAN_RSP = 0x04
+CONNECTABLE_EVT_TYPES = (ADV_IND, ADV_DIRECT_IND)
+
+# Address_Type of HCI_LE_Advertising_Report. Identity addresses resolved by
+# the controller (0x02, 0x03) keep the type of the identity address.
+ADDR_TYPE_NAMES = {0x00: 'public', 0x01: 'random', 0x02: 'public', 0x03: 'random'}
+ADDR_TYPE_ANONYMOUS = 0xFF
+
+# Event_Type bits of HCI_LE_Extended_Advertising_Report
+EXT_EVT_CONNECTABLE = 0x0001
+EXT_EVT_SCANNABLE   = 0x0002
+EXT_EVT_DIRECTED    = 0x0004
+EXT_EVT_SCAN_RSP    = 0x0008
+EXT_EVT_LEGACY      = 0x0010
+EXT_EVT_DATA_STATUS_POS = 5
+EXT_EVT_DATA_STATUS_MSK = 0b11 << EXT_EVT_DATA_STATUS_POS
+
+# Data status of HCI_LE_Extended_Advertising_Report
+DATA_STATUS_COMPLETE   = 0b00
+DATA_STATUS_INCOMPLETE = 0b01 # More data to come
+DATA_STATUS_TRUNCATED  = 0b10
+
+# Maximum length of extended advertising data, Vol 4, Part E, 7.8.54
+MAX_EXT_ADV_DATA_LEN = 1650
+EXT_ADV_REASSEMBLY_POOL_SIZE = 64
+
+LE_SCAN_TYPES = {'passive': 0x00, 'active': 0x01}
+# Scanning_Filter_Policy of HCI_LE_Set_Scan_Parameters
+FILTER_POLICY_ACCEPT_ALL = 0x00
+FILTER_POLICY_ACCEPT_LIST = 0x01
+# Address_Type of HCI_LE_Add_Device_To_Filter_Accept_List
+ACCEPT_LIST_ADDR_TYPES = {'public': 0x00, 'random': 0x01}
+DEFAULT_SCAN_INTERVAL = 0x0010 # 10 ms
+DEFAULT_SCAN_WINDOW = 0x0010   # 10 ms, scanning all the time
+# LE_Scan_Interval and LE_Scan_Window are in units of 0.625 ms, from 2.5 ms to
+# 10.24 sec, or 40.96 sec with extended scanning.
+SCAN_TIME_UNIT = 0.625 # ms
+MIN_SCAN_TIME = 0x0004
+MAX_SCAN_TIME = 0x4000
+MAX_EXT_SCAN_TIME = 0xFFFF
+
+
+def check_scan_timing(interval: int, window: int, extended: bool = False):
+    """Raise ValueError if the scan interval and window, in SCAN_TIME_UNIT, 
+    are not accepted by the controller."""
+    max_time = MAX_EXT_SCAN_TIME if extended else MAX_SCAN_TIME
+    for name, value in (('interval', interval), ('window', window)):
+        if not MIN_SCAN_TIME <= value <= max_time:
+            raise ValueError("Scan {} of {} ms out of {} to {} ms".format(
+                name, value * SCAN_TIME_UNIT, MIN_SCAN_TIME * SCAN_TIME_UNIT, 
+                max_time * SCAN_TIME_UNIT))
+    if window > interval:
+        raise ValueError("Scan window of {} ms longer than the interval of {} ms".format(
+            window * SCAN_TIME_UNIT, interval * SCAN_TIME_UNIT))
+
+
+class LeAdvReport:
+    """A report of HCI_LE_Advertising_Report.
+
+    addr - Upper case
+    data - AdvData or ScanRspData, a slice of the received event, see 
+           gap_data.decode_ad_structs()
+    """
+    __slots__ = ('evt_type', 'addr_type', 'addr', 'data', 'rssi')
+
+    def __init__(self, evt_type: int, addr_type: str, addr: str, data: bytes, rssi: int):
+        self.evt_type = evt_type
+        self.addr_type = addr_type
+        self.addr = addr
+        self.data = data
+        self.rssi = rssi
+
+    @property
+    def connectable(self) -> bool:
+        return self.evt_type in CONNECTABLE_EVT_TYPES
+
+    @property
+    def scan_rsp(self) -> bool:
+        return self.evt_type == SCAN_RSP
+
+
+class LeExtAdvReport:
+    """A report of HCI_LE_Extended_Advertising_Report.
+
+    addr     - Upper case, None for an anonymous advertisement
+    sid      - Advertising_SID, 0xFF if there is no ADI
+    tx_power - dBm, 127 if not available
+    data     - A fragment of the advertising data until reassembled, see 
+               ExtAdvReassembler
+    """
+    __slots__ = ('evt_type', 'addr_type', 'addr', 'primary_phy', 'secondary_phy', 'sid',
+                 'tx_power', 'rssi', 'periodic_adv_interval', 'direct_addr_type',
+                 'direct_addr', 'data')
+
+    def __init__(self, evt_type: int, addr_type: str | None, addr: str | None, 
+                 primary_phy: int, secondary_phy: int, sid: int, tx_power: int, rssi: int,
+                 periodic_adv_interval: int, direct_addr_type: int, direct_addr: str,
+                 data: bytes):
+        self.evt_type = evt_type
+        self.addr_type = addr_type
+        self.addr = addr
+        self.primary_phy = primary_phy
+        self.secondary_phy = secondary_phy
+        self.sid = sid
+        self.tx_power = tx_power
+        self.rssi = rssi
+        self.periodic_adv_interval = periodic_adv_interval
+        self.direct_addr_type = direct_addr_type
+        self.direct_addr = direct_addr
+        self.data = data
+
+    @property
+    def connectable(self) -> bool:
+        return bool(self.evt_type & EXT_EVT_CONNECTABLE)
+
+    @property
+    def scan_rsp(self) -> bool:
+        return bool(self.evt_type & EXT_EVT_SCAN_RSP)
+
+    @property
+    def legacy(self) -> bool:
+        return bool(self.evt_type & EXT_EVT_LEGACY)
+
+    @property
+    def data_status(self) -> int:
+        return (self.evt_type & EXT_EVT_DATA_STATUS_MSK) >> EXT_EVT_DATA_STATUS_POS
+
+
+def parse_le_adv_reports(params: bytes) -> list[LeAdvReport]:
+    """Parse the parameters of HCI_LE_Advertising_Report, from Subevent_Code.
+
+    The reports of a multi-report event are laid out one after another:
+        Event_Type | Address_Type | Address (6) | Data_Length | Data | RSSI
+    A truncated report ends the parsing.
+    """
+    reports = []
+    num_reports = params[1]
+    offset = 2
+    for _ in range(num_reports):
+        if offset + 9 > len(params):
+            break
+        evt_type, addr_type = params[offset], params[offset+1]
+        addr = params[offset+2:offset+8][::-1].hex(':').upper()
+        data_len = params[offset+8]
+        data_end = offset + 9 + data_len
+        if data_end + 1 > len(params):
+            logger.debug("Truncated HCI_LE_Advertising_Report: {}".format(bytes(params)))
+            break
+        rssi = params[data_end] - 256 if params[data_end] > 127 else params[data_end]
+        reports.append(LeAdvReport(evt_type, ADDR_TYPE_NAMES.get(addr_type, 'random'), addr,
+                                   params[offset+9:data_end], rssi))
+        offset = data_end + 1
+    return reports
+
+
+def parse_le_ext_adv_reports(params: bytes) -> list[LeExtAdvReport]:
+    """Parse the parameters of HCI_LE_Extended_Advertising_Report, from 
+    Subevent_Code.
+
+    As for HCI_LE_Advertising_Report, the reports are laid out one after 
+    another, each one being:
+        Event_Type (2) | Address_Type | Address (6) | Primary_PHY | Secondary_PHY |
+        Advertising_SID | TX_Power | RSSI | Periodic_Advertising_Interval (2) |
+        Direct_Address_Type | Direct_Address (6) | Data_Length | Data
+    """
+    reports = []
+    num_reports = params[1]
+    offset = 2
+    for _ in range(num_reports):
+        if offset + 24 > len(params):
+            break
+        evt_type, addr_type, addr, primary_phy, secondary_phy, sid, tx_power, rssi, \
+            periodic_adv_interval, direct_addr_type, direct_addr, data_len = \
+            struct.unpack_from('<HB6sBBBbbHB6sB', params, offset)
+        data_end = offset + 24 + data_len
+        if data_end > len(params):
+            logger.debug("Truncated HCI_LE_Extended_Advertising_Report: {}".format(bytes(params)))
+            break
+        if addr_type == ADDR_TYPE_ANONYMOUS:
+            addr_type = addr = None
+        else:
+            addr_type = ADDR_TYPE_NAMES.get(addr_type, 'random')
+            addr = addr[::-1].hex(':').upper()
+        reports.append(LeExtAdvReport(evt_type, addr_type, addr, primary_phy, secondary_phy, 
+                                      sid, tx_power, rssi, periodic_adv_interval, 
+                                      direct_addr_type, direct_addr[::-1].hex(':').upper(),
+                                      params[offset+24:data_end]))
+        offset = data_end
+    return reports
+
+
+class ReassemblyBuf:
+    __slots__ = ('data', 'length', 'overflow')
+
+    def __init__(self):
+        self.data = bytearray(MAX_EXT_ADV_DATA_LEN)
+        self.length = 0
+        self.overflow = False
+
+
+class ExtAdvReassembler:
+    """Reassemble the advertising data a controller reports in fragments, as
+    HCI_LE_Extended_Advertising_Report with the data status "incomplete, more
+    data to come" followed by a complete or truncated one.
+
+    The fragments are gathered per (addr, SID, scan response or not) in 
+    buffers of MAX_EXT_ADV_DATA_LEN bytes. The buffers come from a pool of 
+    pool_size buffers and return to it once their data is delivered. When all 
+    of them are in use, the least recently started reassembly is dropped, so 
+    memory stays at pool_size * MAX_EXT_ADV_DATA_LEN bytes however many 
+    devices advertise.
+    """
+    def __init__(self, pool_size: int = EXT_ADV_REASSEMBLY_POOL_SIZE):
+        if pool_size <= 0:
+            raise ValueError("pool_size must be > 0")
+
+        self.pool_size = pool_size
+        self.pending = OrderedDict()
+        self.free_bufs = []
+        self.allocated = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def feed(self, report: LeExtAdvReport) -> LeExtAdvReport | None:
+        """Return the report with the reassembled data once its last fragment 
+        is fed, None until then."""
+        status = report.data_status
+        key = (report.addr, report.sid, report.scan_rsp)
+        buf = self.pending.get(key)
+        if buf is None:
+            if status != DATA_STATUS_INCOMPLETE:
+                # Not fragmented, the data is left as is
+                if status == DATA_STATUS_TRUNCATED:
+                    self.truncated += 1
+                return report
+            buf = self.pending[key] = self.acquire()
+
+        # The fragments beyond MAX_EXT_ADV_DATA_LEN are dropped until the last one
+        n = min(len(report.data), MAX_EXT_ADV_DATA_LEN - buf.length)
+        buf.data[buf.length:buf.length+n] = report.data[:n]
+        buf.length += n
+        buf.overflow = buf.overflow or n < len(report.data)
+
+        if status == DATA_STATUS_INCOMPLETE:
+            return None
+
+        del self.pending[key]
+        if status == DATA_STATUS_TRUNCATED or buf.overflow:
+            self.truncated += 1
+        report.data = bytes(buf.data[:buf.length])
+        self.release(buf)
+        return report
+
+    def release(self, buf: ReassemblyBuf):
+        buf.length = 0
+        buf.overflow = False
+        self.free_bufs.append(buf)
+
+    def acquire(self) -> ReassemblyBuf:
+        if self.free_bufs:
+            return self.free_bufs.pop()
+        if self.allocated < self.pool_size:
+            self.allocated += 1
+            return ReassemblyBuf()
+
+        key, buf = self.pending.popitem(last=False)
+        logger.debug("Dropped the partial advertising data of {}".format(key))
+        self.dropped += 1
+        buf.length = 0
+        buf.overflow = False
+        return buf
+
+
+def hci_event_socket(devid: int, evt_codes: list[int]) -> socket.socket:
+    """Open a raw HCI socket on an HCI device, only receiving the events of 
+    the given codes."""
+    sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW, socket.BTPROTO_HCI)
+    try:
+        sock.bind((devid,))
+        event_mask = 0
+        for evt_code in evt_codes:
+            event_mask |= 1 << evt_code
+        # struct hci_ufilter: uint32 type_mask, uint32 event_mask[2], 
+        # uint16 opcode, in host byte order and padded to 16 bytes
+        sock.setsockopt(socket.SOL_HCI, socket.HCI_FILTER, 
+                        struct.pack('IIIH2x', 1 << HCI_EVENT_PKT, event_mask & 0xFFFFFFFF,
+                                    event_mask >> 32, 0))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def hci_le_cmd(devid: int, ocf: int, params: bytes, timeout: float = 2) -> int:
+    """Send an LE controller command that bthci does not provide, on a raw HCI 
+    socket, and return the Status of its HCI_Command_Complete or 
+    HCI_Command_Status event.
+    """
+    return hci_le_cmd_return(devid, ocf, params, timeout)[0]
+
+
+def hci_le_cmd_return(devid: int, ocf: int, params: bytes, timeout: float = 2) -> bytes:
+    """Same as hci_le_cmd(), but return all the Return_Parameters of the 
+    HCI_Command_Complete event, Status first. Only the Status for an 
+    HCI_Command_Status event.
+    """
+    opcode = (OGF_LE_CTL << 10) | ocf
+    with hci_event_socket(devid, [HCI_CMD_COMPLETE_EVT_CODE, HCI_CMD_STATUS_EVT_CODE]) as sock:
+        sock.settimeout(timeout)
+        sock.send(struct.pack('<BHB', HCI_COMMAND_PKT, opcode, len(params)) + params)
+        while True:
+            event = sock.recv(HCI_MAX_EVENT_SIZE)
+            if event[1] == HCI_CMD_COMPLETE_EVT_CODE and len(event) >= 7 and \
+                int.from_bytes(event[4:6], 'little') == opcode:
+                return event[6:3+event[2]]
+            if event[1] == HCI_CMD_STATUS_EVT_CODE and len(event) >= 7 and \
+                int.from_bytes(event[5:7], 'little') == opcode:
+                return event[3:4]
+
+
+@contextmanager
+def peers_in_accept_list(iface: str, addrs: list[str], addr_types: dict[str, str] = None):
+    """Add the addresses to the filter accept list of the controller for the 
+    duration of the with block. Yield whether all of them were added, none 
+    is added if the list is too small for all of them.
+
+    addr_types - addr -> 'public' or 'random', for the addresses whose type 
+                 is known. The others are added as public and as random 
+                 addresses.
+
+    The other entries of the list, e.g. those of bluetoothd, are left alone.
+    """
+    if addr_types is None:
+        addr_types = {}
+    entries = [(ACCEPT_LIST_ADDR_TYPES[addr_type], addr) for addr in addrs 
+               for addr_type in ((addr_types[addr],) if addr in addr_types else 
+                                 ('public', 'random'))]
+
+    devid = HCI.hcistr2devid(iface)
+    added = []
+    try:
+        if entries:
+            ret = hci_le_cmd_return(devid, HCI_LE_READ_FILTER_ACCEPT_LIST_SIZE_OCF, b'')
+            if ret[0] != ControllerErrorCodes.SUCCESS or len(ret) < 2:
+                raise OSError("HCI_LE_Read_Filter_Accept_List_Size returned, status: "
+                              "0x{:02x}".format(ret[0]))
+            if len(entries) > ret[1]:
+                raise OSError("{} entries needed, but the list holds {}".format(
+                    len(entries), ret[1]))
+
+        for addr_type, addr in entries:
+            status = hci_le_cmd(devid, HCI_LE_ADD_DEVICE_TO_FILTER_ACCEPT_LIST_OCF, 
+                                struct.pack('<B6s', addr_type, bytes.fromhex(addr.replace(':', ''))[::-1]))
+            if status != ControllerErrorCodes.SUCCESS:
+                raise OSError("HCI_LE_Add_Device_To_Filter_Accept_List returned {}, status: "
+                              "0x{:02x}".format(addr, status))
+            added.append((addr_type, addr))
+    except OSError as e:
+        logger.warning("Failed to load the filter accept list of {}: {}".format(iface, e))
+
+    try:
+        yield len(added) == len(entries)
+    finally:
+        for addr_type, addr in added:
+            try:
+                status = hci_le_cmd(devid, HCI_LE_REMOVE_DEVICE_FROM_FILTER_ACCEPT_LIST_OCF, 
+                                    struct.pack('<B6s', addr_type, bytes.fromhex(addr.replace(':', ''))[::-1]))
+                if status != ControllerErrorCodes.SUCCESS:
+                    raise OSError("status: 0x{:02x}".format(status))
+            except OSError as e:
+                logger.warning("Failed to remove {} from the filter accept list of {}: {}".format(
+                    addr, iface, e))
+
+
+class HciLeScanner:
+    def __init__(self, iface: str = 'hci0'):
+        self.iface = iface
+        self.devid = HCI.hcistr2devid(iface)
+
+    @staticmethod
+    def check_status(status: int, cmd_name: str):
+        if status != ControllerErrorCodes.SUCCESS:
+            try:
+                name = ControllerErrorCodes(status).name
+            except ValueError:
+                name = 'Unknown'
+            raise RuntimeError("{} returned, status: 0x{:02x} - {}".format(
+                cmd_name, status, name))
+
+    def set_scan_enable(self, hci: HCI, enable: bool, filter_dup: bool, extended: bool) -> int:
+        if extended:
+            # Enable, Filter_Duplicates, Duration and Period of 0, scanning until disabled
+            return hci_le_cmd(self.devid, HCI_LE_SET_EXTENDED_SCAN_ENABLE_OCF, 
+                              struct.pack('<BBHH', enable, filter_dup, 0, 0))
+        else:
+            return hci.le_set_scan_enable(int(enable), int(filter_dup)).status
+
+    def reports(self, scan_type: str = 'active', timeout: float = None, filter_dup: bool = False,
+                interval: int = DEFAULT_SCAN_INTERVAL, window: int = DEFAULT_SCAN_WINDOW,
+                filter_policy: int = FILTER_POLICY_ACCEPT_ALL, extended: bool = False,
+                stop: threading.Event = None, phys: tuple[str, ...] = ('1m',),
+                idle: bool = False):
+        """Scan for timeout sec, until stop is set or until interrupted, and 
+        yield a LeAdvReport for each report of the received 
+        HCI_LE_Advertising_Report events.
+
+        interval, window - LE_Scan_Interval and LE_Scan_Window, in 
+                           SCAN_TIME_UNIT
+        phys             - Primary advertising PHYs to scan on, keys of 
+                           SCANNING_PHYS. Only the LE 1M PHY without extended.
+        idle             - Also yield None each time nothing is received for 
+                           RECV_POLL_INTERVAL sec, for the caller to run its 
+                           periodic work when nothing is advertising.
+
+        With extended, scan with the extended scanning commands, which the 
+        controller answers with HCI_LE_Extended_Advertising_Report events, and
+        yield a LeExtAdvReport for each reassembled report instead. Scanning 
+        on both PHYs, the controller scans each with interval and window in 
+        turn.
+
+        The events are received on a raw HCI socket of our own, waiting at 
+        most RECV_POLL_INTERVAL sec at a time, so the timeout and stop are 
+        honored even if nothing is advertising.
+        """
+        if scan_type not in LE_SCAN_TYPES:
+            raise ValueError("Invalid scan type: {}".format(scan_type))
+        check_scan_timing(interval, window, extended)
+        if len(phys) == 0 or not set(phys).issubset(SCANNING_PHYS):
+            raise ValueError("Invalid scanning PHYs: {}".format(phys))
+        if not extended and set(phys) != {'1m'}:
+            raise ValueError("Scanning on the LE Coded PHY needs extended scanning")
+
+        reassembler = ExtAdvReassembler()
+        # Opened first, not to miss the reports following the scan enable
+        sock = hci_event_socket(self.devid, [HCI_LE_META_EVT_CODE])
+        hci = None
+        try:
+            hci = HCI(self.iface)
+
+            # Stop a scan left running, its status is irrelevant
+            self.set_scan_enable(hci, False, False, extended)
+            if extended:
+                # Own_Address_Type, Scanning_Filter_Policy, Scanning_PHYs, then 
+                # Scan_Type, Scan_Interval and Scan_Window of each PHY, in the 
+                # order of their bits
+                phy_bits = 0
+                phy_params = b''
+                for name, phy in sorted(SCANNING_PHYS.items(), key=lambda item: item[1]):
+                    if name in phys:
+                        phy_bits |= phy
+                        phy_params += struct.pack('<BHH', LE_SCAN_TYPES[scan_type], 
+                                                  interval, window)
+                self.check_status(hci_le_cmd(self.devid, HCI_LE_SET_EXTENDED_SCAN_PARAMETERS_OCF, 
+                    struct.pack('<BBB', 0x00, filter_policy, phy_bits) + phy_params),
+                    'HCI_LE_Set_Extended_Scan_Parameters')
+            else:
+                self.check_status(hci.le_set_scan_parameters(
+                    LE_SCAN_TYPES[scan_type], interval, window, 0x00, filter_policy).status,
+                    'hci.le_set_scan_parameters()')
+            self.check_status(self.set_scan_enable(hci, True, filter_dup, extended),
+                              'HCI_LE_Set_Extended_Scan_Enable' if extended else 
+                              'hci.le_set_scan_enable()')
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while stop is None or not stop.is_set():
+                wait = RECV_POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        break
+                sock.settimeout(wait)
+                try:
+                    # Packet type indicator, then the event
+                    event = memoryview(sock.recv(HCI_MAX_EVENT_SIZE))[1:]
+                except socket.timeout:
+                    if idle:
+                        yield None
+                    continue
+
+                if len(event) < 4 or event[0] != HCI_LE_META_EVT_CODE:
+                    continue
+
+                if event[2] == HCI_LE_ADVERTISING_REPORT_SUBEVT_CODE:
+                    yield from parse_le_adv_reports(bytes(event[2:2+event[1]]))
+                elif event[2] == HCI_LE_EXTENDED_ADVERTISING_REPORT_SUBEVT_CODE:
+                    for report in parse_le_ext_adv_reports(bytes(event[2:2+event[1]])):
+                        report = reassembler.feed(report)
+                        if report is not None:
+                            yield report
+        finally:
+            if extended:
+                logger.debug("Extended advertising data: {} truncated, {} dropped "
+                             "reassemblies".format(reassembler.truncated, reassembler.dropped))
+            try:
+                if hci is not None:
+                    try:
+                        self.set_scan_enable(hci, False, False, extended)
+                    finally:
+                        hci.close()
+            finally:
+                sock.close()
+
+
+class MultiHciLeScanner:
+    """Scan on several HCI devices at once, one thread per device, and merge
+    their reports in the order they are received.
+
+    The devices start scanning interval / len(ifaces) apart, so that while 
+    each one cycles through the primary advertising channels, they listen 
+    on different channels at any time instead of the same one.
+    """
+    def __init__(self, ifaces: list[str]):
+        if len(ifaces) == 0:
+            raise ValueError("No HCI device to scan on")
+        self.ifaces = ifaces
+
+    def reports(self, scan_type: str = 'active', timeout: float = None, filter_dup: bool = False,
+                interval: int = DEFAULT_SCAN_INTERVAL, window: int = DEFAULT_SCAN_WINDOW,
+                filter_policy: int = FILTER_POLICY_ACCEPT_ALL, extended: bool = False,
+                phys: tuple[str, ...] = ('1m',), idle: bool = False):
+        """Same as HciLeScanner.reports(), but yield (iface, report), or None 
+        when idle.
+
+        Raise RuntimeError when the scan on one of the HCI devices fails.
+        """
+        stop = threading.Event()
+        received = queue.Queue(MULTI_SCAN_QUEUE_SIZE)
+        errors = []
+        stagger = interval * 0.000625 / len(self.ifaces) # sec
+
+        def scan(idx: int, iface: str):
+            try:
+                if stop.wait(idx * stagger):
+                    return
+                for report in HciLeScanner(iface).reports(scan_type, None, filter_dup, interval, 
+                                                          window, filter_policy, extended, stop,
+                                                          phys):
+                    while not stop.is_set():
+                        try:
+                            received.put((iface, report), timeout=RECV_POLL_INTERVAL)
+                            break
+                        except queue.Full:
+                            continue
+            except Exception as e:
+                errors.append((iface, e))
+
+        threads = [threading.Thread(target=scan, args=(idx, iface), daemon=True, 
+                                    name='{}-scan'.format(iface))
+                   for idx, iface in enumerate(self.ifaces)]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for thread in threads:
+                thread.start()
+
+            while not errors:
+                wait = RECV_POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        break
+                try:
+                    yield received.get(timeout=wait)
+                except queue.Empty:
+                    if idle:
+                        yield None
+                    continue
+
+            if errors:
+                iface, e = errors[0]
+                raise RuntimeError("Scanning on {} failed, {}: {}".format(
+                    iface, e.__class__.__name__, e))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
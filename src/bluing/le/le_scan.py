@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 
 import sys
-import pickle
+import time
+import signal
+import sqlite3
+import threading
+from datetime import datetime
+from contextlib import ExitStack
+from collections.abc import Iterable
 
 from bluepy.btle import Scanner
 from bluepy.btle import DefaultDelegate
@@ -13,25 +19,36 @@ from bthci import HCI, ControllerErrorCodes, HciRuntimeError, ADDR_TYPE_PUBLIC
 from btsm import SecurityManager
 from btsm.commands import OOBDataFlags, BondingFlags, AuthReq, KeyDist
 from xpycommon.log import Logger
-from xpycommon.ui import blue, green, red, INDENT
+from xpycommon.ui import blue, green, red
 
 from .. import ScanResult
-from ..common import bdaddr_to_company_name
-from ..gap_data import SERVICE_DATA_128_BIT_UUID, SERVICE_DATA_16_BIT_UUID, SERVICE_DATA_32_BIT_UUID, gap_type_names, company_names, \
-    COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS, INCOMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS, \
-    COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS, INCOMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS,\
-    COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS, INCOMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS, \
-    TX_POWER_LEVEL, MANUFACTURER_SPECIFIC_DATA, FLAGS
-
-from . import LE_DEVS_SCAN_RESULT_CACHE, LOG_LEVEL
+from ..common import bdaddr_to_company_name, bdaddrs_to_company_names
+from ..gap_data import decode_ad_structs, intern_ad_record, intern_ad_structs, \
+    pp_ad_records, TX_POWER_LEVEL
+
+from . import LOG_LEVEL
+from .addr_type_cache import addr_type_cache
+from .device_table import LeDeviceTable, LeDeviceEntry
+from .rpa import RpaResolver, Identity
+from .addr_linker import AddrLinker, AddrCluster, MIN_ROTATION_SILENCE
+from .discovery_latency import DiscoveryLatencyReport
+from .proximity import ProximityEstimator
 from .serial_protocol import serial_reset
-from .serial_protocol import SerialEventHandler
+from .serial_protocol import SerialEventHandler, SerialMultiplexer
+from .sniff_pipeline import SniffPipeline, SniffSink, ConsoleSink, StatsSink, \
+    SNIFF_QUEUE_SIZE, DROP_NEWEST
 
 logger = Logger(__name__, LOG_LEVEL)
 
 microbit_infos = {}
 
 
+# Duration of each Scanner.process() call of a continuous scan, which is also
+# the period of device table eviction.
+CONTINUOUS_SCAN_PROCESS_INTERVAL = 1.0
+FIND_ADDR_TYPE_TIMEOUT = 3
+
+
 # 这个字典暂时没用，以后可能用来判断收到的 advertising 类型
 HCI_LE_ADVERTISING_REPORT_EVENT_EVENT_TYPE_DESCPS = {
     0x00: "Connectable undirected advertising (ADV_IND, 0x00)",
@@ -41,19 +58,17 @@ HCI_LE_ADVERTISING_REPORT_EVENT_EVENT_TYPE_DESCPS = {
     0x04: "Scan Response (SCAN_RSP, 0x04)"
 }
 
-class AdStruct:
-    def __init__(self, type: int, value: bytes) -> None:
-        self.length = None
-        self.type = type
-        self.value = value
-
-
 class LEDelegate(DefaultDelegate):
     def __init__(self):
         DefaultDelegate.__init__(self)
+        # Upper case addr -> [first seen time, last seen time], bluepy does 
+        # not keep them.
+        self.seen = {}
     
     def handleDiscovery(self, scanEntry, isNewDev, isNewData):
         # a callback function
+        now = time.time()
+        self.seen.setdefault(scanEntry.addr.upper(), [now, now])[1] = now
         if isNewDev:
             #print("[LE scan] discovered new device")
             pass
@@ -62,128 +77,145 @@ class LEDelegate(DefaultDelegate):
             pass
 
 
+class ContinuousScanDelegate(DefaultDelegate):
+    """Queue the advertising reports handled by one Scanner.process() call."""
+    def __init__(self):
+        DefaultDelegate.__init__(self)
+        self.reports = []
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        self.reports.append((scanEntry, isNewDev or isNewData))
+
+
 class LeDeviceInfo:
-    def __init__(self, addr: str, addr_type: str, connectable : bool, rssi : int) -> None:
+    __slots__ = ('addr', 'addr_type', 'connectable', 'rssi', 'adapters', 'identity',
+                 'cluster', 'ad_structs', 'first_seen')
+
+    def __init__(self, addr: str, addr_type: str, connectable : bool, rssi : int,
+                 adapters: dict = None, identity: Identity = None) -> None:
         """
-        addr - Upper case
+        addr       - Upper case
+        adapters   - Latest RSSI seen by each HCI device, iface -> RSSI, when 
+                     scanning on several of them
+        identity   - Identity of an RPA resolved by a known IRK
+        cluster    - AddrCluster of the addresses linked to this one
+        ad_structs - Tuple of interned AdRecords, shared by the devices 
+                     advertising the same data
+        first_seen - time.time() of its first advertising report
         """
         self.addr = addr.upper()
         self.addr_type = addr_type
         self.connectable = connectable
         self.rssi = rssi
-        self.ad_structs = []
-        
-    def add_ad_structs(self, ad: AdStruct):
-        self.ad_structs.append(ad)
+        self.adapters = {} if adapters is None else adapters
+        self.identity = identity
+        self.cluster = None
+        self.ad_structs = ()
+        self.first_seen = None
+
+    def to_dict(self) -> dict:
+        return {'record': 'le_device', 'addr': self.addr, 'addr_type': self.addr_type,
+                'connectable': self.connectable, 'rssi': self.rssi, 'adapters': self.adapters,
+                'identity': None if self.identity is None else self.identity.to_dict(),
+                'cluster': None if self.cluster is None else self.cluster.id,
+                'first_seen': self.first_seen,
+                'ad_structs': [ad.to_dict() for ad in self.ad_structs]}
 
 
 class LeDevicesScanResult(ScanResult):
     def __init__(self) -> None:
         super().__init__('LE Devices')
         self.devices_info = []
+        self.linked_clusters = []
+        self.latency_report = None
     
     def add_device_info(self, info: LeDeviceInfo):
+        """Add a device with its AD structures."""
         self.devices_info.append(info)
+        self.emit(info.to_dict())
+
+    def add_linked_clusters(self, clusters: list[AddrCluster]):
+        """Add the clusters of the addresses linked together."""
+        self.linked_clusters.extend(clusters)
+        for cluster in clusters:
+            self.emit(cluster.to_dict())
+
+    def add_latency_report(self, report: DiscoveryLatencyReport):
+        self.latency_report = report
+        self.emit(report.to_dict())
         
     def print(self):
-        for dev_info in self.devices_info:
+        oui_names = bdaddrs_to_company_names(
+            dev_info.addr for dev_info in self.devices_info)
+
+        for dev_info, oui_name in zip(self.devices_info, oui_names):
             print('Addr:       ', blue(dev_info.addr), 
-                  "("+bdaddr_to_company_name(dev_info.addr)+")" if dev_info.addr_type == 'public' else "")
+                  "("+oui_name+")" if dev_info.addr_type == 'public' else "")
             print('Addr type:  ', blue(dev_info.addr_type))
+            if dev_info.identity is not None:
+                print('Identity:   ', green(str(dev_info.identity)))
+            if dev_info.cluster is not None and len(dev_info.cluster.addrs) > 1:
+                print('Linked:     ', ', '.join(blue(addr) for addr in dev_info.cluster.addrs 
+                                                if addr != dev_info.addr), 
+                      "(device #{})".format(dev_info.cluster.id))
             print('Connectable:', 
                 green('True') if dev_info.connectable else red('False'))
             print("RSSI:        {} dBm".format(dev_info.rssi))
+            if dev_info.adapters:
+                print("Adapters:   ", ', '.join("{} {} dBm".format(blue(iface), rssi) 
+                                                for iface, rssi in dev_info.adapters.items()))
             print("General Access Profile:")
-            
-            # TODO: Unify the gap type name parsings of BR and LE
-            for ad in dev_info.ad_structs:
-                try:
-                    type_names = gap_type_names[ad.type]
-                except KeyError:
-                    type_names = "0x{:02X} ".format(ad.type)+"("+ red("Unknown")+")"
-
-                print(INDENT+"{}: ".format(type_names), end='')
-                # print(INDENT+"0x{:02X} ({}): ".format(ad.type, type_names), end='')
-                
-                # Parses AD structure based on https://www.bluetooth.com/specifications/specs/
-                # -> Core Specification Supplement
-                if ad.type == COMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS or \
-                    ad.type == INCOMPLETE_LIST_OF_16_BIT_SERVICE_CLASS_UUIDS:
-                    print()
-                    for uuid in ad.value.split(','):
-                        if len(uuid) == 36:
-                            # 这里拿到的是完整的 128-bit uuid，但我们需要 16-bit uuid。
-                            print(INDENT*2 + blue("0x"+uuid[4:8].upper()))
-                        else:
-                            print(INDENT*2 + blue(uuid))
-                elif ad.type == COMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS or \
-                    ad.type == INCOMPLETE_LIST_OF_32_BIT_SERVICE_CLASS_UUIDS:
-                    print()
-                    for uuid in ad.value.split(','): 
-                        if len(uuid) == 36:
-                            # 这里拿到的是完整的 128-bit uuid，但我们需要 32-bit uuid。
-                            print(INDENT*2 + blue("0x"+uuid[0:8].upper()))
-                        else:
-                            print(INDENT*2 + blue(uuid))
-                elif ad.type == COMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS or \
-                    ad.type == INCOMPLETE_LIST_OF_128_BIT_SERVICE_CLASS_UUIDS:
-                        print()
-                        for uuid in ad.value.split(','): 
-                            print(INDENT*2 + blue(uuid).upper())
-                elif ad.type == SERVICE_DATA_16_BIT_UUID:
-                    print()
-                    print(INDENT*2 + "UUID: 0x{}".format(ad.value[0:2*2].upper()))
-                    print(INDENT*2 + "Data:", ad.value[2*2:])
-                elif ad.type == SERVICE_DATA_32_BIT_UUID:
-                    print()
-                    print(INDENT*2 + "UUID: {}".format(ad.value[0:4*2].upper()))
-                    print(INDENT*2 + "Data:", ad.value[4*2:])
-                elif ad.type == SERVICE_DATA_128_BIT_UUID:
-                    print()
-                    print(INDENT*2 + "UUID: {}".format(ad.value[0:16*2].upper()))
-                    print(INDENT*2 + "Data: ", ad.value[16*2:])
-                elif ad.type == FLAGS:
-                    print()
-                    try:
-                        value = bytes.fromhex(ad.value)
-                        print(INDENT*2 + "LE Limited Discoverable Mode\n" if value[0] & 0x01 else "", end="")
-                        print(INDENT*2 + "LE General Discoverable Mode\n" if value[0] & 0x02 else "", end="")
-                        print(INDENT*2 + "BR/EDR Not Supported\n" if value[0] & 0x04 else "", end="") # Bit 37 of LMP Feature Mask Definitions (Page 0)
-                        print(INDENT*2 + "Simultaneous LE + BR/EDR to Same Device Capable (Controller)\n" if value[0] & 0x08 else "", end="") # Bit 49 of LMP Feature Mask Definitions (Page 0)
-                        print(INDENT*2 + "Simultaneous LE + BR/EDR to Same Device Capable (Host)\n" if value[0] & 0x10 else "", end="") # Bit 66 of LMP Feature Mask Definitions (Page 1)
-                    except (ValueError, IndexError) as e:
-                        logger.debug("LeDevicesScanResult.print(), parse ad.type == FLAGS")
-                        print(ad.value, "("+red("Raw")+")")
-                elif ad.type == MANUFACTURER_SPECIFIC_DATA:
-                    value = bytes.fromhex(ad.value)
-                    company_id = int.from_bytes(value[0:2], 'little', signed=False)
-                    try:
-                        company_name = blue(company_names[company_id])
-                    except KeyError:
-                        company_name = red("Unknown")
-                    
-                    if len(value) >= 2:
-                        print()
-                        print(INDENT*2+"Company ID:", '0x{:04X} ({})'.format(company_id,company_name))
-                        try:
-                            
-                            print(INDENT*2+'Data:      ', ''.join(["{:02X}".format(b) for b in value[2:]]))
-                        except IndexError:
-                            print(INDENT*2+'Data:', None)
-                    else:
-                        print(value)
-                elif ad.type == TX_POWER_LEVEL:
-                    value = int.from_bytes(bytes.fromhex(ad.value), 'little', signed=True)
-                    print(value, "dBm", "(pathloss {} dBm)".format(value - dev_info.rssi))
-                else:
-                    print(ad.value)
+            pp_ad_records(dev_info.ad_structs, dev_info.rssi)
 
             print()  
             print() # Two empty lines before next LE device information
 
+        if self.linked_clusters:
+            num_linked_addrs = sum(len(cluster.addrs) for cluster in self.linked_clusters)
+            print("{} addresses, {} devices once the {} rotating addresses are linked".format(
+                len(self.devices_info), 
+                len(self.devices_info) - num_linked_addrs + len(self.linked_clusters),
+                num_linked_addrs))
+
+        if self.latency_report is not None:
+            print()
+            self.latency_report.print()
+
     def store(self):
-        with open(LE_DEVS_SCAN_RESULT_CACHE, 'wb') as result_file:
-            pickle.dump(self, result_file)
+        """Merge the devices into the LE address type cache."""
+        try:
+            addr_type_cache.update((dev_info.addr, dev_info.addr_type, dev_info.rssi, None)
+                                   for dev_info in self.devices_info)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Failed to update the LE address type cache {}: {}".format(
+                addr_type_cache.path, e))
+
+
+def pp_dev_seen(entry: LeDeviceEntry):
+    """Print a device newly added to the live device table."""
+    print("[{}] {} {:<7} {:>4} dBm {}".format(
+        datetime.fromtimestamp(entry.first_seen).strftime('%Y-%m-%d %H:%M:%S'), 
+        green('+'), entry.addr_type, entry.rssi, blue(entry.addr)), 
+        "("+bdaddr_to_company_name(entry.addr)+")" if entry.addr_type == 'public' else 
+        "-> " + green(str(entry.identity)) if entry.identity is not None else "",
+        "(rotated from {})".format(blue(entry.cluster.addrs[-2])) 
+        if entry.cluster is not None and len(entry.cluster.addrs) > 1 
+        and entry.cluster.addrs[-1] == entry.addr else "")
+
+
+def pp_addrs_linked(cluster: AddrCluster, merged: AddrCluster):
+    """Print a new address linked to the previous address of a device."""
+    print("[{}] {} {} rotated to {}".format(
+        datetime.fromtimestamp(merged.first_seen).strftime('%Y-%m-%d %H:%M:%S'), 
+        blue('~'), blue(cluster.addrs[-len(merged.addrs)-1]), blue(merged.addrs[0])))
+
+
+def pp_dev_lost(entry: LeDeviceEntry):
+    """Print a device evicted from the live device table."""
+    print("[{}] {} {:<7} {:>4} dBm {}, {} reports in {:.0f} sec".format(
+        datetime.fromtimestamp(entry.last_seen).strftime('%Y-%m-%d %H:%M:%S'), 
+        red('-'), entry.addr_type, entry.rssi, blue(entry.addr), entry.update_count,
+        entry.last_seen - entry.first_seen))
 
 
 class LeScanner:
@@ -194,62 +226,194 @@ class LeScanner:
     2. LL features scanning
     3. Advertising physical channel PDU sniffing.
     """
-    def __init__(self, iface: str ='hci0', microbit_devpaths=None):
+    def __init__(self, iface: str ='hci0', microbit_devpaths=None, 
+                 resolver: RpaResolver = None, proximity: ProximityEstimator = None):
         """
         hci               - HCI device for scaning LE devices and LL features.
         microbit_devpaths - When sniffing advertising physical channel PDU, we 
                             need at least one micro:bit.
+        resolver          - Resolve the RPAs scanned or sniffed to the 
+                            identities of its IRKs.
+        proximity         - Fed with the RSSIs seen by each HCI device during a 
+                            continuous scan, ticked every 
+                            CONTINUOUS_SCAN_PROCESS_INTERVAL sec.
         """
         self.devs_scan_result = LeDevicesScanResult()
         self.iface = iface
         self.devid = HCI.hcistr2devid(self.iface)
         self.microbit_devpaths = microbit_devpaths
+        self.resolver = resolver
+        self.proximity = proximity
+        self.sniffer = None
+
+    def add_devs(self, devs_info: list[LeDeviceInfo], seen: dict[str, tuple[float, float]]):
+        """Resolve the RPAs and link the rotating addresses of the devices 
+        scanned, then add them to the scan result.
+
+        seen - addr -> (first seen time, last seen time)
+        """
+        identities = self.resolve_rpas((info.addr, info.addr_type) for info in devs_info)
+
+        linker = AddrLinker()
+        for info in sorted(devs_info, key=lambda info: seen[info.addr][0]):
+            info.cluster = linker.link(info.addr, info.addr_type, info.ad_structs, 
+                                       *seen[info.addr])
+
+        for info in devs_info:
+            info.identity = identities.get(info.addr)
+            info.first_seen = seen[info.addr][0]
+            self.devs_scan_result.add_device_info(info)
+        self.devs_scan_result.add_linked_clusters(linker.linked_clusters())
+
+    def resolve_rpas(self, devs: Iterable[tuple[str, str]]) -> dict[str, Identity | None]:
+        """Resolve the random addresses of devs, (addr, addr_type), in a single 
+        batch and return addr -> identity."""
+        if self.resolver is None:
+            return {}
+        identities = self.resolver.resolve_many(addr for addr, addr_type in devs 
+                                                if addr_type == 'random')
+        logger.debug("RPA resolver: {}".format(self.resolver.stats()))
+        return identities
 
     @staticmethod
-    def determine_addr_type(iface: str, addr: str):
-        """For user not provide the remote LE address type."""
-        logger.debug("Entered determine_addr_type(cls, iface={}, addr={})".format(
-            iface, addr))
+    def determine_addr_type(iface: str, addr: str, timeout: float = FIND_ADDR_TYPE_TIMEOUT,
+                            accept_list: bool = False):
+        """For user not provide the remote LE address type.
+
+        timeout, accept_list - See find_addr_type()
+        """
+        logger.debug("Entered determine_addr_type(cls, iface={}, addr={}, timeout={}, "
+                     "accept_list={})".format(iface, addr, timeout, accept_list))
 
         try:
             atype = LeScanner.cached_addr_to_atype(addr)
             if atype is not None:
                 return atype
-        except FileNotFoundError:
-            logger.warning("No cached LE device information available")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("No cached LE device information available: {}".format(e))
         else:
-            logger.info("The cached LE device information dose not match")
+            logger.info("No cached LE device information of {}".format(addr))
         
-        logger.info("Start scanning nearby LE devices")
-                
-        le_devs_scan_result = LeScanner(iface).scan_devs(scan_type='passive')
-        le_devs_scan_result.store()
-        for dev_info in le_devs_scan_result.devices_info:
-            if addr == dev_info.addr:
-                return dev_info.addr_type
+        logger.info("Scanning for {} for at most {} sec".format(blue(addr), timeout))
+
+        found = LeScanner(iface).find_addr_type(addr, timeout, accept_list)
+        if found is None:
+            raise RuntimeError("Failed to automatically determine the LE address type, "
+                               "{} not seen in {} sec".format(addr, timeout))
 
-        raise RuntimeError("Failed to automatically determine the LE address type")
+        addr_type, rssi = found
+        try:
+            addr_type_cache.update([(addr, addr_type, rssi, None)])
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Failed to update the LE address type cache {}: {}".format(
+                addr_type_cache.path, e))
+        return addr_type
     
     @staticmethod
-    def cached_addr_to_atype(addr: str) -> str | None:
-        addr = addr.upper()
+    def cached_addr_types(addrs: Iterable[str]) -> dict[str, str]:
+        """Return addr -> addr type of the addresses in the LE address type 
+        cache."""
+        addr_types = {}
+        try:
+            for addr in addrs:
+                record = addr_type_cache.lookup(addr)
+                if record is not None:
+                    addr_types[addr] = record[0]
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Failed to read the LE address type cache {}: {}".format(
+                addr_type_cache.path, e))
+        return addr_types
 
-        with open(LE_DEVS_SCAN_RESULT_CACHE, 'rb') as le_devs_scan_result_cache:
-            le_devs_scan_result = pickle.load(le_devs_scan_result_cache)
-            for dev_info in le_devs_scan_result.devices_info:
-                if addr == dev_info.addr:
-                    return dev_info.addr_type
+    @staticmethod
+    def cached_addr_to_atype(addr: str) -> str | None:
+        record = addr_type_cache.lookup(addr)
+        if record is not None:
+            addr_type, rssi, last_seen = record
+            logger.debug("Cached {}: {}, {} dBm, last seen {}".format(
+                addr, addr_type, rssi, datetime.fromtimestamp(last_seen)))
+            return addr_type
+
+    def find_addr_type(self, addr: str, timeout: float = FIND_ADDR_TYPE_TIMEOUT, 
+                       accept_list: bool = False) -> tuple[str, int] | None:
+        """Passively scan until addr advertises, or for at most timeout sec, 
+        and return its (addr type, RSSI), None if it was not seen.
+
+        accept_list - Only let the controller report addr, through its filter 
+                      accept list, so the other devices do not wake us up.
+        """
+        from .hci_scan import HciLeScanner, peers_in_accept_list, \
+            FILTER_POLICY_ACCEPT_ALL, FILTER_POLICY_ACCEPT_LIST
 
-    def scan_devs(self, timeout=8, scan_type='active', sort='rssi') -> LeDevicesScanResult:
+        addr = addr.upper()
+        with peers_in_accept_list(self.iface, [addr] if accept_list else []) as listed:
+            if accept_list and not listed:
+                logger.warning("Scanning without the filter accept list")
+            reports = HciLeScanner(self.iface).reports(
+                'passive', timeout, filter_policy=FILTER_POLICY_ACCEPT_LIST 
+                if accept_list and listed else FILTER_POLICY_ACCEPT_ALL)
+            try:
+                for report in reports:
+                    if report.addr == addr:
+                        return report.addr_type, report.rssi
+            finally:
+                reports.close()
+
+    def scan_devs(self, timeout=8, scan_type='active', sort='rssi', 
+                  engine='bluepy', extended=False, writer=None, 
+                  ifaces=None, accept_list=None, filter_dup=False, 
+                  interval=None, window=None, phys=None, 
+                  latency=False) -> LeDevicesScanResult:
         """Perform LE Devices scanning and return scan reuslt as LeDevicesScanResult
 
         scan_type  - 'active' or 'passive'
+        engine     - 'bluepy' scans through the bluepy-helper process, 'hci' 
+                     scans straight on the HCI socket, see hci_scan.py.
+        extended   - Use extended scanning to also see the devices using 
+                     extended advertising, 'hci' engine only.
+        writer     - An ndjson.NdjsonWriter the devices are written to.
+        ifaces     - Scan on these HCI devices at once instead of self.iface, 
+                     'hci' engine only. Each device records the RSSI seen by 
+                     each of them.
+        accept_list - Only scan for these addresses, loaded into the filter 
+                     accept list of the controller so that it drops the 
+                     other advertisers, 'hci' engine only.
+        filter_dup - Let the controller filter the duplicate advertising 
+                     reports, 'hci' engine only.
+        interval, window - LE_Scan_Interval and LE_Scan_Window, in units of 
+                     0.625 ms, 'hci' engine only. bluepy-helper sets its own.
+        phys       - Primary advertising PHYs to scan on, '1m' and/or 'coded', 
+                     'coded' needing extended, 'hci' engine only.
+        latency    - Add a DiscoveryLatencyReport of the devices found to the 
+                     scan result.
         """
+        self.devs_scan_result.writer = writer
         if scan_type == 'active':
             logger.warning("You might want to spoof your LE address before doing "
                            "an active scan")
 
-        scanner = Scanner(self.devid).withDelegate(LEDelegate())
+        if engine == 'hci':
+            from .hci_scan import DEFAULT_SCAN_INTERVAL, DEFAULT_SCAN_WINDOW, SCAN_TIME_UNIT
+            interval = DEFAULT_SCAN_INTERVAL if interval is None else interval
+            window = DEFAULT_SCAN_WINDOW if window is None else window
+            phys = ('1m',) if phys is None else phys
+
+            start = time.time()
+            self._scan_devs_hci(timeout, scan_type, sort, extended, ifaces, 
+                                accept_list, filter_dup, interval, window, phys)
+            if latency:
+                self.add_latency_report(start, timeout, engine=engine, scan_type=scan_type, 
+                                        interval_ms=interval * SCAN_TIME_UNIT, 
+                                        window_ms=window * SCAN_TIME_UNIT, phys=','.join(phys), 
+                                        ifaces=','.join(ifaces) if ifaces else self.iface)
+            return self.devs_scan_result
+        elif engine != 'bluepy':
+            raise ValueError("Invalid scan engine: " + red(engine))
+        self.check_hci_engine_options(extended=extended, ifaces=ifaces, 
+                                      accept_list=accept_list, filter_dup=filter_dup,
+                                      interval=interval, window=window, phys=phys)
+
+        delegate = LEDelegate()
+        scanner = Scanner(self.devid).withDelegate(delegate)
         #print("[Debug] timeout =", timeout)
         
         spinner = Halo(text="Scanning", placement='right')
@@ -258,6 +422,8 @@ class LeScanner:
         logger.info('LE {} scanning on {} for {} sec'.format(
             blue(scan_type), blue(self.iface), blue("{}".format(timeout))))
 
+        # Includes starting bluepy-helper, a latency of the bluepy engine too
+        start = time.time()
         if scan_type == 'active': # Active scan 会在 LL 发送 SCAN_REQ PDU
             spinner.start()
             devs = scanner.scan(timeout)
@@ -274,9 +440,9 @@ class LeScanner:
             devs = list(devs) # 将 dictionary view 转换为 list
             devs.sort(key=lambda d:d.rssi)
         
+        devs_info = []
         for dev in devs:
             dev_info = LeDeviceInfo(dev.addr.upper(), dev.addrType.lower(), dev.connectable, dev.rssi)
-            self.devs_scan_result.add_device_info(dev_info)
             
             # print('Addr:       ', blue(dev.addr.upper()))
             # print('Addr type:  ', blue(dev.addrType))
@@ -284,9 +450,10 @@ class LeScanner:
             #     green('True') if dev.connectable else red('False'))
             # print("RSSI:        %d dB" % dev.rssi)
             # print("General Access Profile:")
-            for (adtype, desc, val) in dev.getScanData():
-                ad_struct = AdStruct(adtype, val)
-                dev_info.add_ad_structs(ad_struct)
+            ad_structs = []
+            for adtype, val in dev.scanData.items():
+                ad_struct = intern_ad_record(adtype, val)
+                ad_structs.append(ad_struct)
                 # 打印当前 remote LE dev 透露的所有 GAP 数据（AD structure）。
                 # 
                 # 如果 bluepy.scan() 执行的是 active scan，那么这些 GAP 数据
@@ -304,12 +471,281 @@ class LeScanner:
                 # AdvData。其余的 ADV_IND，ADV_NONCONN_IND 以及 ADV_SCAN_IND 都
                 # 可能包含 AdvData。
                 #
-                # 另外 getScanData() 返回的 desc 还可以通过 ScanEntry.getDescription() 
-                # 单独获取；val 还可以通过 ScanEntry.getValueText() 单独获取；
-                # adtype 表示当前一条 GAP 数据（AD structure）的类型。
+                # ScanEntry.scanData 中的 val 是未经 bluepy 转换的原始字节，由
+                # AdRecord 统一解码；adtype 表示当前一条 GAP 数据（AD structure）
+                # 的类型。
+            dev_info.ad_structs = intern_ad_structs(ad_structs)
+            devs_info.append(dev_info)
+
+        self.add_devs(devs_info, delegate.seen)
+        if latency:
+            self.add_latency_report(start, timeout, engine=engine, scan_type=scan_type,
+                                    ifaces=self.iface)
             
         return self.devs_scan_result
 
+    def add_latency_report(self, start: float, duration: float, **params):
+        """Add the discovery latency of the devices scanned since start to 
+        the scan result.
+
+        params - Parameters of the scan, reported as is
+        """
+        self.devs_scan_result.add_latency_report(DiscoveryLatencyReport(
+            start, duration, {info.addr: info.first_seen 
+                              for info in self.devs_scan_result.devices_info}, params))
+
+
+    @staticmethod
+    def check_hci_engine_options(**options):
+        """Raise ValueError if an option only supported by the hci engine is 
+        set."""
+        for name, value in options.items():
+            if value:
+                raise ValueError("{} needs the hci engine".format(name))
+
+    def _scan_devs_hci(self, timeout, scan_type, sort, extended=False, ifaces=None, 
+                       accept_list=None, filter_dup=False, interval=None, window=None, 
+                       phys=None) -> LeDevicesScanResult:
+        logger.info('LE {}{} scanning on {} for {} sec, HCI engine'.format(
+            'extended ' if extended else '', blue(scan_type), 
+            blue(', '.join(ifaces) if ifaces else self.iface), blue("{}".format(timeout))))
+
+        # Nothing is evicted during a scan of bounded duration
+        dev_table = LeDeviceTable(sys.maxsize, float('inf'))
+        reports, _ = self._hci_reports(scan_type, timeout, extended, ifaces, 
+                                       accept_list, filter_dup, interval, window, phys)
+
+        spinner = Halo(text="Scanning", placement='right')
+        spinner.start()
+        try:
+            for report in reports:
+                if report is not None:
+                    dev_table.update(*report)
+        finally:
+            spinner.stop()
+
+        devs = list(dev_table)
+        if ifaces:
+            # The adapter closest to a device gives its RSSI
+            for dev in devs:
+                dev.rssi = max(dev.adapters.values())
+        if sort == 'rssi':
+            devs.sort(key=lambda d:d.rssi)
+
+        devs_info = []
+        for dev in devs:
+            dev_info = LeDeviceInfo(dev.addr, dev.addr_type, dev.connectable, dev.rssi,
+                                    dev.adapters if ifaces else None)
+            dev_info.ad_structs = dev.ad_structs
+            devs_info.append(dev_info)
+
+        self.add_devs(devs_info, {dev.addr: (dev.first_seen, dev.last_seen) for dev in devs})
+
+        return self.devs_scan_result
+
+    def scan_devs_continuous(self, scan_type='active', max_devs=10000, max_idle=300, 
+                             timeout=None, callback=None, evict_callback=None, 
+                             engine='bluepy', extended=False, ifaces=None, 
+                             accept_list=None, filter_dup=False, interval=None, 
+                             window=None, phys=None, writer=None, link_callback=None):
+        """Scan until interrupted, or for timeout sec, and yield (entry, is_new)
+        for each advertising report, entry being the LeDeviceEntry updated in 
+        self.dev_table.
+
+        The device table is bounded by max_devs and max_idle (sec), so memory 
+        stays flat whatever the duration of the scan.
+
+        scan_type      - 'active' or 'passive'
+        callback       - Called as callback(entry, is_new) for each advertising 
+                         report, before it is yielded.
+        evict_callback - Called as evict_callback(entry) for each device evicted.
+        link_callback  - Called as link_callback(cluster, merged) for each new 
+                         address linked to the previous address of a device, 
+                         see AddrLinker.sweep().
+        writer         - An ndjson.NdjsonWriter the callbacks write to, flushed 
+                         every CONTINUOUS_SCAN_PROCESS_INTERVAL sec if due
+        engine, extended, ifaces, accept_list, filter_dup, interval, window, 
+        phys           - See scan_devs()
+        """
+        if scan_type not in ('active', 'passive'):
+            raise ValueError("Invalid scan type: " + red(scan_type))
+        elif scan_type == 'active':
+            logger.warning("You might want to spoof your LE address before doing "
+                           "an active scan")
+
+        if engine == 'bluepy':
+            self.check_hci_engine_options(extended=extended, ifaces=ifaces, 
+                                          accept_list=accept_list, filter_dup=filter_dup,
+                                          interval=interval, window=window, phys=phys)
+            reports, forget = self._bluepy_reports(scan_type, timeout)
+        elif engine == 'hci':
+            if filter_dup:
+                logger.warning("With duplicate filtering, the controller reports a device "
+                               "once, it will be dropped after --max-idle sec even if "
+                               "still advertising")
+            reports, forget = self._hci_reports(scan_type, timeout, extended, ifaces, 
+                                                accept_list, filter_dup, interval, window, phys)
+        else:
+            raise ValueError("Invalid scan engine: " + red(engine))
+
+        self.dev_table = LeDeviceTable(max_devs, max_idle)
+        self.linker = AddrLinker(min_silence=MIN_ROTATION_SILENCE)
+
+        logger.info('LE {} scanning on {} {}, at most {} devices idle for at most {} sec'.format(
+            blue(scan_type), blue(', '.join(ifaces) if ifaces else self.iface), 
+            'until interrupted' if timeout is None else 'for ' + blue(str(timeout)) + ' sec',
+            blue(str(max_devs)), blue(str(max_idle))))
+
+        last_evict = time.monotonic()
+        try:
+            for report in reports:
+                now = time.time()
+                if report is not None:
+                    entry, is_new = self.dev_table.update(*report, now=now)
+                    if is_new and self.resolver is not None and entry.addr_type == 'random':
+                        entry.identity = self.resolver.resolve(entry.addr)
+                    entry.cluster = self.linker.link(entry.addr, entry.addr_type, 
+                                                     entry.ad_structs, entry.first_seen, now)
+                    if self.proximity is not None:
+                        # Only the AD structures that changed are reported
+                        tx_power = next((ad.value for ad in report[4] if ad.type == TX_POWER_LEVEL
+                                         and ad.error is None), None)
+                        self.proximity.observe(entry.addr, report[5], report[3], tx_power)
+                    if callback is not None:
+                        callback(entry, is_new)
+                    yield entry, is_new
+
+                if time.monotonic() - last_evict < CONTINUOUS_SCAN_PROCESS_INTERVAL:
+                    continue
+                last_evict = time.monotonic()
+                for entry in self.dev_table.evict(now):
+                    forget(entry.addr)
+                    self.linker.forget(entry.addr)
+                    if self.proximity is not None:
+                        self.proximity.forget(entry.addr)
+                    if evict_callback is not None:
+                        evict_callback(entry)
+                for cluster, merged in self.linker.sweep(now):
+                    for addr in merged.addrs:
+                        entry = self.dev_table.get(addr)
+                        if entry is not None:
+                            entry.cluster = cluster
+                    if link_callback is not None:
+                        link_callback(cluster, merged)
+                if self.proximity is not None:
+                    self.proximity.tick(now)
+                if writer is not None:
+                    writer.flush_if_due()
+        finally:
+            reports.close()
+
+    def _bluepy_reports(self, scan_type: str, timeout=None):
+        """Return a generator of the advertising reports received by bluepy,
+        as (addr, addr_type, connectable, rssi, ad_structs, iface), and a function 
+        forgetting an evicted address. None is yielded after each 
+        Scanner.process() call.
+        """
+        delegate = ContinuousScanDelegate()
+        scanner = Scanner(self.devid).withDelegate(delegate)
+
+        def reports():
+            deadline = None if timeout is None else time.monotonic() + timeout
+            scanner.start(passive=(scan_type == 'passive'))
+            try:
+                while deadline is None or time.monotonic() < deadline:
+                    scanner.process(CONTINUOUS_SCAN_PROCESS_INTERVAL)
+
+                    batch, delegate.reports = delegate.reports, []
+                    for scan_entry, changed in batch:
+                        # Only decode the scan data when bluepy says it changed
+                        yield (scan_entry.addr.upper(), scan_entry.addrType.lower(), 
+                               scan_entry.connectable, scan_entry.rssi,
+                               [intern_ad_record(adtype, val) for adtype, val in 
+                                scan_entry.scanData.items()] if changed else (),
+                               self.iface)
+                    yield None
+            finally:
+                scanner.stop()
+
+        # Keep the ScanEntry dict of bluepy in lockstep with the device table, 
+        # otherwise it grows for the whole scan.
+        def forget(addr: str):
+            scanner.scanned.pop(addr.lower(), None)
+
+        return reports(), forget
+
+    def _hci_reports(self, scan_type: str, timeout=None, extended=False, ifaces=None, 
+                     accept_list=None, filter_dup=False, interval=None, window=None, 
+                     phys=None):
+        """Same as _bluepy_reports(), for the HCI engine, on ifaces at once if
+        given. Anonymous extended advertisements are skipped, they have no 
+        address to track. None is yielded each time nothing is received for 
+        RECV_POLL_INTERVAL sec.
+
+        The reports of the addresses out of accept_list are also dropped here,
+        for the other entries of the filter accept list, or in case it could 
+        not be loaded.
+        """
+        from .hci_scan import HciLeScanner, MultiHciLeScanner, peers_in_accept_list, \
+            FILTER_POLICY_ACCEPT_ALL, FILTER_POLICY_ACCEPT_LIST, DEFAULT_SCAN_INTERVAL, \
+            DEFAULT_SCAN_WINDOW
+
+        interval = DEFAULT_SCAN_INTERVAL if interval is None else interval
+        window = DEFAULT_SCAN_WINDOW if window is None else window
+        phys = ('1m',) if phys is None else phys
+
+        # Latest AdvData and ScanRspData of each device, in order to only 
+        # decode the data that changed, whichever HCI device received them.
+        last_data = {}
+        watch_set = None if accept_list is None else {addr.upper() for addr in accept_list}
+
+        def reports():
+            with ExitStack() as stack:
+                filter_policy = FILTER_POLICY_ACCEPT_ALL
+                if watch_set:
+                    addr_types = self.cached_addr_types(watch_set)
+                    if all([stack.enter_context(peers_in_accept_list(iface, watch_set, addr_types)) 
+                            for iface in (ifaces if ifaces else [self.iface])]):
+                        filter_policy = FILTER_POLICY_ACCEPT_LIST
+                    else:
+                        logger.warning("Scanning without the filter accept list")
+
+                if ifaces:
+                    received = MultiHciLeScanner(ifaces).reports(scan_type, timeout, filter_dup, 
+                        interval, window, filter_policy, extended, phys, idle=True)
+                else:
+                    received = (None if report is None else (self.iface, report) 
+                                for report in HciLeScanner(self.iface).reports(
+                                    scan_type, timeout, filter_dup, interval, window, 
+                                    filter_policy, extended, phys=phys, idle=True))
+
+                # Scanning is disabled before the filter accept list is 
+                # restored, the controller rejects changing it while in use.
+                try:
+                    for item in received:
+                        if item is None:
+                            yield None
+                            continue
+                        iface, report = item
+                        if report.addr is None or \
+                            (watch_set is not None and report.addr not in watch_set):
+                            continue
+                        key = (report.addr, report.scan_rsp)
+                        if last_data.get(key) == report.data:
+                            ad_structs = ()
+                        else:
+                            last_data[key] = report.data
+                            ad_structs = decode_ad_structs(report.data)
+                        yield (report.addr, report.addr_type, report.connectable, report.rssi, 
+                               ad_structs, iface)
+                finally:
+                    received.close()
+
+        def forget(addr: str):
+            last_data.pop((addr, False), None)
+            last_data.pop((addr, True), None)
+
+        return reports(), forget
 
     def read_ll_feature_set(self, paddr: str, patype: int = ADDR_TYPE_PUBLIC, timeout: int = 10):
         """LL feature scanning
@@ -389,9 +825,16 @@ class LeScanner:
         self.sm.close()
 
 
-    def sniff_adv(self, channels={37, 38, 39}):
+    def sniff_adv(self, channels={37, 38, 39}, timeout: float = None, 
+                  sinks: list[SniffSink] = None, queue_size: int = SNIFF_QUEUE_SIZE,
+                  drop: str = DROP_NEWEST):
         """Advertising physical channel PDU sniffing
 
+        All the micro:bits are serviced from one loop in the calling thread,
+        which returns after timeout sec, on stop_sniff_adv() or SIGTERM. The
+        PDUs are queued there and decoded by a sniff_pipeline.SniffPipeline 
+        thread writing them to the sinks.
+
         channel - The channel index(es) used when sniffing advertising 
                    physical channel PDU.
 
@@ -399,6 +842,12 @@ class LeScanner:
                    and 39), these PDUs may also appear in other channels. But 
                    at present we only focus on the primary advertising 
                    channel.
+        timeout    - sec, None to sniff until stopped
+        sinks      - Where the PDUs go, a ConsoleSink printing them by default. 
+                     A StatsSink is always added.
+        queue_size - PDUs waiting to be decoded, beyond which they are dropped
+        drop       - sniff_pipeline.DROP_NEWEST or DROP_OLDEST, the PDU 
+                     dropped when the queue is full
         """
         logger.debug("LeScanner.sniff_adv")
         
@@ -408,6 +857,8 @@ class LeScanner:
             serial_devs = []
             idx = 0
             event_handlers = []
+            pipeline = None
+            prev_sigterm_handler = None
 
             dev_paths = self.microbit_devpaths
 
@@ -419,6 +870,11 @@ class LeScanner:
             elif len(dev_paths) < len(channels):
                 channels = channels[:len(dev_paths)]
 
+            if sinks is None:
+                sinks = [ConsoleSink(self.resolver)]
+            pipeline = SniffPipeline(sinks + [StatsSink()], queue_size, drop)
+            pipeline.start()
+
             for dev_path in dev_paths:
                 logger.info("Using micro:bit {} on channel {}".format(dev_path, channels[idx]))
                 
@@ -427,19 +883,38 @@ class LeScanner:
                 dev.reset_output_buffer()
                 serial_devs.append(dev)
 
-                handler = SerialEventHandler(dev, channels[idx])
-                handler.start()
+                handler = SerialEventHandler(dev, channels[idx], pipeline)
                 event_handlers.append(handler)
                 idx += 1
-                
-            for handler in event_handlers:
-                handler.join()
+
+            self.sniffer = SerialMultiplexer(event_handlers)
+            # Signal handlers can only be set in the main thread
+            if threading.current_thread() is threading.main_thread():
+                prev_sigterm_handler = signal.signal(
+                    signal.SIGTERM, lambda signum, frame: self.stop_sniff_adv())
+            self.sniffer.run(timeout)
         finally:
+            if prev_sigterm_handler is not None:
+                signal.signal(signal.SIGTERM, prev_sigterm_handler)
+            if self.sniffer is not None:
+                self.sniffer.close()
+                self.sniffer = None
+            for handler in event_handlers:
+                logger.info("micro:bit on channel {}: {}".format(
+                    handler.channel, handler.parser.stats()))
             for dev in serial_devs:
                 logger.debug("LeScanner.scan, close()")
                 serial_reset(dev)
                 dev.close()
-       
+            if pipeline is not None:
+                pipeline.close()
+                logger.info("Sniff pipeline: {}".format(pipeline.stats()))
+
+    def stop_sniff_adv(self):
+        """Make sniff_adv() return, safe to call from another thread."""
+        sniffer = self.sniffer
+        if sniffer is not None:
+            sniffer.stop()
 
 
 def pp_le_feature_set(features: bytes):
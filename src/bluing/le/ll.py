@@ -73,9 +73,217 @@ CONNECT_IND     = 0b0101
 # AUX_CONNECT_REQ
 # AUX_CONNECT_RSP
 
+# Common Extended Advertising Payload Format
+#
+# ref
+# BLUETOOTH CORE SPECIFICATION Version 5.2 | Vol 6, Part B page 2880, 
+# 2.3.4 Common Extended Advertising Payload Format
+EXT_HDR_LEN_MSK = 0b00111111
+ADV_MODE_POS = 6
 
-def pp_adv_phych_pdu(pdu:bytes, ch:int) -> list:
-    '''Parse and print advertising physical channel PDU
+adv_modes = {
+    0b00: 'Non-connectable and non-scannable',
+    0b01: 'Connectable and non-scannable',
+    0b10: 'Non-connectable and scannable',
+    0b11: 'Reserved'
+}
+
+# Extended Header Flags
+EXT_HDR_ADV_A     = 0x01
+EXT_HDR_TARGET_A  = 0x02
+EXT_HDR_CTE_INFO  = 0x04
+EXT_HDR_ADI       = 0x08
+EXT_HDR_AUX_PTR   = 0x10
+EXT_HDR_SYNC_INFO = 0x20
+EXT_HDR_TX_POWER  = 0x40
+
+aux_phys = {
+    0b000: 'LE 1M',
+    0b001: 'LE 2M',
+    0b010: 'LE Coded'
+}
+
+
+class AuxPtr:
+    """AuxPtr field, where the next auxiliary PDU is sent.
+
+    aux_offset - In units of 30 or 300 us, see offset_us
+    """
+    __slots__ = ('ch_idx', 'ca', 'offset_units', 'aux_offset', 'aux_phy')
+
+    def __init__(self, raw: bytes):
+        self.ch_idx = raw[0] & 0b00111111
+        self.ca = (raw[0] >> 6) & 0b1
+        self.offset_units = raw[0] >> 7
+        self.aux_offset = int.from_bytes(raw[1:3], 'little') & 0x1FFF
+        self.aux_phy = raw[2] >> 5
+
+    @property
+    def offset_us(self) -> int:
+        return self.aux_offset * (300 if self.offset_units else 30)
+
+
+class SyncInfo:
+    """SyncInfo field, how to synchronize to a periodic advertising train."""
+    __slots__ = ('sync_packet_offset', 'offset_units', 'offset_adjust', 'interval', 
+                 'chm', 'sca', 'aa', 'crc_init', 'event_counter')
+
+    def __init__(self, raw: bytes):
+        offset = int.from_bytes(raw[0:2], 'little')
+        self.sync_packet_offset = offset & 0x1FFF
+        self.offset_units = (offset >> 13) & 0b1
+        self.offset_adjust = (offset >> 14) & 0b1
+        self.interval = int.from_bytes(raw[2:4], 'little')
+        chm_sca = int.from_bytes(raw[4:9], 'little')
+        self.chm = chm_sca & (2**37 - 1)
+        self.sca = chm_sca >> 37
+        self.aa = int.from_bytes(raw[9:13], 'little')
+        self.crc_init = int.from_bytes(raw[13:16], 'little')
+        self.event_counter = int.from_bytes(raw[16:18], 'little')
+
+
+class ExtAdvPayload:
+    """A decoded Common Extended Advertising Payload. The absent fields are 
+    None.
+
+    adv_a, target_a - Upper case
+    adi_did, adi_sid - Advertising Data ID and Advertising Set ID of the ADI
+    """
+    __slots__ = ('adv_mode', 'adv_a', 'target_a', 'cte_info', 'adi_did', 'adi_sid',
+                 'aux_ptr', 'sync_info', 'tx_power', 'acad', 'adv_data')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+def parse_common_ext_adv_payload(payload: bytes) -> ExtAdvPayload:
+    """Parse a Common Extended Advertising Payload, from the PDU of 
+    ADV_EXT_IND, AUX_ADV_IND, AUX_CHAIN_IND...
+
+    +------------------------------------------------------------+
+    | Extended Header Length | AdvMode | Extended Header | AdvData |
+    |------------------------|---------|-----------------|---------|
+    | 6 b                    | 2 b     | 0-63 B          | 0-254 B |
+    +------------------------------------------------------------+
+
+    Extended Header
+    +--------------------------------------------------------------------------------+
+    | Flags | AdvA | TargetA | CTEInfo | ADI | AuxPtr | SyncInfo | TxPower | ACAD    |
+    |-------|------|---------|---------|-----|--------|----------|---------|---------|
+    | 1 B   | 6 B  | 6 B     | 1 B     | 2 B | 3 B    | 18 B     | 1 B     | varies  |
+    +--------------------------------------------------------------------------------+
+
+    Raise ValueError when a field is truncated.
+    """
+    if len(payload) < 1:
+        raise ValueError("Empty extended advertising payload")
+
+    ext_adv = ExtAdvPayload()
+    ext_hdr_len = payload[0] & EXT_HDR_LEN_MSK
+    ext_adv.adv_mode = payload[0] >> ADV_MODE_POS
+    ext_hdr_end = 1 + ext_hdr_len
+    if ext_hdr_end > len(payload):
+        raise ValueError("Truncated extended header, length {}, {} bytes left".format(
+            ext_hdr_len, len(payload) - 1))
+    ext_adv.adv_data = bytes(payload[ext_hdr_end:])
+    if ext_hdr_len == 0:
+        return ext_adv
+
+    flags = payload[1]
+    offset = 2
+
+    def field(length: int) -> bytes:
+        nonlocal offset
+        if offset + length > ext_hdr_end:
+            raise ValueError("Truncated extended header, flags 0x{:02x}".format(flags))
+        value = bytes(payload[offset:offset+length])
+        offset += length
+        return value
+
+    if flags & EXT_HDR_ADV_A:
+        ext_adv.adv_a = field(6)[::-1].hex(':').upper()
+    if flags & EXT_HDR_TARGET_A:
+        ext_adv.target_a = field(6)[::-1].hex(':').upper()
+    if flags & EXT_HDR_CTE_INFO:
+        ext_adv.cte_info = field(1)[0]
+    if flags & EXT_HDR_ADI:
+        adi = int.from_bytes(field(2), 'little')
+        ext_adv.adi_did, ext_adv.adi_sid = adi & 0x0FFF, adi >> 12
+    if flags & EXT_HDR_AUX_PTR:
+        ext_adv.aux_ptr = AuxPtr(field(3))
+    if flags & EXT_HDR_SYNC_INFO:
+        ext_adv.sync_info = SyncInfo(field(18))
+    if flags & EXT_HDR_TX_POWER:
+        tx_power = field(1)[0]
+        ext_adv.tx_power = tx_power - 256 if tx_power > 127 else tx_power
+    ext_adv.acad = bytes(payload[offset:ext_hdr_end])
+
+    return ext_adv
+
+
+def pp_ext_adv_payload(ext_adv: ExtAdvPayload, tx_add: int, rx_add: int):
+    print("AdvMode: {}".format(adv_modes[ext_adv.adv_mode]))
+    if ext_adv.adv_a is not None:
+        print("{} AdvA: {}".format('public' if tx_add == 0b0 else 'random', ext_adv.adv_a))
+    if ext_adv.target_a is not None:
+        print("{} TargetA: {}".format('public' if rx_add == 0b0 else 'random', ext_adv.target_a))
+    if ext_adv.cte_info is not None:
+        print("CTEInfo: 0x{:02x}".format(ext_adv.cte_info))
+    if ext_adv.adi_did is not None:
+        print("ADI: DID 0x{:03x}, SID 0x{:x}".format(ext_adv.adi_did, ext_adv.adi_sid))
+    if ext_adv.aux_ptr is not None:
+        aux_ptr = ext_adv.aux_ptr
+        print("AuxPtr: channel {}, {} us, {}, CA {}".format(
+            aux_ptr.ch_idx, aux_ptr.offset_us, 
+            aux_phys.get(aux_ptr.aux_phy, 'Reserved'), aux_ptr.ca))
+    if ext_adv.sync_info is not None:
+        sync_info = ext_adv.sync_info
+        print("SyncInfo: interval {:.2f} ms, AA 0x{:08x}, event counter {}".format(
+            sync_info.interval * 1.25, sync_info.aa, sync_info.event_counter))
+    if ext_adv.tx_power is not None:
+        print("TxPower: {} dBm".format(ext_adv.tx_power))
+    if ext_adv.acad:
+        print("ACAD: {}".format(ext_adv.acad.hex()))
+    if ext_adv.adv_data:
+        print("AdvData: {}".format(ext_adv.adv_data.hex()))
+
+
+class AdvPhychPdu:
+    """An advertising physical channel PDU, decoded.
+
+    addrs - [{'field': 'AdvA', 'BD_ADDR': bytes, 'type': 'public'}, ...], the 
+            addresses carried, BD_ADDR MSB first
+    """
+    __slots__ = ('raw', 'pdu_type', 'ch_sel', 'tx_add', 'rx_add', 'addrs', 'ext_adv')
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.pdu_type = (raw[0] & PDU_TYPE_MSK) >> PDU_TYPE_POS
+        self.ch_sel   = (raw[0] & CH_SEL_MSK) >> CH_SEL_POS
+        self.tx_add   = (raw[0] & TX_ADD_MSK) >> TX_ADD_POS
+        self.rx_add   = (raw[0] & RX_ADD_MSK) >> RX_ADD_POS
+        self.addrs = []
+        self.ext_adv = None
+
+    @property
+    def name(self) -> str:
+        return adv_phych_pdu_types.get(self.pdu_type, "0x{:02x}".format(self.pdu_type))
+
+    def add_addr(self, field: str, bd_addr: bytes, add: int):
+        self.addrs.append({'field': field, 'BD_ADDR': bd_addr, 
+                           'type': 'public' if add == 0b0 else 'random'})
+
+    def to_dict(self) -> dict:
+        return {'pdu_type': self.name,
+                'addrs': [{'field': addr['field'], 'type': addr['type'],
+                           'addr': ':'.join('%02X'%b for b in addr['BD_ADDR'])}
+                          for addr in self.addrs],
+                'raw': self.raw}
+
+
+def parse_adv_phych_pdu(pdu: bytes) -> AdvPhychPdu:
+    '''Parse advertising physical channel PDU
 
     ref 
     BLUETOOTH CORE SPECIFICATION Version 5.2 | Vol 6, Part B page 2871, 
@@ -94,121 +302,75 @@ def pp_adv_phych_pdu(pdu:bytes, ch:int) -> list:
     |----------|-----|-------|-------|-------|--------|
     | 4 b      | 1 b | 1 b   | 1 b   | 1 b   | 8 b    |
     +-------------------------------------------------+
+
+    Raise IndexError if pdu has no header.
     '''
-    header = pdu[:2]
+    adv_pdu = AdvPhychPdu(pdu)
     payload = pdu[2:]
+    tx_add, rx_add = adv_pdu.tx_add, adv_pdu.rx_add
+
+    if adv_pdu.pdu_type in (ADV_IND, ADV_NONCONN_IND, ADV_SCAN_IND, SCAN_RSP):
+        adv_pdu.add_addr('AdvA', payload[:6][::-1], tx_add)
+        # AdvData or ScanRspData: payload[6:]
+    elif adv_pdu.pdu_type == ADV_DIRECT_IND:
+        adv_pdu.add_addr('AdvA', payload[:6][::-1], tx_add)
+        adv_pdu.add_addr('TargetA', payload[6:][::-1], rx_add)
+    elif adv_pdu.pdu_type == SCAN_REQ:
+        adv_pdu.add_addr('ScanA', payload[:6][::-1], tx_add)
+        adv_pdu.add_addr('AdvA', payload[6:][::-1], rx_add)
+    elif adv_pdu.pdu_type == CONNECT_IND:
+        adv_pdu.add_addr('InitA', payload[:6][::-1], tx_add)
+        adv_pdu.add_addr('AdvA', payload[6:12][::-1], rx_add)
+        # LLData: payload[12:]
+    elif adv_pdu.pdu_type == ADV_EXT_IND:
+        try:
+            ext_adv = parse_common_ext_adv_payload(payload)
+        except ValueError as e:
+            logger.warning("{}, raw: {}".format(e, payload))
+        else:
+            adv_pdu.ext_adv = ext_adv
+            if ext_adv.adv_a is not None:
+                adv_pdu.add_addr('AdvA', bytes.fromhex(ext_adv.adv_a.replace(':', '')), tx_add)
+            if ext_adv.target_a is not None:
+                adv_pdu.add_addr('TargetA', bytes.fromhex(ext_adv.target_a.replace(':', '')), 
+                                 rx_add)
+
+    return adv_pdu
+
+
+adv_phych_pdu_colors = {
+    ADV_IND:         blue,
+    ADV_DIRECT_IND:  blue,
+    ADV_NONCONN_IND: red,
+    ADV_SCAN_IND:    blue,
+    ADV_EXT_IND:     yellow,
+    SCAN_REQ:        blue,
+    SCAN_RSP:        blue,
+    CONNECT_IND:     green
+}
 
-    pdu_type = (header[0] & PDU_TYPE_MSK) >> PDU_TYPE_POS
-    rfu      = (header[0] & RFU_MSK) >> RFU_POS
-    ch_sel   = (header[0] & CH_SEL_MSK) >> CH_SEL_POS
-    tx_add   = (header[0] & TX_ADD_MSK) >> TX_ADD_POS
-    rx_add   = (header[0] & RX_ADD_MSK) >> RX_ADD_POS
 
-    addrs = []
-    
+def pp_parsed_adv_phych_pdu(adv_pdu: AdvPhychPdu, ch: int):
     print("[{}] ".format(ch), end='')
-    if pdu_type == ADV_IND:
-        adv_a = payload[:6][::-1]
-        addrs = [{
-            'BD_ADDR': adv_a,
-            'type': 'public' if tx_add == 0b0 else 'random'
-        }]
-        
-        print("[{}]".format(blue('ADV_IND')))
-        print("{} AdvA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        # print("AdvData:", payload[6:])
-    elif pdu_type == ADV_DIRECT_IND:
-        adv_a = payload[:6][::-1]
-        target_a = payload[6:][::-1]
-        addrs = [
-            {
-                'BD_ADDR': adv_a,
-                'type': 'public' if tx_add == 0b0 else 'random'
-            },
-            {
-                'BD_ADDR': target_a,
-                'type': 'public' if rx_add == 0b0 else 'random'
-            },
-        ]
-        print("[{}]".format(blue('ADV_DIRECT_IND')))
-        print("{} AdvA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        print("{} TargetA: {}".format(
-            'public' if rx_add == 0b0 else 'random', ':'.join('%02X'%b for b in target_a)))
-    elif pdu_type == ADV_NONCONN_IND:
-        adv_a = payload[:6][::-1]
-        addrs = [{
-            'BD_ADDR': adv_a,
-            'type': 'public' if tx_add == 0b0 else 'random'
-        }]
-        print("[{}]".format(red('ADV_NONCONN_IND')))
-        print("{} AdvA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        # print("AdvData:", payload[6:])
-    elif pdu_type == ADV_SCAN_IND:
-        adv_a = payload[:6][::-1]
-        addrs = [{
-            'BD_ADDR': adv_a,
-            'type': 'public' if tx_add == 0b0 else 'random'
-        }]
-        print("[{}]".format(blue('ADV_SCAN_IND')))
-        print("{} AdvA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        # print("AdvData:", payload[6:])
-    elif pdu_type == ADV_EXT_IND:
-        print("[{}]".format(yellow('ADV_EXT_IND')))
-        print("raw: {}".format(payload))
-    elif pdu_type == SCAN_REQ:
-        scan_a = payload[:6][::-1]
-        adv_a = payload[6:][::-1]
-        addrs = [
-            {
-                'BD_ADDR': scan_a,
-                'type': 'public' if tx_add == 0b0 else 'random'
-            },
-            {
-                'BD_ADDR': adv_a,
-                'type': 'public' if rx_add == 0b0 else 'random'
-            },     
-        ]
-        print("[{}]".format(blue('SCAN_REQ')))
-        print("{} ScanA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in scan_a)))
-        print("{} AdvA: {}".format(
-            'public' if rx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-    elif pdu_type == SCAN_RSP:
-        adv_a = payload[:6][::-1]
-        addrs = [{
-            'BD_ADDR': adv_a,
-            'type': 'public' if tx_add == 0b0 else 'random'
-        }]
-        print("[{}]".format(blue('SCAN_RSP')))
-        print("{} AdvA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        # print("ScanRspData:", payload[6:])
-    elif pdu_type == CONNECT_IND:
-        init_a = payload[:6]
-        adv_a = payload[6:12]
-        print('init_a:', ':'.join('%02x'%b for b in init_a))
-        print('adv_a:', ':'.join('%02x'%b for b in adv_a))
-        addrs = [
-            {
-                'BD_ADDR': init_a,
-                'type': 'public' if tx_add == 0b0 else 'random'
-            },
-            {
-                'BD_ADDR': adv_a,
-                'type': 'public' if rx_add == 0b0 else 'random'
-            },
-        ]
-        print("[{}]".format(green('CONNECT_IND')))
-        print("{} InitA: {}".format(
-            'public' if tx_add == 0b0 else 'random', ':'.join('%02X'%b for b in init_a)))
-        print("{} AdvA: {}".format(
-            'public' if rx_add == 0b0 else 'random', ':'.join('%02X'%b for b in adv_a)))
-        # print("LLData:", payload[12:])
-    else:
-        logger.warning("Unknown PDU type 0x%02x'%pdu_type")
-
-    return addrs
+    if adv_pdu.pdu_type not in adv_phych_pdu_colors:
+        print()
+        logger.warning("Unknown PDU type 0x%02x"%adv_pdu.pdu_type)
+        return
+
+    print("[{}]".format(adv_phych_pdu_colors[adv_pdu.pdu_type](adv_pdu.name)))
+    if adv_pdu.pdu_type == ADV_EXT_IND:
+        if adv_pdu.ext_adv is not None:
+            pp_ext_adv_payload(adv_pdu.ext_adv, adv_pdu.tx_add, adv_pdu.rx_add)
+        return
+
+    for addr in adv_pdu.addrs:
+        print("{} {}: {}".format(addr['type'], addr['field'], 
+                                 ':'.join('%02X'%b for b in addr['BD_ADDR'])))
+
+
+def pp_adv_phych_pdu(pdu:bytes, ch:int) -> list:
+    '''Parse and print advertising physical channel PDU, return the addresses
+    it carries, see AdvPhychPdu.addrs.'''
+    adv_pdu = parse_adv_phych_pdu(pdu)
+    pp_parsed_adv_phych_pdu(adv_pdu, ch)
+    return adv_pdu.addrs
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+r"""Capture files of the advertising physical channel PDUs sniffed
+
+The PDUs are written as LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR packets, which
+Wireshark and the libpcap based tools dissect as is:
+
+    +-----------------------------------------------------------------+
+    | RF Channel | Signal | Noise | AA Offenses | Ref AA | Flags       |
+    |------------|--------|-------|-------------|--------|-------------|
+    | 1 B        | 1 B    | 1 B   | 1 B         | 4 B    | 2 B         |
+    +-----------------------------------------------------------------+
+    | Access Address | PDU (Header, Payload) | CRC                      |
+    |----------------|-----------------------|--------------------------|
+    | 4 B            | 2-257 B               | 3 B                      |
+    +-----------------------------------------------------------------+
+
+All fields little-endian. The micro:bit firmware only passes on the PDUs
+whose CRC is correct, and not the CRC itself, so it is computed again from
+the PDU. The firmware does not report the RSSI either.
+
+ref
+https://www.tcpdump.org/linktypes/LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR.html
+BLUETOOTH CORE SPECIFICATION Version 5.2 | Vol 6, Part B, 3.1.1 CRC
+generation
+
+The capture can be rotated to a new file once the current one reaches a
+size or an age, the files being numbered, e.g.
+adv-0001.pcap, adv-0002.pcap... In ring buffer mode, the oldest files are
+deleted so that all of them take at most the ring size.
+"""
+
+import os
+import time
+import struct
+from collections import deque
+from pathlib import Path
+
+from xpycommon.log import Logger
+
+from ..ndjson import BufferedRecordWriter
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR = 256
+SNAPLEN = 0xFFFF
+
+PCAP_BUFFER_SIZE = 64 * 1024
+PCAP_FLUSH_INTERVAL = 1.0 # sec
+# Files a ring buffer is split in when no rotation size is given
+PCAP_RING_FILES = 10
+
+PCAP_FORMATS = ('pcap', 'pcapng')
+
+ADV_ACCESS_ADDR = 0x8E89BED6
+ADV_CRC_INIT = 0x555555
+
+# Flags of the pseudo-header
+PHDR_DEWHITENED            = 0x0001
+PHDR_SIGNAL_POWER_VALID    = 0x0002
+PHDR_NOISE_POWER_VALID     = 0x0004
+PHDR_DECRYPTED             = 0x0008
+PHDR_REF_ACCESS_ADDR_VALID = 0x0010
+PHDR_AA_OFFENSES_VALID     = 0x0020
+PHDR_CHANNEL_ALIASED       = 0x0040
+PHDR_CRC_CHECKED           = 0x0400
+PHDR_CRC_VALID             = 0x0800
+
+# The pseudo-header does not carry the RSSI, the LL packet carries the CRC
+# computed from the PDU, and the PDU type and PHY bits are 0 for the PDUs on
+# the primary advertising channels over LE 1M.
+ADV_PHDR_FLAGS = PHDR_DEWHITENED | PHDR_REF_ACCESS_ADDR_VALID
+
+PCAP_MAGIC = 0xA1B2C3D4
+
+# pcapng block types
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+
+def rf_channel(channel: int) -> int:
+    """Return the RF channel (2402 + 2 * k MHz) of an LE channel index."""
+    if channel == 37:
+        return 0
+    elif channel == 38:
+        return 12
+    elif channel == 39:
+        return 39
+    elif 0 <= channel <= 10:
+        return channel + 1
+    elif 11 <= channel <= 36:
+        return channel + 2
+    else:
+        raise ValueError("Invalid LE channel index: {}".format(channel))
+
+
+def _crc24_table() -> list[int]:
+    # The LFSR of the spec shifts the bits in LSB first, i.e. a reflected
+    # CRC with the polynomial x^24 + x^10 + x^9 + x^6 + x^4 + x^3 + x + 1
+    poly = 0xDA6000
+    table = []
+    for byte in range(256):
+        state = byte
+        for _ in range(8):
+            state = (state >> 1) ^ poly if state & 1 else state >> 1
+        table.append(state)
+    return table
+
+
+CRC24_TABLE = _crc24_table()
+
+
+def crc24(pdu: bytes, init: int = ADV_CRC_INIT) -> bytes:
+    """Return the 3 CRC bytes of a PDU, in the order they are transmitted.
+
+    init - CRCInit, its LSB in position 0 of the LFSR of the spec
+    """
+    # Position 0 is the MSB of the state of the reflected CRC, so the state
+    # starts as the 24 bits of CRCInit reversed, not each byte of it
+    state = int('{:024b}'.format(init)[::-1], 2)
+    for byte in pdu:
+        state = (state >> 8) ^ CRC24_TABLE[(state ^ byte) & 0xFF]
+    return state.to_bytes(3, 'little')
+
+
+def le_ll_phdr_packet(channel: int, pdu: bytes) -> bytes:
+    """Return the LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR packet of an
+    advertising physical channel PDU sniffed on channel."""
+    # Signal and noise are -128 (invalid), as their flags say
+    phdr = struct.pack('<BbbBIH', rf_channel(channel), -128, -128, 0, ADV_ACCESS_ADDR,
+                       ADV_PHDR_FLAGS)
+    return phdr + struct.pack('<I', ADV_ACCESS_ADDR) + pdu + crc24(pdu)
+
+
+def pcap_header() -> bytes:
+    return struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, SNAPLEN,
+                       LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR)
+
+
+def pcap_record(t: float, packet: bytes) -> bytes:
+    usecs = round(t * 1000000)
+    return struct.pack('<IIII', usecs // 1000000, usecs % 1000000, len(packet),
+                       len(packet)) + packet
+
+
+def pcapng_header() -> bytes:
+    """Return a Section Header Block and the Interface Description Block of
+    the interface 0, timestamps in usec, the default resolution."""
+    # Section length unknown: -1
+    shb = struct.pack('<IIIHHq', PCAPNG_SHB, 28, PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1) + \
+        struct.pack('<I', 28)
+    idb = struct.pack('<IIHHI', PCAPNG_IDB, 20, LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR, 0,
+                      SNAPLEN) + struct.pack('<I', 20)
+    return shb + idb
+
+
+def pcapng_record(t: float, packet: bytes) -> bytes:
+    """Return an Enhanced Packet Block of the interface 0."""
+    usecs = round(t * 1000000)
+    padding = -len(packet) % 4
+    length = 32 + len(packet) + padding
+    return struct.pack('<IIIIIII', PCAPNG_EPB, length, 0, usecs >> 32, usecs & 0xFFFFFFFF,
+                       len(packet), len(packet)) + packet + b'\x00' * padding + \
+        struct.pack('<I', length)
+
+
+class PcapWriter(BufferedRecordWriter):
+    def __init__(self, path: str, format: str = None, rotate_size: int = None,
+                 rotate_interval: float = None, ring_size: int = None,
+                 buffer_size: int = PCAP_BUFFER_SIZE, flush_interval: float = PCAP_FLUSH_INTERVAL):
+        """
+        path            - The capture file, numbered when rotated
+        format          - 'pcap' or 'pcapng', None to follow the extension of
+                          path, pcapng for .pcapng and pcap otherwise
+        rotate_size     - Bytes a file reaches before the next one is started,
+                          None not to rotate by size
+        rotate_interval - sec a file is written before the next one is
+                          started, None not to rotate by time
+        ring_size       - Bytes all the files take at most, the oldest ones
+                          being deleted, None to keep them all. Rotates every
+                          ring_size / PCAP_RING_FILES bytes without rotate_size.
+        """
+        if format is None:
+            format = 'pcapng' if path.lower().endswith('.pcapng') else 'pcap'
+        if format not in PCAP_FORMATS:
+            raise ValueError("Unknown capture format: {}".format(format))
+        if ring_size is not None:
+            if rotate_size is None:
+                rotate_size = ring_size // PCAP_RING_FILES
+            if rotate_size > ring_size:
+                raise ValueError("The rotation size {} > the ring size {}".format(
+                    rotate_size, ring_size))
+        for name, value in (('rotate_size', rotate_size), ('rotate_interval', rotate_interval),
+                            ('ring_size', ring_size)):
+            if value is not None and value <= 0:
+                raise ValueError("{} must be > 0".format(name))
+
+        self.path = Path(path)
+        self.format = format
+        self.header = pcapng_header() if format == 'pcapng' else pcap_header()
+        self.record = pcapng_record if format == 'pcapng' else pcap_record
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.ring_size = ring_size
+
+        # The file is opened by open_next()
+        super().__init__(None, buffer_size, flush_interval)
+        # Numbered when rotating, from 1
+        self.file_num = 0
+        self.file_path = None
+        self.file_size = 0
+        self.file_start = None
+        # (path, size) of the files closed and kept by the ring buffer, oldest first
+        self.closed_files = deque()
+
+        self.packets = 0
+        self.files_deleted = 0
+
+        self.open_next()
+
+    @property
+    def rotating(self) -> bool:
+        return self.rotate_size is not None or self.rotate_interval is not None
+
+    def open_next(self):
+        if self.rotating:
+            self.file_num += 1
+            self.file_path = self.path.with_name("{}-{:04d}{}".format(
+                self.path.stem, self.file_num, self.path.suffix))
+        else:
+            self.file_path = self.path
+        logger.debug("PcapWriter, {}".format(self.file_path))
+
+        self.file = open(self.file_path, 'wb')
+        self.buf += self.header
+        self.file_size = len(self.header)
+        self.file_start = time.monotonic()
+
+    def rotate(self):
+        self.close_file()
+
+        if self.ring_size is not None:
+            # Leave room for the next file to grow to rotate_size
+            total = sum(size for _, size in self.closed_files)
+            while self.closed_files and total + self.rotate_size > self.ring_size:
+                path, size = self.closed_files.popleft()
+                total -= size
+                try:
+                    os.remove(path)
+                    self.files_deleted += 1
+                except FileNotFoundError:
+                    pass
+
+        self.open_next()
+
+    def write(self, t: float, channel: int, pdu: bytes):
+        """
+        t - time.time() the PDU was sniffed
+        """
+        record = self.record(t, le_ll_phdr_packet(channel, pdu))
+
+        if self.file_size > len(self.header) and \
+            ((self.rotate_size is not None and
+              self.file_size + len(record) > self.rotate_size) or
+             (self.rotate_interval is not None and
+              time.monotonic() - self.file_start >= self.rotate_interval)):
+            self.rotate()
+
+        self.file_size += len(record)
+        self.packets += 1
+        self.write_record(record)
+
+    def close_file(self):
+        try:
+            super().close()
+        finally:
+            if self.ring_size is not None:
+                self.closed_files.append((self.file_path, self.file_size))
+
+    def close(self):
+        self.close_file()
+
+    def stats(self) -> str:
+        return "{} packets, {} files, {} deleted".format(
+            self.packets, self.file_num if self.rotating else 1, self.files_deleted)
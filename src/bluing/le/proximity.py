@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+r"""RSSI proximity estimation from several sensors
+
+Each device seen by each sensor (an HCI device, or any other receiver whose
+RSSIs are fed in) has an RSSI stream. The streams of all the devices are
+kept in NumPy arrays, a row per device and a column per sensor, and the
+measurements received between two ticks are applied to them at once: on
+each tick, a Kalman filter (or an EWMA) smooths every stream with a few
+array operations, whatever the number of devices.
+
+The distance to a sensor comes from the pathloss, Tx Power Level - RSSI,
+with the log-distance model
+
+    pathloss = PATHLOSS_AT_1M + 10 * n * log10(d)
+
+so it is only known for the devices advertising their Tx Power Level. The
+position of a device relative to the sensors, when their positions are
+known, is the centroid of the sensor positions weighted by 1 / d^2, which
+does not need the Tx Power Level: the weights only depend on the RSSIs.
+"""
+
+from array import array
+from datetime import datetime
+
+from xpycommon.log import Logger
+from xpycommon.ui import blue
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+# Free space pathloss at 1 m at 2.4 GHz
+PATHLOSS_AT_1M = 40.0 # dB
+PATHLOSS_EXPONENT = 2.0 # 2 in free space, 2.7 to 3.5 indoors
+# Variance of the RSSI measurements, and how much the RSSI of a device may
+# drift per second as it moves.
+KALMAN_MEASUREMENT_NOISE = 16.0 # dB^2
+KALMAN_PROCESS_NOISE = 1.0 # dB^2/sec
+EWMA_ALPHA = 0.3
+# A sensor which has not seen a device for STALE_AFTER sec is left out of
+# its estimates.
+STALE_AFTER = 10.0 # sec
+INITIAL_CAPACITY = 1024
+FILTERS = ('kalman', 'ewma')
+
+
+def load_sensor_positions(path: str) -> dict[str, tuple[float, float]]:
+    """Load a file of SENSOR X Y lines, in any unit of length. Empty lines and
+    lines starting with '#' are ignored."""
+    positions = {}
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            fields = line.split()
+            try:
+                if len(fields) != 3:
+                    raise ValueError()
+                positions[fields[0]] = (float(fields[1]), float(fields[2]))
+            except ValueError:
+                raise ValueError("Invalid sensor position in {}, line {}: {}".format(
+                    path, line_num, line))
+    return positions
+
+
+class ProximitySnapshot:
+    """Estimates of the devices updated by a tick.
+
+    rssi, distance - (devices, sensors) arrays, NaN where unknown
+    nearest        - Index of the sensor closest to each device
+    position       - (devices, 2) array, NaN where unknown, or None if the
+                     sensor positions are not known
+    """
+    __slots__ = ('time', 'sensors', 'addrs', 'rssi', 'distance', 'nearest', 'position')
+
+    def __init__(self, time: float, sensors: list[str], addrs: list[str], rssi, distance,
+                 nearest, position):
+        self.time = time
+        self.sensors = sensors
+        self.addrs = addrs
+        self.rssi = rssi
+        self.distance = distance
+        self.nearest = nearest
+        self.position = position
+
+    def records(self):
+        """Yield a JSON serializable record per device."""
+        rssis = self.rssi.round(1).tolist()
+        distances = self.distance.round(2).tolist()
+        nearest = self.nearest.tolist()
+        positions = None if self.position is None else self.position.round(2).tolist()
+        for i, addr in enumerate(self.addrs):
+            yield {'record': 'le_proximity', 'time': self.time, 'addr': addr,
+                   'rssi': {sensor: rssi for sensor, rssi in zip(self.sensors, rssis[i])
+                            if rssi == rssi},
+                   'distance': {sensor: d for sensor, d in zip(self.sensors, distances[i])
+                                if d == d},
+                   'nearest': self.sensors[nearest[i]],
+                   'position': None if positions is None or positions[i][0] != positions[i][0]
+                               else positions[i]}
+
+
+class ProximityEstimator:
+    def __init__(self, sensors: list[str], positions: dict[str, tuple[float, float]] = None,
+                 filter: str = 'kalman', pathloss_exponent: float = PATHLOSS_EXPONENT,
+                 callback=None):
+        """
+        sensors   - Names of the sensors, others are added as they are observed
+        positions - Sensor name -> (x, y)
+        callback  - Called as callback(snapshot) by each tick with updates
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            raise RuntimeError("Proximity estimation needs the numpy package, "
+                               "pip install bluing[proximity]")
+        if filter not in FILTERS:
+            raise ValueError("Invalid filter: {}".format(filter))
+
+        self.np = np
+        self.filter = filter
+        self.pathloss_exponent = pathloss_exponent
+        self.positions = {} if positions is None else positions
+        self.callback = callback
+
+        self.sensors = []
+        self.sensor_idxes = {}
+        # addr -> row, and row -> addr, None for a free row
+        self.rows = {}
+        self.addrs = []
+        self.free_rows = []
+        # Rows of the devices forgotten since the last tick, not to be reused
+        # by a device before the measurements queued for them are dropped
+        self.released_rows = []
+
+        # One row per device, one column per sensor
+        self.rssi = np.full((INITIAL_CAPACITY, 0), np.nan)
+        self.var = np.full((INITIAL_CAPACITY, 0), np.nan)
+        self.updated = np.full((INITIAL_CAPACITY, 0), -np.inf)
+        self.tx_power = np.full(INITIAL_CAPACITY, np.nan)
+        self.live = np.zeros(INITIAL_CAPACITY, dtype=bool)
+
+        # Measurements received since the last tick
+        self.pending_rows = array('l')
+        self.pending_cols = array('l')
+        self.pending_rssis = array('d')
+
+        for sensor in sensors:
+            self._sensor_idx(sensor)
+
+    def _sensor_idx(self, sensor: str) -> int:
+        idx = self.sensor_idxes.get(sensor)
+        if idx is None:
+            np = self.np
+            idx = self.sensor_idxes[sensor] = len(self.sensors)
+            self.sensors.append(sensor)
+            column = np.full((len(self.rssi), 1), np.nan)
+            self.rssi = np.hstack((self.rssi, column))
+            self.var = np.hstack((self.var, column))
+            self.updated = np.hstack((self.updated, np.full_like(column, -np.inf)))
+        return idx
+
+    def _row(self, addr: str) -> int:
+        row = self.rows.get(addr)
+        if row is not None:
+            return row
+
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.addrs[row] = addr
+        else:
+            row = len(self.addrs)
+            self.addrs.append(addr)
+            if row == len(self.rssi):
+                self._grow()
+        self.rows[addr] = row
+        self.live[row] = True
+        return row
+
+    def _grow(self):
+        np = self.np
+        capacity = len(self.rssi)
+        self.rssi = np.vstack((self.rssi, np.full_like(self.rssi, np.nan)))
+        self.var = np.vstack((self.var, np.full_like(self.var, np.nan)))
+        self.updated = np.vstack((self.updated, np.full_like(self.updated, -np.inf)))
+        self.tx_power = np.concatenate((self.tx_power, np.full(capacity, np.nan)))
+        self.live = np.concatenate((self.live, np.zeros(capacity, dtype=bool)))
+
+    def observe(self, addr: str, sensor: str, rssi: int, tx_power: int = None):
+        """Queue an RSSI measurement until the next tick.
+
+        tx_power - Tx Power Level advertised by the device, if it changed
+        """
+        row = self._row(addr)
+        if tx_power is not None:
+            self.tx_power[row] = tx_power
+        self.pending_rows.append(row)
+        self.pending_cols.append(self._sensor_idx(sensor))
+        self.pending_rssis.append(rssi)
+
+    def forget(self, addr: str):
+        """Free the row of a device no longer tracked."""
+        row = self.rows.pop(addr, None)
+        if row is None:
+            return
+        self.addrs[row] = None
+        self.live[row] = False
+        self.rssi[row] = self.np.nan
+        self.var[row] = self.np.nan
+        self.updated[row] = -self.np.inf
+        self.tx_power[row] = self.np.nan
+        self.released_rows.append(row)
+
+    def tick(self, now: float) -> ProximitySnapshot | None:
+        """Filter the measurements queued since the last tick, and return the
+        estimates of the devices they updated, None if there is none."""
+        np = self.np
+        num_sensors = len(self.sensors)
+        cells = np.array(self.pending_rows) * num_sensors + np.array(self.pending_cols)
+        rssis = np.array(self.pending_rssis)
+        del self.pending_rows[:], self.pending_cols[:], self.pending_rssis[:]
+        self.free_rows.extend(self.released_rows)
+        self.released_rows.clear()
+        if len(rssis) == 0:
+            return None
+
+        # The measurements of a device by a sensor within a tick are averaged,
+        # which also lowers their noise.
+        cells, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        z = np.bincount(inverse, weights=rssis) / counts
+        rows, cols = np.divmod(cells, num_sensors)
+        # The measurements of the devices forgotten since are dropped
+        live = self.live[rows]
+        if not live.all():
+            rows, cols, z, counts = rows[live], cols[live], z[live], counts[live]
+            if len(rows) == 0:
+                return None
+
+        x = self.rssi[rows, cols]
+        new = np.isnan(x)
+        if self.filter == 'kalman':
+            r = KALMAN_MEASUREMENT_NOISE / counts
+            p = self.var[rows, cols] + KALMAN_PROCESS_NOISE * (now - self.updated[rows, cols])
+            k = p / (p + r)
+            x = x + k * (z - x)
+            p = (1 - k) * p
+            x[new] = z[new]
+            p[new] = r[new]
+            self.var[rows, cols] = p
+        else:
+            x = x + EWMA_ALPHA * (z - x)
+            x[new] = z[new]
+        self.rssi[rows, cols] = x
+        self.updated[rows, cols] = now
+
+        snapshot = self.estimate(np.unique(rows), now)
+        if self.callback is not None:
+            self.callback(snapshot)
+        return snapshot
+
+    def estimate(self, rows, now: float) -> ProximitySnapshot:
+        """Return the estimates of the devices of rows."""
+        np = self.np
+        rssi = self.rssi[rows]
+        rssi = np.where(now - self.updated[rows] <= STALE_AFTER, rssi, np.nan)
+
+        exponent = 10 * self.pathloss_exponent
+        pathloss = self.tx_power[rows, None] - rssi
+        distance = 10 ** ((pathloss - PATHLOSS_AT_1M) / exponent)
+        # Closest by RSSI, which does not need the Tx Power Level
+        nearest = np.argmax(np.nan_to_num(rssi, nan=-np.inf), axis=1)
+
+        position = None
+        sensor_positions = np.array([self.positions.get(sensor, (np.nan, np.nan))
+                                     for sensor in self.sensors])
+        if not np.isnan(sensor_positions).all():
+            # 1 / d^2 up to a factor common to a device
+            weights = 10 ** (2 * rssi / exponent)
+            weights[:, np.isnan(sensor_positions[:, 0])] = np.nan
+            weights = np.nan_to_num(weights)
+            total = weights.sum(axis=1, keepdims=True)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                position = (weights @ np.nan_to_num(sensor_positions)) / total
+
+        return ProximitySnapshot(now, list(self.sensors), [self.addrs[row] for row in rows.tolist()],
+                                 rssi, distance, nearest, position)
+
+
+def pp_proximity(snapshot: ProximitySnapshot, limit: int = 20):
+    """Print the estimates of the limit devices closest to a sensor."""
+    import numpy as np
+
+    closest = np.nan_to_num(snapshot.rssi, nan=-np.inf).max(axis=1)
+    order = np.argsort(-closest, kind='stable')[:limit].tolist()
+
+    print("[{}] {} devices updated".format(
+        datetime.fromtimestamp(snapshot.time).strftime('%Y-%m-%d %H:%M:%S'), len(snapshot.addrs)))
+    print("{:<17} {:<8} {} {}".format('Addr', 'Nearest', ' '.join(
+        "{:>16}".format(sensor) for sensor in snapshot.sensors),
+        '' if snapshot.position is None else 'Position'))
+    for i in order:
+        cells = []
+        for rssi, distance in zip(snapshot.rssi[i].tolist(), snapshot.distance[i].tolist()):
+            if rssi != rssi:
+                cells.append("{:>16}".format('-'))
+            elif distance != distance:
+                cells.append("{:>16}".format("{:.0f} dBm".format(rssi)))
+            else:
+                cells.append("{:>16}".format("{:.0f} dBm {:.1f} m".format(rssi, distance)))
+        position = ''
+        if snapshot.position is not None and snapshot.position[i, 0] == snapshot.position[i, 0]:
+            position = "({:.1f}, {:.1f})".format(*snapshot.position[i].tolist())
+        print(blue(snapshot.addrs[i]), "{:<8}".format(snapshot.sensors[snapshot.nearest[i]]),
+              ' '.join(cells), position)
+    print()
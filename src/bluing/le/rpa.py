@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+r"""Resolvable private address (RPA) resolution
+
+An RPA is prand (24 bits, MSB 0b01) || hash (24 bits), with
+hash = ah(IRK, prand) = e(IRK, padding || prand) mod 2^24, see BLUETOOTH CORE
+SPECIFICATION Version 5.3 | Vol 3, Part H, 2.2.2 and Vol 6, Part B, 1.3.2.2.
+
+Nothing but trying every known IRK tells which one generated an RPA, so an
+address is resolved once and its result, identity or none, is cached until
+it is no longer seen, i.e. its device rotated to a new RPA. The addresses to
+resolve are batched: all their padding || prand blocks go through a single
+AES-ECB call per IRK. The IRKs that resolved recently are tried first, since
+a device rotating its RPA is usually one seen before.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from xpycommon.log import Logger
+from xpycommon.ui import red
+
+from . import LOG_LEVEL
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+IRK_SIZE = 16
+RPA_CACHE_SIZE = 10000
+# Default RPA timeout of the spec, an address not seen for that long has
+# most likely been replaced by a new one.
+RPA_CACHE_IDLE = 900 # sec
+
+
+def is_rpa(addr: str) -> bool:
+    """addr - A random address, 'XX:XX:XX:XX:XX:XX'"""
+    return int(addr[:2], 16) >> 6 == 0b01
+
+
+class Identity:
+    """A device whose IRK is known.
+
+    irk  - MSB first, the order the spec prints the keys in
+    addr - Identity address, or None if only the IRK is known
+    """
+    __slots__ = ('irk', 'addr', 'name')
+
+    def __init__(self, irk: bytes, addr: str = None, name: str = None):
+        self.irk = irk
+        self.addr = addr
+        self.name = name
+
+    def __str__(self) -> str:
+        s = self.addr if self.addr is not None else "IRK " + self.irk.hex()
+        return s if self.name is None else "{} ({})".format(s, self.name)
+
+    def to_dict(self) -> dict:
+        return {'irk': self.irk.hex(), 'addr': self.addr, 'name': self.name}
+
+
+def load_irk_file(path: str) -> list[Identity]:
+    """Load the identities of an IRK file.
+
+    Each line is IRK [IDENTITY_ADDR [NAME]], the IRK in hex, MSB first,
+    optionally separated by ':'. Empty lines and lines starting with '#' are
+    ignored.
+    """
+    identities = []
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+
+            fields = line.split(maxsplit=2)
+            try:
+                irk = bytes.fromhex(fields[0].replace(':', ''))
+                if len(irk) != IRK_SIZE:
+                    raise ValueError()
+            except ValueError:
+                raise ValueError("Invalid IRK in {}, line {}: {}".format(
+                    path, line_num, red(fields[0])))
+
+            addr = fields[1].upper() if len(fields) > 1 else None
+            if addr is not None and (len(addr) != 17 or
+                                     len(bytes.fromhex(addr.replace(':', ''))) != 6):
+                raise ValueError("Invalid identity address in {}, line {}: {}".format(
+                    path, line_num, red(fields[1])))
+
+            identities.append(Identity(irk, addr, fields[2] if len(fields) > 2 else None))
+
+    return identities
+
+
+class RpaResolver:
+    def __init__(self, identities: Iterable[Identity], cache_size: int = RPA_CACHE_SIZE,
+                 cache_idle: float = RPA_CACHE_IDLE):
+        try:
+            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        except ImportError:
+            raise RuntimeError("Resolving RPAs needs the cryptography package, "
+                               "pip install bluing[rpa]")
+
+        # IRK -> (identity, AES-ECB encryptor), most recently resolving first.
+        # An ECB encryptor keeps no state between blocks, so it is created
+        # once per IRK and reused by every batch.
+        self.keys = OrderedDict()
+        for identity in identities:
+            if identity.irk in self.keys:
+                logger.warning("Duplicate IRK {}, ignored".format(identity.irk.hex()))
+                continue
+            self.keys[identity.irk] = (
+                identity, Cipher(algorithms.AES(identity.irk), modes.ECB()).encryptor())
+
+        self.cache_size = cache_size
+        self.cache_idle = cache_idle
+        # RPA -> [identity or None, last lookup time], least recently looked up first
+        self.cache = OrderedDict()
+        # The resolver is shared by the sniffing threads
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.cache_hits = 0
+        self.aes_blocks = 0
+
+    @classmethod
+    def from_irk_file(cls, path: str) -> 'RpaResolver':
+        identities = load_irk_file(path)
+        logger.info("Loaded {} IRKs from {}".format(len(identities), path))
+        return cls(identities)
+
+    def resolve(self, addr: str) -> Identity | None:
+        """Return the identity of a random address, None if it is not an RPA
+        or no known IRK resolves it.
+
+        addr - Upper case
+        """
+        return self.resolve_many([addr])[addr]
+
+    def resolve_many(self, addrs: Iterable[str]) -> dict[str, Identity | None]:
+        """Same as resolve(), for several random addresses at once."""
+        now = time.monotonic()
+        results = {}
+        pending = []
+        with self.lock:
+            for addr in addrs:
+                if addr in results:
+                    continue
+                self.lookups += 1
+                if not is_rpa(addr):
+                    results[addr] = None
+                    continue
+
+                record = self.cache.get(addr)
+                if record is not None:
+                    self.cache_hits += 1
+                    record[1] = now
+                    self.cache.move_to_end(addr)
+                    results[addr] = record[0]
+                else:
+                    results[addr] = None
+                    pending.append(addr)
+
+            if pending:
+                for addr, identity in self._resolve(pending).items():
+                    results[addr] = identity
+                    self.cache[addr] = [identity, now]
+                self._evict(now)
+
+        return results
+
+    def _resolve(self, addrs: list[str]) -> dict[str, Identity | None]:
+        """Try the IRKs on RPAs not in the cache."""
+        results = dict.fromkeys(addrs)
+        # padding || prand of each address, and its hash
+        prands = [bytes(13) + bytes.fromhex(addr[:8].replace(':', '')) for addr in addrs]
+        hashes = [bytes.fromhex(addr[9:].replace(':', '')) for addr in addrs]
+        blocks = b''.join(prands)
+        resolving_irks = []
+
+        for irk, (identity, encryptor) in self.keys.items():
+            out = encryptor.update(blocks)
+            self.aes_blocks += len(addrs)
+
+            resolved = [i for i in range(len(addrs)) if out[16*i+13:16*i+16] == hashes[i]]
+            if not resolved:
+                continue
+
+            for i in resolved:
+                results[addrs[i]] = identity
+            resolving_irks.append(irk)
+
+            addrs = [addr for i, addr in enumerate(addrs) if i not in resolved]
+            if not addrs:
+                break
+            prands = [prand for i, prand in enumerate(prands) if i not in resolved]
+            hashes = [h for i, h in enumerate(hashes) if i not in resolved]
+            blocks = b''.join(prands)
+
+        for irk in resolving_irks:
+            self.keys.move_to_end(irk, last=False)
+
+        return results
+
+    def _evict(self, now: float):
+        while self.cache:
+            addr, (identity, last_lookup) = next(iter(self.cache.items()))
+            if now - last_lookup <= self.cache_idle and len(self.cache) <= self.cache_size:
+                break
+            self.cache.popitem(last=False)
+
+    def stats(self) -> str:
+        return "{} lookups, {} cache hits, {} AES blocks, {} IRKs, {} cached RPAs".format(
+            self.lookups, self.cache_hits, self.aes_blocks, len(self.keys), len(self.cache))
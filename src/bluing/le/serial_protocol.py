@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
+import time
+import socket
 import struct
-import threading
+import selectors
 from enum import Enum, unique
+from collections import OrderedDict
 
-from serial import Serial
+from serial import Serial, SerialException
 from xpycommon.log import Logger
 
-from .ll import pp_adv_phych_pdu
 from . import LOG_LEVEL
 
 logger = Logger(__name__, LOG_LEVEL)
@@ -31,6 +33,24 @@ class SerialCmdOpcodes(Enum):
     SNIFF_ADV = 0X0B
 
 
+SERIAL_EVT_HDR_SIZE = 3
+# Largest read from the serial device at once
+SERIAL_READ_SIZE = 4096
+# Event code -> maximum payload length. A header out of these is not one.
+MAX_EVT_PAYLOAD_LENS = {
+    SerialEvtCodes.READY.value   : 0,
+    SerialEvtCodes.ERROR.value   : 255,
+    SerialEvtCodes.ACK.value     : 255,
+    # Advertising physical channel PDU, 2 B header + 255 B payload
+    SerialEvtCodes.NEW_ADV.value : 257,
+    # SERIAL_DMSG_BUF_SIZE of the firmware
+    SerialEvtCodes.DEBUG.value   : 100,
+}
+PDU_DEDUP_SIZE = 100000
+# A PDU not sniffed for PDU_DEDUP_TTL sec is printed again when it comes back
+PDU_DEDUP_TTL = 600 # sec
+
+
 def serial_reset(dev:Serial):
     cmd = struct.pack('>BH', SerialCmdOpcodes.RESET.value, 0)
     dev.write(cmd)
@@ -41,57 +61,244 @@ def serial_sniff_adv(dev:Serial, channel:int):
     dev.write(cmd)
 
 
-class SerialEventHandler(threading.Thread):
-    adv_phych_pdu_set = set()
+class SerialFrameParser:
+    """Split the byte stream of a micro:bit into events.
+
+    An event is Event code (1 B) | Length (2 B, big endian) | Payload. The
+    stream has no sync word nor checksum, so a header is only trusted if its
+    event code is known and its length fits the event, and a NEW_ADV event if
+    its length is the one of the PDU it carries. Otherwise, e.g. on the 0x00
+    bytes Bluefruit sends around a reset or on a byte lost by the UART, the
+    parser drops one byte and tries again from the next one, until the
+    stream is back in sync.
+
+    frames        - Events parsed
+    dropped_bytes - Bytes dropped while out of sync
+    resyncs       - Times the sync was lost
+    """
+    def __init__(self):
+        # Received bytes not parsed yet, the tail of an incomplete event
+        self.buf = bytearray()
+        self.in_sync = True
+        self.frames = 0
+        self.dropped_bytes = 0
+        self.resyncs = 0
+
+    def feed(self, data: bytes) -> list[tuple[int, bytes]]:
+        """Return the (event code, payload) of the events completed by data."""
+        buf = self.buf
+        buf += data
+        events = []
+        pos = 0
+        end = len(buf)
+        while end - pos >= SERIAL_EVT_HDR_SIZE:
+            evt_code = buf[pos]
+            length = buf[pos+1] << 8 | buf[pos+2]
+            max_length = MAX_EVT_PAYLOAD_LENS.get(evt_code)
+            if max_length is not None and length <= max_length:
+                if end - pos - SERIAL_EVT_HDR_SIZE < length:
+                    break # Wait for the rest of the event
+                payload_pos = pos + SERIAL_EVT_HDR_SIZE
+                if evt_code != SerialEvtCodes.NEW_ADV.value or \
+                    (length >= 2 and buf[payload_pos+1] == length - 2):
+                    events.append((evt_code, bytes(buf[payload_pos:payload_pos+length])))
+                    pos = payload_pos + length
+                    self.in_sync = True
+                    continue
+
+            if self.in_sync:
+                self.in_sync = False
+                self.resyncs += 1
+            self.dropped_bytes += 1
+            pos += 1
+
+        del buf[:pos]
+        self.frames += len(events)
+        return events
+
+    def stats(self) -> str:
+        return "{} events, {} bytes dropped, {} resyncs".format(
+            self.frames, self.dropped_bytes, self.resyncs)
+
+
+class PduDedupCache:
+    """The advertising PDUs sniffed recently, on all the channels.
+
+    Owned by sniff_pipeline.ConsoleSink and only used from the decoding 
+    thread of the pipeline, so it takes no lock.
+
+    A PDU is recorded by its hash, a device advertising the same PDU over and
+    over keeps refreshing one entry. Entries are kept in least recently
+    sniffed order, and those not sniffed for ttl sec or beyond size are
+    evicted from the front, so memory stays bounded however long the sniff.
+    """
+    def __init__(self, size: int = PDU_DEDUP_SIZE, ttl: float = PDU_DEDUP_TTL):
+        if size <= 0:
+            raise ValueError("size must be > 0")
+        if ttl <= 0:
+            raise ValueError("ttl must be > 0")
+
+        self.size = size
+        self.ttl = ttl
+        # hash(PDU) -> last sniffed time
+        self.entries = OrderedDict()
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def seen(self, pdu: bytes, now: float = None) -> bool:
+        """Record pdu and return whether it was already sniffed within ttl sec.
+
+        pdu - Header and payload, the header holding the PDU type and the
+              payload AdvA and AdvData
+        """
+        if now is None:
+            now = time.monotonic()
+        key = hash(pdu)
+
+        self.lookups += 1
+        last_seen = self.entries.get(key)
+        hit = last_seen is not None and now - last_seen <= self.ttl
+        if hit:
+            self.hits += 1
+        if last_seen is not None:
+            # Also on an expired entry, the front must stay the oldest
+            self.entries.move_to_end(key)
+        self.entries[key] = now
+
+        while self.entries:
+            last_seen = next(iter(self.entries.values()))
+            if now - last_seen <= self.ttl and len(self.entries) <= self.size:
+                break
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return hit
 
-    def __init__(self, dev:Serial, channel:int):
+    def stats(self) -> str:
+        return "{} PDUs, {:.1%} duplicates, {} evictions, {} cached".format(
+            self.lookups, self.hits / self.lookups if self.lookups else 0,
+            self.evictions, len(self.entries))
+
+
+class SerialEventHandler:
+    def __init__(self, dev:Serial, channel:int, pipeline):
+        """
+        pipeline - sniff_pipeline.SniffPipeline the PDUs sniffed are submitted 
+                   to, shared with the handlers of the other channels
+        """
         logger.debug("SerialEventHandler, %s, channel: %d"%(dev.name, channel))
-        super().__init__()
         self.dev = dev
         self.channel = channel
+        self.pipeline = pipeline
+        self.parser = SerialFrameParser()
         serial_reset(self.dev)
 
 
-    def run(self):
-        while True:
-            header = self.dev.read(3)
-            # This is a hack to eat up 0x00 bytes that seem to get transmitted by Bluefruit
-            # before and after reset.  As 0x00 evt_code should only anve 0 length, this seems to work.
-            while ((header[0] == 0) and (header[1:] != b'\x00\x00')):
-                header = header[1:0] + self.dev.read(1)
-            evt_code, length = struct.unpack(">BH", header)
-            payload = self.dev.read(length)
-            
-            if len(payload) > 257:
-                print('Invalid payload')
-                continue
-
-            if evt_code == SerialEvtCodes.READY.value:
-                logger.info("micro:bit {} < Ready -> Start".format(self.channel))
-                # input("Start?")
-                serial_sniff_adv(self.dev, self.channel)
-            elif evt_code == SerialEvtCodes.ERROR.value:
-                print('<', SerialEvtCodes.ERROR.name, payload)
-            elif evt_code == SerialEvtCodes.ACK.value:
-                print('<', SerialEvtCodes.ACK.name, payload)
-            elif evt_code == SerialEvtCodes.DEBUG.value:
-                logger.debug("micro:bit < {}".format(payload))
-            elif evt_code == SerialEvtCodes.NEW_ADV.value:
-                # print(SerialEvtCodes.NEW_ADV.name, payload)
-                if payload not in SerialEventHandler.adv_phych_pdu_set:
-                    SerialEventHandler.adv_phych_pdu_set.add(payload)
-                    try:
-                        pp_adv_phych_pdu(payload, self.channel)
-                    except IndexError as e:
-                        logger.warning("{}, channel: {}".format(e, self.channel))
-                        continue
-
-                # for addr in addrs:
-                #     if addr['BD_ADDR'] not in public_addrs and addr['BD_ADDR'] not in random_addrs:
-                #         print(':'.join('%02X'%b for b in addr['BD_ADDR']), addr['type'])
-                #     public_addrs.add(addr['BD_ADDR']) if addr['type'] == 'public' else random_addrs.add(addr['BD_ADDR'])
-            else:
-                print('Unknown event 0x%02x'%evt_code, header)
+    def fileno(self) -> int:
+        return self.dev.fileno()
+
+    def service(self):
+        """Read and handle the events arrived, called when the device is 
+        readable so that the read does not block."""
+        data = self.dev.read(min(max(1, self.dev.in_waiting), SERIAL_READ_SIZE))
+        for evt_code, payload in self.parser.feed(data):
+            self.handle_event(evt_code, payload)
+
+    def handle_event(self, evt_code: int, payload: bytes):
+        if evt_code == SerialEvtCodes.READY.value:
+            logger.info("micro:bit {} < Ready -> Start".format(self.channel))
+            # input("Start?")
+            serial_sniff_adv(self.dev, self.channel)
+        elif evt_code == SerialEvtCodes.ERROR.value:
+            print('<', SerialEvtCodes.ERROR.name, payload)
+        elif evt_code == SerialEvtCodes.ACK.value:
+            print('<', SerialEvtCodes.ACK.name, payload)
+        elif evt_code == SerialEvtCodes.DEBUG.value:
+            logger.debug("micro:bit < {}".format(payload))
+        elif evt_code == SerialEvtCodes.NEW_ADV.value:
+            # print(SerialEvtCodes.NEW_ADV.name, payload)
+            self.pipeline.submit(self.channel, payload)
+
+            # for addr in addrs:
+            #     if addr['BD_ADDR'] not in public_addrs and addr['BD_ADDR'] not in random_addrs:
+            #         print(':'.join('%02X'%b for b in addr['BD_ADDR']), addr['type'])
+            #     public_addrs.add(addr['BD_ADDR']) if addr['type'] == 'public' else random_addrs.add(addr['BD_ADDR'])
+        else:
+            print('Unknown event 0x%02x'%evt_code, payload)
+
+
+class SerialMultiplexer:
+    """Service the serial devices of all the sniffing micro:bits from one loop.
+
+    A device is read only once the selector reports it readable, so no thread
+    blocks in read(), and the events of all channels are handled and printed
+    in the thread calling run().
+    """
+    def __init__(self, handlers: list[SerialEventHandler]):
+        self.handlers = handlers
+        self.selector = selectors.DefaultSelector()
+        self.stopped = False
+
+        # stop() wakes up the select() through this pair
+        self.wakeup_rsock, self.wakeup_wsock = socket.socketpair()
+        self.wakeup_rsock.setblocking(False)
+        self.wakeup_wsock.setblocking(False)
+        self.selector.register(self.wakeup_rsock, selectors.EVENT_READ)
+
+        for handler in handlers:
+            self.selector.register(handler, selectors.EVENT_READ, handler)
+
+    def run(self, timeout: float = None):
+        """Handle the events of the devices until stop(), timeout or none of 
+        them can be read anymore.
+
+        timeout - sec, None for no timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        # The wakeup socket is always registered
+        while not self.stopped and len(self.selector.get_map()) > 1:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+            for key, _ in self.selector.select(remaining):
+                handler = key.data
+                if handler is None:
+                    self.drain_wakeup()
+                    continue
+
+                try:
+                    handler.service()
+                except (SerialException, OSError) as e:
+                    logger.warning("micro:bit {} on channel {}: {}, stop reading it".format(
+                        handler.dev.name, handler.channel, e))
+                    self.selector.unregister(handler)
+
+    def stop(self):
+        """End run(), safe to call from another thread or a signal handler."""
+        self.stopped = True
+        try:
+            self.wakeup_wsock.send(b'\0')
+        except OSError:
+            # Full or closed, run() is being woken up or has returned anyway
+            pass
+
+    def drain_wakeup(self):
+        try:
+            while self.wakeup_rsock.recv(SERIAL_READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.selector.close()
+        self.wakeup_rsock.close()
+        self.wakeup_wsock.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+r"""Pipeline of the advertising physical channel PDUs sniffed
+
+    capture --> bounded queue --> decode --> sink, sink, ...
+
+The capture stage is the loop reading the micro:bits, it only puts the raw
+PDUs into the queue and never waits for the rest: when the queue is full,
+the drop policy discards either the PDU arriving (newest) or the one
+waiting the longest (oldest), and counts it. One thread decodes the PDUs
+and fans them out to the sinks, so a slow terminal or file only delays
+the output, not the reads of the serial devices.
+"""
+
+import time
+import queue
+import threading
+from abc import ABC, abstractmethod
+
+from xpycommon.log import Logger
+from xpycommon.ui import green
+
+from . import LOG_LEVEL
+from .ll import AdvPhychPdu, parse_adv_phych_pdu, pp_parsed_adv_phych_pdu
+from .serial_protocol import PduDedupCache
+
+
+logger = Logger(__name__, LOG_LEVEL)
+
+
+SNIFF_QUEUE_SIZE = 4096
+SNIFF_POLL_INTERVAL = 0.5 # sec
+
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+DROP_POLICIES = (DROP_NEWEST, DROP_OLDEST)
+
+
+class SniffedPdu:
+    __slots__ = ('time', 'channel', 'adv_pdu')
+
+    def __init__(self, time: float, channel: int, adv_pdu: AdvPhychPdu):
+        """
+        time - time.time() the PDU was read from the serial device
+        """
+        self.time = time
+        self.channel = channel
+        self.adv_pdu = adv_pdu
+
+    def to_dict(self) -> dict:
+        return dict(self.adv_pdu.to_dict(), record='le_adv_pdu', time=self.time,
+                    channel=self.channel)
+
+
+class SniffSink(ABC):
+    """Where the decoded PDUs go, called from the decoding thread only."""
+    @abstractmethod
+    def write(self, pdu: SniffedPdu):
+        pass
+
+    def idle(self):
+        """Called when no PDU came for SNIFF_POLL_INTERVAL sec."""
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSink(SniffSink):
+    """Print the PDUs, each PDU once until it is not sniffed for a while."""
+    def __init__(self, resolver=None, dedup: PduDedupCache = None):
+        """
+        resolver - rpa.RpaResolver, to print the identity of the RPAs sniffed
+        """
+        self.resolver = resolver
+        self.dedup = PduDedupCache() if dedup is None else dedup
+
+    def write(self, pdu: SniffedPdu):
+        if self.dedup.seen(pdu.adv_pdu.raw):
+            return
+
+        pp_parsed_adv_phych_pdu(pdu.adv_pdu, pdu.channel)
+        if self.resolver is not None:
+            self.pp_identities(pdu.adv_pdu.addrs)
+
+    def pp_identities(self, addrs: list):
+        """Print the identities of the RPAs of a PDU, resolved at once."""
+        addrs = [':'.join('%02X'%b for b in addr['BD_ADDR']) for addr in addrs
+                 if addr['type'] == 'random' and len(addr['BD_ADDR']) == 6]
+        for addr, identity in self.resolver.resolve_many(addrs).items():
+            if identity is not None:
+                print("{} -> {}".format(addr, green(str(identity))))
+
+    def close(self):
+        logger.info("PDU deduplication: {}".format(self.dedup.stats()))
+
+
+class NdjsonSink(SniffSink):
+    """Write every PDU as an le_adv_pdu record."""
+    def __init__(self, writer, resolver=None):
+        """
+        writer   - An ndjson.NdjsonWriter
+        resolver - rpa.RpaResolver, to add the identity of the RPAs sniffed
+        """
+        self.writer = writer
+        self.resolver = resolver
+
+    def write(self, pdu: SniffedPdu):
+        record = pdu.to_dict()
+        if self.resolver is not None:
+            identities = self.resolver.resolve_many(
+                addr['addr'] for addr in record['addrs'] if addr['type'] == 'random')
+            for addr in record['addrs']:
+                identity = identities.get(addr['addr'])
+                if identity is not None:
+                    addr['identity'] = identity.to_dict()
+        self.writer.write(record)
+
+    def idle(self):
+        self.writer.flush_if_due()
+
+    def close(self):
+        self.writer.flush()
+
+
+class PcapSink(SniffSink):
+    """Write every PDU to a capture file for Wireshark."""
+    def __init__(self, writer):
+        """
+        writer - A pcap.PcapWriter
+        """
+        self.writer = writer
+
+    def write(self, pdu: SniffedPdu):
+        self.writer.write(pdu.time, pdu.channel, pdu.adv_pdu.raw)
+
+    def idle(self):
+        self.writer.flush_if_due()
+
+    def close(self):
+        self.writer.close()
+        logger.info("Capture {}: {}".format(self.writer.path, self.writer.stats()))
+
+
+class StatsSink(SniffSink):
+    """Count the PDUs by channel and by PDU type."""
+    def __init__(self):
+        self.channels = {}
+        self.pdu_types = {}
+
+    def write(self, pdu: SniffedPdu):
+        self.channels[pdu.channel] = self.channels.get(pdu.channel, 0) + 1
+        name = pdu.adv_pdu.name
+        self.pdu_types[name] = self.pdu_types.get(name, 0) + 1
+
+    def stats(self) -> str:
+        return "channels: {}, PDU types: {}".format(
+            ', '.join("{} {}".format(channel, count) for channel, count
+                      in sorted(self.channels.items())) or 'none',
+            ', '.join("{} {}".format(name, count) for name, count
+                      in sorted(self.pdu_types.items(), key=lambda item: -item[1])) or 'none')
+
+    def close(self):
+        logger.info("PDUs sniffed, {}".format(self.stats()))
+
+
+class SniffPipeline:
+    def __init__(self, sinks: list[SniffSink], queue_size: int = SNIFF_QUEUE_SIZE,
+                 drop: str = DROP_NEWEST):
+        """
+        queue_size - PDUs waiting to be decoded, beyond which they are dropped
+        drop       - DROP_NEWEST or DROP_OLDEST
+        """
+        if queue_size <= 0:
+            raise ValueError("queue_size must be > 0")
+        if drop not in DROP_POLICIES:
+            raise ValueError("Unknown drop policy: {}".format(drop))
+
+        self.sinks = sinks
+        self.drop = drop
+        self.queue = queue.Queue(queue_size)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.decode, daemon=True, name='sniff-decode')
+
+        # Written by the capture stage only
+        self.captured = 0
+        self.dropped = 0
+        # Written by the decoding thread only
+        self.decoded = 0
+        self.decode_errors = 0
+        self.sink_errors = 0
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, channel: int, pdu: bytes):
+        """Queue a PDU sniffed on channel, never blocking. Called from the 
+        capture loop only."""
+        self.captured += 1
+        item = (time.time(), channel, pdu)
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            if self.drop == DROP_NEWEST:
+                self.dropped += 1
+                return
+
+        try:
+            self.queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            # Emptied by the decoding thread meanwhile
+            pass
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def decode(self):
+        while not (self.closed.is_set() and self.queue.empty()):
+            try:
+                t, channel, raw = self.queue.get(timeout=SNIFF_POLL_INTERVAL)
+            except queue.Empty:
+                for sink in self.sinks:
+                    try:
+                        sink.idle()
+                    except Exception as e:
+                        self.sink_errors += 1
+                        logger.warning("{} failed, {}: {}".format(
+                            sink.__class__.__name__, e.__class__.__name__, e))
+                continue
+
+            try:
+                pdu = SniffedPdu(t, channel, parse_adv_phych_pdu(raw))
+            except IndexError as e:
+                logger.warning("{}, channel: {}".format(e, channel))
+                self.decode_errors += 1
+                continue
+            self.decoded += 1
+
+            for sink in self.sinks:
+                try:
+                    sink.write(pdu)
+                except Exception as e:
+                    self.sink_errors += 1
+                    logger.warning("{} failed, {}: {}".format(
+                        sink.__class__.__name__, e.__class__.__name__, e))
+
+    def close(self):
+        """Decode the PDUs still queued, then close the sinks."""
+        self.closed.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self) -> str:
+        return "{} PDUs captured, {} dropped ({:.1%}, drop {}), {} decoded, " \
+               "{} decode errors, {} sink errors".format(
+                   self.captured, self.dropped,
+                   self.dropped / self.captured if self.captured else 0, self.drop,
+                   self.decoded, self.decode_errors, self.sink_errors)
@@ -3,13 +3,14 @@
 r"""
 Usage:
     bluing le [-h | --help]
-    bluing le [-i <hci>] [--scan-type=<type>] [--timeout=<sec>] [--sort=<key>] --scan
-    bluing le [-i <hci>] --pairing-feature [--timeout=<sec>] [--addr-type=<type>] PEER_ADDR
-    bluing le [-i <hci>] --ll-feature-set [--timeout=<sec>] [--addr-type=<type>] PEER_ADDR
-    bluing le [-i <hci>] --gatt [--io-cap=<name>] [--addr-type=<type>] PEER_ADDR
+    bluing le [-i <hci>] [--scan-type=<type>] [--timeout=<sec>] [--sort=<key>] [--engine=<name>] [--extended] [--ifaces=<hcis>] [--accept-list=<addrs>] [--filter-dup] [--interval=<ms>] [--window=<ms>] [--phy=<phys>] [--latency] [--irk-file=<file>] [--ndjson=<file>] --scan
+    bluing le [-i <hci>] [--scan-type=<type>] [--max-devs=<n>] [--max-idle=<sec>] [--engine=<name>] [--extended] [--ifaces=<hcis>] [--accept-list=<addrs>] [--filter-dup] [--interval=<ms>] [--window=<ms>] [--phy=<phys>] [--proximity] [--sensor-pos=<file>] [--pathloss-exp=<n>] [--irk-file=<file>] [--ndjson=<file>] --continuous --scan
+    bluing le [-i <hci>] --pairing-feature [--timeout=<sec>] [--addr-type=<type>] [--find-timeout=<sec>] [--find-accept-list] PEER_ADDR
+    bluing le [-i <hci>] --ll-feature-set [--timeout=<sec>] [--addr-type=<type>] [--find-timeout=<sec>] [--find-accept-list] PEER_ADDR
+    bluing le [-i <hci>] --gatt [--io-cap=<name>] [--ndjson=<file>] [--addr-type=<type>] [--find-timeout=<sec>] [--find-accept-list] PEER_ADDR
     bluing le [-i <hci>] --local --gatt
     bluing le [-i <hci>] --mon-incoming-conn
-    bluing le [--device=</dev/tty>] [--channel=<num>] --sniff-adv
+    bluing le [--device=</dev/tty>] [--channel=<num>] [--queue-size=<n>] [--drop=<policy>] [--irk-file=<file>] [--ndjson=<file>] [--pcap=<file>] [--rotate-size=<MB>] [--rotate-interval=<sec>] [--ring-size=<MB>] --sniff-adv
 
 Arguments:
     PEER_ADDR    LE Bluetooth device address
@@ -21,6 +22,49 @@ Options:
     --scan-type=<type>    The type of scan to perform. active or passive [default: active]
     --sort=<key>          Sort the discovered devices by key, only support RSSI 
                           now [default: rssi]
+    --engine=<name>       Scan engine. bluepy, through the bluepy-helper process, 
+                          or hci, straight on the HCI socket [default: bluepy]
+    --extended            Use extended scanning to also discover the devices 
+                          using extended advertising. Need --engine=hci and a 
+                          Bluetooth 5 controller
+    --ifaces=<hcis>       Scan on several HCI devices at once and merge what 
+                          they see, comma separated (e.g., hci0,hci1). Need 
+                          the hci engine
+    --accept-list=<addrs> Only scan for these addresses, loaded into the filter 
+                          accept list of the controller so that it ignores the 
+                          other advertisers. Comma separated, or a file of one 
+                          address per line. Need the hci engine
+    --filter-dup          Let the controller drop the duplicate advertising 
+                          reports. Need the hci engine
+    --interval=<ms>       Start scanning every <ms> ms, from 2.5 to 10240 ms, 
+                          or 40960 ms with --extended, by steps of 0.625 ms. 
+                          Need the hci engine. Defaults to the window, or 10 ms
+    --window=<ms>         Scan for <ms> ms of each interval. Need the hci 
+                          engine. Defaults to the interval, scanning all the time
+    --phy=<phys>          Primary advertising PHYs to scan on, 1m, coded or 
+                          1m,coded. The LE Coded PHY needs --extended
+    --latency             Report the time each device took to be first seen and 
+                          the share of the devices discovered over time
+    --irk-file=<file>     Resolve the resolvable private addresses seen to the 
+                          identities of known IRKs. One IRK per line, in hex 
+                          MSB first, optionally followed by the identity address 
+                          and a name. Need the cryptography package
+    --ndjson=<file>       Write the result as NDJSON, one device, service or PDU
+                          per line, to <file> or stdout if <file> is -, instead of 
+                          printing it
+    --continuous          Keep scanning until interrupted, printing devices as 
+                          they appear and disappear
+    --max-devs=<n>        Maximum number of devices tracked by a continuous scan,
+                          the least recently seen ones are dropped [default: 10000]
+    --max-idle=<sec>      Drop the devices not seen for <sec> seconds from a 
+                          continuous scan [default: 300]
+    --proximity           Smooth the RSSI of each device seen by each HCI device 
+                          of a continuous scan, and estimate its distance to 
+                          them from its Tx Power Level. Need the numpy package
+    --sensor-pos=<file>   Also estimate the position of the devices from the 
+                          positions of the HCI devices, one "hciN X Y" per line
+    --pathloss-exp=<n>    Pathloss exponent of the venue, 2 in free space, 2.7 
+                          to 3.5 indoors [default: 2]
     --ll-feature-set      Read LL FeatureSet of a remote LE device
     --pairing-feature     Request the pairing feature of a remote LE device
     --timeout=<sec>       Duration of the LE scanning, but may not be precise [default: 10]
@@ -29,14 +73,34 @@ Options:
                               DisplayOnly, DisplayYesNo, KeyboardOnly, NoInputNoOutput, 
                               KeyboardDisplay [default: NoInputNoOutput]
     --addr-type=<type>    Type of the LE address, public or random
+    --find-timeout=<sec>  Without --addr-type, scan for PEER_ADDR until it 
+                          advertises or for at most <sec> sec to determine its 
+                          address type [default: 3]
+    --find-accept-list    Only let the controller report PEER_ADDR to this scan,
+                          through its filter accept list
     --sniff-adv           Sniff advertising physical channel PDU. Need at least 
                           one micro:bit (or other supported NRF51 device specified with --device)
     --channel=<num>       LE advertising physical channel, 37, 38 or 39 [default: 37,38,39]
     --device=</dev/tty>   Device to use, comma separated (e.g., /dev/ttyUSB0,/dev/ttyUSB1,/dev/ttyUSB2)
                           Only needed if using NRF51 devices other than micro:bit (e.g., Bluefruit)
+    --queue-size=<n>      PDUs sniffed waiting to be decoded and printed, beyond 
+                          which they are dropped [default: 4096]
+    --drop=<policy>       PDU dropped when the queue is full, newest (the one 
+                          arriving) or oldest (the one waiting the longest) 
+                          [default: newest]
+    --pcap=<file>         Also write the PDUs sniffed to a capture file for 
+                          Wireshark, pcapng if <file> ends with .pcapng, pcap 
+                          otherwise
+    --rotate-size=<MB>    Start a new capture file, numbered, once the current 
+                          one reaches <MB> MB
+    --rotate-interval=<sec>  Start a new capture file, numbered, every <sec> sec
+    --ring-size=<MB>      Delete the oldest capture files to keep only the last 
+                          <MB> MB of them, rotating every <MB> / 10 MB unless 
+                          given --rotate-size
 """
 
 
+import os
 import sys
 from collections import Counter
 
@@ -47,7 +111,6 @@ from docopt import docopt
 from bthci import ADDR_TYPE_PUBLIC, ADDR_TYPE_RANDOM, HCI
 
 from . import LOG_LEVEL, PKG_NAME
-from .le_scan import LeScanner
 
 
 logger = Logger(__name__, LOG_LEVEL)
@@ -73,7 +136,21 @@ def parse_cmdline(argv: list[str] = sys.argv[1:]) -> dict:
         hci_demander_counter = Counter([args['--scan'], args['--ll-feature-set'], 
                                         args['--pairing-feature'], args['--gatt'], 
                                         args['--mon-incoming-conn']])
-        if hci_demander_counter[True] == 1:
+        if args['--ifaces'] is not None:
+            args['--ifaces'] = [iface.strip() for iface in args['--ifaces'].split(',')]
+            for iface in args['--ifaces']:
+                if not iface.startswith('hci') or not iface[3:].isdigit():
+                    raise ValueError("Invalid --ifaces: " + red(iface))
+            if len(set(args['--ifaces'])) != len(args['--ifaces']):
+                raise ValueError("Duplicate HCI device in --ifaces")
+            if args['-i'] is None:
+                args['-i'] = args['--ifaces'][0]
+
+            for iface in args['--ifaces']:
+                hci = HCI(iface)
+                hci.clean_up_running()
+                hci.close()
+        elif hci_demander_counter[True] == 1:
             if args['-i'] is None:
                 args['-i'] = HCI.get_default_iface()
            
@@ -100,6 +177,88 @@ def parse_cmdline(argv: list[str] = sys.argv[1:]) -> dict:
                 e.args = ("Invalid --timeout: " + red(args['--timeout']),)
                 raise e
 
+        args['--engine'] = args['--engine'].lower()
+        if args['--engine'] not in ('bluepy', 'hci'):
+            raise ValueError("Invalid --engine: " + red(args['--engine']))
+        if args['--extended'] and args['--engine'] != 'hci':
+            raise ValueError("--extended needs --engine=hci")
+        if args['--ifaces'] and args['--engine'] != 'hci':
+            raise ValueError("--ifaces needs --engine=hci")
+        if args['--filter-dup'] and args['--engine'] != 'hci':
+            raise ValueError("--filter-dup needs --engine=hci")
+
+        for opt in ('--interval', '--window'):
+            if args[opt] is None:
+                continue
+            if args['--engine'] != 'hci':
+                raise ValueError("{} needs --engine=hci".format(opt))
+            try:
+                # In units of 0.625 ms
+                args[opt] = round(float(args[opt]) / 0.625)
+            except ValueError as e:
+                e.args = ("Invalid {}: ".format(opt) + red(args[opt]),)
+                raise e
+        if args['--interval'] is None:
+            args['--interval'] = args['--window']
+        if args['--window'] is None:
+            args['--window'] = args['--interval']
+        if args['--interval'] is not None:
+            from .hci_scan import check_scan_timing
+            check_scan_timing(args['--interval'], args['--window'], args['--extended'])
+
+        if args['--phy'] is not None:
+            if args['--engine'] != 'hci':
+                raise ValueError("--phy needs --engine=hci")
+            phys = tuple(phy.strip().lower() for phy in args['--phy'].split(','))
+            if len(phys) == 0 or not set(phys).issubset({'1m', 'coded'}):
+                raise ValueError("Invalid --phy: " + red(args['--phy']))
+            if 'coded' in phys and not args['--extended']:
+                raise ValueError("--phy=coded needs --extended")
+            args['--phy'] = phys
+
+        try:
+            args['--pathloss-exp'] = float(args['--pathloss-exp'])
+            if args['--pathloss-exp'] <= 0:
+                raise ValueError()
+        except ValueError as e:
+            e.args = ("Invalid --pathloss-exp: " + red(str(args['--pathloss-exp'])),)
+            raise e
+        if args['--sensor-pos'] is not None and not args['--proximity']:
+            raise ValueError("--sensor-pos needs --proximity")
+
+        if args['--accept-list'] is not None:
+            if args['--engine'] != 'hci':
+                raise ValueError("--accept-list needs --engine=hci")
+            if os.path.isfile(args['--accept-list']):
+                with open(args['--accept-list']) as f:
+                    addrs = [line.split()[0] for line in f 
+                             if line.strip() and not line.lstrip().startswith('#')]
+            else:
+                addrs = [addr.strip() for addr in args['--accept-list'].split(',')]
+            for addr in addrs:
+                if not BD_ADDR.verify(addr):
+                    raise ValueError("Invalid --accept-list address: " + red(addr))
+            if len(addrs) == 0:
+                raise ValueError("Empty --accept-list: " + red(args['--accept-list']))
+            args['--accept-list'] = [addr.upper() for addr in addrs]
+
+        try:
+            args['--find-timeout'] = float(args['--find-timeout'])
+            if args['--find-timeout'] <= 0:
+                raise ValueError()
+        except ValueError as e:
+            e.args = ("Invalid --find-timeout: " + red(str(args['--find-timeout'])),)
+            raise e
+
+        for opt in ('--max-devs', '--max-idle', '--queue-size'):
+            try:
+                args[opt] = int(args[opt])
+                if args[opt] <= 0:
+                    raise ValueError()
+            except ValueError as e:
+                e.args = ("Invalid {}: ".format(opt) + red(str(args[opt])),)
+                raise e
+
         if args['--io-cap'] not in ['DisplayOnly', 'DisplayYesNo', 'KeyboardOnly', 
                                     'NoInputNoOutput', 'KeyboardDisplay']:
             raise ValueError("Invalid --io-cap: " + red(args['--io-cap']))
@@ -113,8 +272,10 @@ def parse_cmdline(argv: list[str] = sys.argv[1:]) -> dict:
                 logger.info("Automatically determining the address type of", blue(args['PEER_ADDR']))
                 
                 try:
+                    from .le_scan import LeScanner
                     args['--addr-type'] = LeScanner.determine_addr_type(
-                        args['-i'], args['PEER_ADDR'])
+                        args['-i'], args['PEER_ADDR'], args['--find-timeout'], 
+                        args['--find-accept-list'])
                     logger.info("{} is a {} address".format(
                         blue(args['PEER_ADDR']), blue(args['--addr-type'])))
                 except Exception as e:
@@ -143,6 +304,32 @@ def parse_cmdline(argv: list[str] = sys.argv[1:]) -> dict:
         if args['--device']:
             args['--device'] = set([n for n in args['--device'].split(',')])
 
+        for opt in ('--rotate-size', '--rotate-interval', '--ring-size'):
+            if args[opt] is None:
+                continue
+            try:
+                args[opt] = float(args[opt])
+                if args[opt] <= 0:
+                    raise ValueError()
+            except ValueError as e:
+                e.args = ("Invalid {}: ".format(opt) + red(str(args[opt])),)
+                raise e
+
+        if not args['--pcap'] and (args['--rotate-size'] or args['--rotate-interval'] 
+                                   or args['--ring-size']):
+            raise ValueError("--rotate-size, --rotate-interval and --ring-size need --pcap")
+        if args['--ring-size'] and args['--rotate-size'] \
+            and args['--rotate-size'] > args['--ring-size']:
+            raise ValueError("Invalid --rotate-size: " + red(str(args['--rotate-size'])) + 
+                             ", larger than --ring-size")
+        for opt in ('--rotate-size', '--ring-size'):
+            if args[opt] is not None:
+                args[opt] = round(args[opt] * 1024 * 1024)
+
+        args['--drop'] = args['--drop'].lower()
+        if args['--drop'] not in ('newest', 'oldest'):
+            raise ValueError("Invalid --drop: " + red(args['--drop']))
+
         if args['--mon-incoming-conn']:
             raise NotImplementedError("The `--mon-incoming-conn` option is not"
                                       " yet implemented")
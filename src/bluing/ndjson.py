@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+r"""Machine-readable output of the scan results
+
+Each record (an LE device, a GATT service, a BR/EDR device, an SDP record...)
+is written as one JSON object per line as soon as the scanner knows it.
+
+The records of a BufferedRecordWriter, the lines here and the packets of a
+capture file, are gathered in a buffer, written out when it is full or when
+it is older than the flush interval, so a long scan neither writes each
+record on its own nor holds its records back for long. A scanner calls
+flush_if_due() while it is idle, so the last records of a burst are not held
+back until the next one.
+"""
+
+import sys
+import json
+import time
+from uuid import UUID
+from enum import Enum
+
+
+NDJSON_BUFFER_SIZE = 64 * 1024
+NDJSON_FLUSH_INTERVAL = 1.0 # sec
+
+
+def jsonable(value):
+    """json.JSONEncoder default, for the values found in the records."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    elif isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, UUID):
+        return str(value)
+    else:
+        return str(value)
+
+
+class BufferedRecordWriter:
+    def __init__(self, file, buffer_size: int, flush_interval: float):
+        """
+        file - Binary file the records are written to, sys.stdout.buffer is
+               left open by close()
+        """
+        self.file = file
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buf = bytearray()
+        self.last_flush = time.monotonic()
+
+    def write_record(self, record: bytes):
+        self.buf += record
+        if len(self.buf) >= self.buffer_size or \
+            time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush if the flush interval has elapsed since the last flush."""
+        if self.buf and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            self.file.write(self.buf)
+            self.buf.clear()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.file is not sys.stdout.buffer:
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NdjsonWriter(BufferedRecordWriter):
+    def __init__(self, path: str = '-', buffer_size: int = NDJSON_BUFFER_SIZE,
+                 flush_interval: float = NDJSON_FLUSH_INTERVAL):
+        """
+        path - '-' for stdout
+        """
+        super().__init__(sys.stdout.buffer if path == '-' else open(path, 'wb'),
+                         buffer_size, flush_interval)
+        self.path = path
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'),
+                                        default=jsonable)
+
+    def write(self, record: dict):
+        self.write_record(self.encoder.encode(record).encode() + b'\n')
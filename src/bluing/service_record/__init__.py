@@ -1,36 +1,17 @@
 #!/usr/bin/env python
 
-import io
-import pkg_resources
 from xml.etree import ElementTree
 
 from xpycommon.ui import blue, green, yellow, red
 from xpycommon.log import DEBUG, INFO, WARNING, ERROR
 
-from .. import service_cls_profile_ids
+from ..uuid_registry import get_uuid
 
 
 __all__ = ['ag_service_record', 'hf_service_record', 'hid_service_record', 
     'mce_service_record', 'mse_service_record']
 
 
-# Only used in the ProfileDescriptorList attribute
-protocol_ids_file = pkg_resources.resource_stream(__name__, "../res/sdp_ProfileDescriptorList_protocol_ids.txt")
-protocol_ids_file = io.TextIOWrapper(protocol_ids_file)
-protocol_ids = {}
-
-for line in protocol_ids_file:
-    items = line.strip().split('\t')
-    if items[0] == 'Protocol Name':
-        continue
-    # print(items)
-    uuid = items.pop(1).lower()
-    protocol_ids[uuid] = {
-        'Name': items[0],
-        'spec': items[1]
-    }
-
-
 class ServiceRecord:
     '''SDP service record'''
 
@@ -159,6 +140,16 @@ class ServiceRecord:
         self.attr_id_bases = []
 
 
+    def to_dict(self) -> dict:
+        '''JSON serializable form of the attributes, ID -> value, see 
+        data_elem_to_jsonable().'''
+        attrs = {}
+        for attr in ElementTree.fromstring(self.record_xml).findall('./attribute'):
+            elem = attr.find('./')
+            attrs['0x%04x'%int(attr.attrib['id'][2:], base=16)] = \
+                None if elem is None else data_elem_to_jsonable(elem)
+        return {'record': 'sdp_record', 'attrs': attrs}
+
     def pp(self):
         '''Parse and print current service record.'''
         attrs = ElementTree.fromstring(self.record_xml).findall('./attribute')
@@ -277,27 +268,23 @@ class ServiceRecord:
         for uuid in uuids:
             uuid = uuid.attrib['value']
             print('\t'+uuid+':', end=' ')
-            
+
             try:
-                uuid = int(uuid[2:], base=16)
-            except ValueError: # Full UUID
-                pass
+                bt_uuid = get_uuid(uuid)
+            except ValueError:
+                self.service_clses.append(uuid)
+                print(red('unknown'))
+                continue
 
-            self.service_clses.append(uuid)
+            self.service_clses.append(uuid if bt_uuid.short is None else bt_uuid.short)
 
-            try:
-                if 'Service Class' in service_cls_profile_ids[uuid]['Allowed Usage']:
-                    name = service_cls_profile_ids[uuid]['Name']
-                    print(green(name))
-                else:
-                    print(red('unknown'))
-            except KeyError:
-                if uuid == 0x1800:
-                    print(green('Generic Access'))
-                elif uuid == 0x1801:
-                    print(green('Generic Attribute'))
-                else:
-                    print(red('unknown'))
+            if bt_uuid.category == 'Service Class' and \
+                'Service Class' in bt_uuid.info['Allowed Usage']:
+                print(green(bt_uuid.name))
+            elif bt_uuid.category == 'GATT Service': # e.g. Generic Access
+                print(green(bt_uuid.name))
+            else:
+                print(red('unknown'))
 
 
     def pp_protocol_descp_list(self, seq:ElementTree.Element):
@@ -322,8 +309,11 @@ class ServiceRecord:
             uuid = protocol.find('./uuid').attrib['value']
             print('\t'+uuid+':', end=' ')
             try:
-                name = protocol_ids[uuid]['Name']
-                
+                bt_uuid = get_uuid(uuid)
+                if bt_uuid.category != 'Protocol':
+                    raise KeyError(uuid)
+                name = bt_uuid.name
+
                 print(name)
                 # print('\t\t', protocol_ids[uuid]['Specification'])
                 if name == 'L2CAP':
@@ -351,7 +341,7 @@ class ServiceRecord:
                         s = ElementTree.tostring(elem).decode().strip().replace('\t', '').split('\n')
                         for i in s:
                             print('\t\t' + i)
-            except KeyError:
+            except (KeyError, ValueError):
                 print('(Unknown)')
 
 
@@ -416,20 +406,18 @@ class ServiceRecord:
             uuid = profile.find('./uuid').attrib['value']
             print('\t'+uuid+':', end=' ')
             try:
-                uuid = int(uuid[2:], base=16)
-            except ValueError:
-                pass
+                bt_uuid = get_uuid(uuid)
+                if bt_uuid.category != 'Service Class':
+                    raise KeyError(uuid)
 
-            try:
-                if 'Profile' in service_cls_profile_ids[uuid]['Allowed Usage']:
-                    name = service_cls_profile_ids[uuid]['Name']
-                    print(green(name), end=' ')
+                if 'Profile' in bt_uuid.info['Allowed Usage']:
+                    print(green(bt_uuid.name), end=' ')
                     # print('\t\t', service_cls_profile_ids[uuid]['Specification'])
                 else:
                     print(red('unknown'), end=' ')
                 version = int(profile.find('./uint16').attrib['value'][2:], base=16)
                 print(green('v%d.%d'%(version>>8, version&0xFF)))
-            except KeyError:
+            except (KeyError, ValueError):
                 print(red('unknown'))
 
 
@@ -456,6 +444,37 @@ class ServiceRecord:
             self.pp_protocol_descp_list(sequence)
 
 
+def data_elem_to_jsonable(elem: ElementTree.Element):
+    '''Convert a data element of the sdptool XML output. Integers are 
+    converted to int, UUIDs to their display form, sequences and alternatives 
+    to lists, the others are left as their value string.'''
+    tag = elem.tag
+    if tag in ('sequence', 'alternate'):
+        return [data_elem_to_jsonable(child) for child in elem]
+    elif tag == 'nil':
+        return None
+
+    val = elem.attrib.get('value')
+    if tag.startswith('uint'):
+        return int(val, base=16)
+    elif tag.startswith('int'):
+        if not val.lower().startswith('0x'):
+            return int(val, base=10)
+        # Hex is the two's complement of the value over the width of the tag
+        bits = int(tag[len('int'):])
+        value = int(val, base=16)
+        return value - (1 << bits) if value >> (bits - 1) else value
+    elif tag == 'uuid':
+        try:
+            return get_uuid(val).display
+        except ValueError:
+            return val
+    elif tag == 'boolean':
+        return val == 'true'
+    else:
+        return val
+
+
 def __test():
     record_xml = '''<?xml version="1.0" encoding="UTF-8" ?>
 <record>
@@ -23,6 +23,7 @@ Options:
 Commands:
     br         Basic Rate system, includes an optional Enhanced Data Rate (EDR) extension
     le         Low Energy system
+    discover   BR/EDR inquiry and LE scanning in turn on one HCI device
     android    Android Bluetooth stack
     spoof      Spoof with new local device information
     plugin     Manage plugins
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+r"""Registry of interned Bluetooth UUIDs shared by GATT, SDP and AD parsing
+
+Every form a UUID shows up in is canonicalized to a single BtUuid object:
+
+    get_uuid(0x180F)                                    # 16/32-bit int
+    get_uuid(b'\x0f\x18')                               # 2, 4 or 16 bytes, little-endian (on air)
+    get_uuid('0x180f'), get_uuid('180F')                # SDP and bluepy short forms
+    get_uuid('0000180f-0000-1000-8000-00805f9b34fb')    # full string
+    get_uuid(UUID(...)), get_uuid(0x0000180f00001000800000805f9b34fb)
+
+All of them return the same object, which carries the short form, the string
+for display and the assigned name, computed once. A form already seen costs a
+single dict lookup.
+
+Only the assigned UUIDs, a bounded set, are interned for good. The others,
+e.g. the 128-bit vendor UUIDs a long scan keeps meeting, are kept in an LRU
+cache of UUID_CACHE_SIZE forms, so they may come back as another, equal,
+object.
+"""
+
+import threading
+from uuid import UUID
+from collections import OrderedDict
+
+from .assigned_numbers import AssignedNumbers
+
+
+BT_BASE_UUID = UUID('00000000-0000-1000-8000-00805F9B34FB')
+
+UUID_CACHE_SIZE = 4096
+
+_SHORT_MASK = (1 << 96) - 1
+_BT_BASE_LOW = BT_BASE_UUID.int & _SHORT_MASK
+
+# Tables naming 16-bit and 32-bit UUIDs. Their ranges do not overlap, the
+# first one containing a UUID gives its name.
+uuid_categories = {
+    'GATT Service': AssignedNumbers('gatt-services'),
+    'GATT Characteristic': AssignedNumbers('gatt-characteristics'),
+    'GATT Descriptor': AssignedNumbers('gatt-descriptors'),
+    'GATT Declaration': AssignedNumbers('gatt-declarations'),
+    'Service Class': AssignedNumbers('service-class-profile-ids'),
+    'Protocol': AssignedNumbers('protocol-ids'),
+}
+
+
+class BtUuid:
+    """An interned Bluetooth UUID, don't instantiate it directly, use get_uuid().
+
+    int      - 128-bit value
+    uuid     - uuid.UUID
+    short    - 16-bit or 32-bit value if derived from the Bluetooth Base UUID,
+               otherwise None
+    display  - '180F', '0001FFFF' or 'E20A39F4-73F5-4BC4-A12F-17D1AD07A961'
+    category - Assigned numbers category of a short UUID, e.g. 'GATT Service',
+               or None
+    info     - Record of the category table (a dict with 'Name' ...), or None
+    name     - Assigned name, or None
+    """
+    __slots__ = ('int', 'uuid', 'short', 'display', 'category', 'info', 'name')
+
+    def __init__(self, value: int):
+        self.int = value
+        self.uuid = UUID(int=value)
+        self.category = self.info = self.name = None
+
+        if value & _SHORT_MASK == _BT_BASE_LOW:
+            self.short = value >> 96
+            self.display = '{:04X}'.format(self.short) if self.short <= 0xFFFF \
+                else '{:08X}'.format(self.short)
+
+            for category, table in uuid_categories.items():
+                try:
+                    self.info = table[self.short]
+                except KeyError:
+                    continue
+                self.category = category
+                self.name = self.info['Name']
+                break
+        else:
+            self.short = None
+            self.display = str(self.uuid).upper()
+
+    def __str__(self) -> str:
+        return self.display
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BtUuid) and self.int == other.int
+
+    def __hash__(self) -> int:
+        return hash(self.int)
+
+    def __repr__(self) -> str:
+        return "BtUuid({}{})".format(self.display,
+                                     '' if self.name is None else ', ' + self.name)
+
+
+class UuidRegistry:
+    def __init__(self, cache_size: int = UUID_CACHE_SIZE):
+        """
+        cache_size - Forms of the unassigned UUIDs kept
+        """
+        # The assigned UUIDs and their forms
+        self._by_int = {}
+        self._by_form = {}
+        # Form of an unassigned UUID -> BtUuid, least recently used first
+        self._recent = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def to_int(value) -> int:
+        """Convert any supported form of a UUID to its 128-bit value."""
+        if isinstance(value, UUID):
+            return value.int
+        elif isinstance(value, int):
+            if value < 0 or value >= 1 << 128:
+                raise ValueError("Invalid UUID: {}".format(value))
+            return value if value >> 32 else (value << 96) | _BT_BASE_LOW
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            if len(value) not in (2, 4, 16):
+                raise ValueError("Invalid UUID length: {}".format(len(value)))
+            value = int.from_bytes(value, 'little')
+            return value if value >> 32 else (value << 96) | _BT_BASE_LOW
+        elif isinstance(value, str):
+            if len(value) == 36:
+                return UUID(value).int
+            short = int(value, base=16)
+            if short >> 32:
+                raise ValueError("Invalid UUID: {}".format(value))
+            return (short << 96) | _BT_BASE_LOW
+        else:
+            raise TypeError("Unsupported UUID form: {}".format(type(value).__name__))
+
+    def get(self, value) -> BtUuid:
+        """Return the interned BtUuid of a UUID in any supported form.
+
+        Raise ValueError or TypeError for an invalid UUID.
+        """
+        if isinstance(value, (bytearray, memoryview)):
+            value = bytes(value)
+
+        try:
+            return self._by_form[value]
+        except KeyError:
+            pass
+
+        with self.lock:
+            bt_uuid = self._recent.get(value)
+            if bt_uuid is not None:
+                self._recent.move_to_end(value)
+                return bt_uuid
+
+        full = self.to_int(value)
+        bt_uuid = self._by_int.get(full)
+        if bt_uuid is None:
+            bt_uuid = BtUuid(full)
+            if bt_uuid.name is not None:
+                self._by_int[full] = bt_uuid
+
+        if bt_uuid.name is not None:
+            self._by_form[value] = bt_uuid
+        else:
+            with self.lock:
+                self._recent[value] = bt_uuid
+                if len(self._recent) > self.cache_size:
+                    self._recent.popitem(last=False)
+        return bt_uuid
+
+
+uuid_registry = UuidRegistry()
+get_uuid = uuid_registry.get